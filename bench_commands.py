@@ -0,0 +1,428 @@
+import argparse, asyncio, glob, itertools, json, os, random, resource, statistics, tempfile, time
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import urlparse
+from aiohttp import web
+
+##### END-TO-END COMMAND BENCHMARK #####
+# Serves NOAA datagetter/mdapi, api.weather.gov and Nominatim responses from a local stub
+# with injected latency, then drives the GetDiveWeather fetchers and the slash-command
+# handlers at a fixed concurrency. By default the payloads are synthetic: the right shape
+# for every route, so the caches, coalescing and deadlines are exercised, but not NOAA's
+# real payload sizes or parse cost. --replay serves the responses record_noaa_fixtures.py
+# saved under fixtures/upstream instead (none are committed yet; record them first), with
+# tide predictions for dates that weren't recorded computed from the recorded constants.
+#     python bench_commands.py --latency 150 --concurrency 20 -n 400
+#     python bench_commands.py --scenario report --scenario cmd_weather --places 5
+#     python record_noaa_fixtures.py && python bench_commands.py --replay
+# The stub runs in the same process, so its (small) CPU time is part of the measurement.
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "harmonics")
+UPSTREAM_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "upstream")
+METHOD_SCENARIOS = ("geocode", "tides", "water_temp", "forecast", "currents", "report")
+COMMAND_SCENARIOS = ("cmd_weather", "cmd_guide", "cmd_component")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark DiveBot's fetchers and slash commands against a local NOAA/NWS stand-in")
+    parser.add_argument("-n", "--requests", help="Requests per scenario", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", help="Requests in flight at once", type=int, default=10)
+    parser.add_argument("--latency", help="Injected upstream latency (ms)", type=float, default=100)
+    parser.add_argument("--jitter", help="Uniform ± jitter on the latency (ms)", type=float, default=0)
+    parser.add_argument("--places", help="Distinct places requests are spread over (fewer = warmer caches)", type=int, default=20)
+    parser.add_argument("--forecast-max-age", help="Cache-Control max-age on forecasts (s)", type=int, default=600)
+    parser.add_argument("--scenario", action="append", choices=METHOD_SCENARIOS + COMMAND_SCENARIOS,
+                        help="Run only these scenarios (repeatable); default is all of them")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--replay", action="store_true", help="Serve the responses in fixtures/upstream instead of synthetic payloads")
+    return parser.parse_args()
+
+
+def recorded_constants():
+    """Station id -> mdapi constants from every fixture recorded by record_noaa_fixtures.py"""
+    constants = {}
+    for path in glob.glob(os.path.join(FIXTURE_DIR, "*.json")):
+        with open(path) as f:
+            constants.update(json.load(f)["constants"])
+    return constants
+
+
+def recorded_upstream():
+    """Every response recorded for the benchmark's places, merged into one replay table"""
+    recordings = {"places": [], "nominatim": {}, "datagetter": {}, "points": {}, "forecast": {}}
+    for path in sorted(glob.glob(os.path.join(UPSTREAM_FIXTURE_DIR, "*.json"))):
+        with open(path) as f:
+            fixture = json.load(f)
+        city, state = fixture["place"]
+        recordings["places"].append((city, state))
+        recordings["nominatim"][city.lower()] = fixture["nominatim"]
+        for route in ("datagetter", "points", "forecast"):
+            recordings[route].update(fixture[route])
+    return recordings
+
+
+def synthetic_constants(station_id):
+    """Plausible semidiurnal harmonics, phased per station so sites don't all peak together"""
+    shift = int(station_id) % 360 if str(station_id).isdigit() else 0
+    harcon = [{"name": name, "amplitude": amplitude, "phase_GMT": (phase + shift) % 360}
+              for name, amplitude, phase in (("M2", 1.2, 40.0), ("S2", 0.3, 60.0), ("N2", 0.25, 20.0), ("K1", 0.5, 180.0), ("O1", 0.4, 170.0))]
+    return {"type": "R", "harcon": {"HarmonicConstituents": harcon},
+            "datums": {"datums": [{"name": "MSL", "value": 1.4}, {"name": "MLLW", "value": 0.0}]}}
+
+
+##### STUB UPSTREAM #####
+NOT_RECORDED = {"error": {"message": "No data was found. This product may not be offered at this station at the requested time."}}
+
+
+class StubUpstream:
+    def __init__(self, latency_ms, jitter_ms, places, tz_for, forecast_max_age, recordings=None):
+        from cache import TTLCache
+        from harmonics import HarmonicPredictor
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.places = places  # lowercased city -> (lat, lng)
+        self.tz_for = tz_for
+        self.forecast_max_age = forecast_max_age
+        # None: synthesize every payload (the default, without --replay)
+        self.recordings = recordings
+        self.recorded = recorded_constants()
+        self.predictor = HarmonicPredictor(TTLCache("stub_constants", default_ttl=86400))
+        self.predictions = {}
+        self.calls = Counter()
+        self.runner = None
+        self.base = None
+
+    async def delay(self, route):
+        self.calls[route] += 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def replay(self, route, key):
+        """The recorded body for key, or None (counted, so gaps in the recording show up)"""
+        if self.recordings is None:
+            return None
+        body = self.recordings[route].get(key)
+        if body is None:
+            self.calls[f"unrecorded:{route}"] += 1
+        return body
+
+    def constants(self, station_id):
+        if self.recordings is None:
+            return self.recorded.get(str(station_id)) or synthetic_constants(station_id)
+        return self.recorded.get(str(station_id))
+
+    def tide_predictions(self, station_id, begin_date, end_date):
+        key = (station_id, begin_date, end_date)
+        if key not in self.predictions:
+            if self.predictor.constants(station_id) is None:
+                if self.constants(station_id) is None:
+                    return NOT_RECORDED
+                self.predictor.cache.set(str(station_id), self.constants(station_id))
+            tz = self.tz_for(station_id)
+            begin = tz.localize(datetime.strptime(begin_date, '%Y%m%d'))
+            end = tz.localize(datetime.strptime(end_date, '%Y%m%d') + timedelta(days=1))
+            predicted = self.predictor.predict(station_id, begin.timestamp(), end.timestamp(), tz) or {"predictions": []}
+            self.predictions[key] = {"predictions": predicted["predictions"]}
+        return self.predictions[key]
+
+    async def datagetter(self, request):
+        query = request.query
+        product, station_id = query.get("product"), query.get("station")
+        await self.delay(f"datagetter:{product}")
+        key = f"{product}:{station_id}" + (f":{query.get('bin')}" if product == "currents_predictions" else "")
+        if self.recordings is not None:
+            recorded = self.replay("datagetter", key)
+            if recorded is None and product == "predictions":
+                return web.json_response(self.tide_predictions(station_id, query["begin_date"], query["end_date"]))
+            return web.json_response(recorded if recorded is not None else NOT_RECORDED)
+        if product == "predictions":
+            return web.json_response(self.tide_predictions(station_id, query["begin_date"], query["end_date"]))
+        if product == "water_temperature":
+            local = datetime.now(self.tz_for(station_id)) - timedelta(minutes=6)
+            value = 70 + int(station_id) % 15 if station_id.isdigit() else 75
+            return web.json_response({"metadata": {"id": station_id}, "data": [{"t": local.strftime('%Y-%m-%d %H:%M'), "v": f"{value:.1f}", "f": "0,0,0"}]})
+        if product == "currents_predictions":
+            day = datetime.strptime(query["begin_date"], '%Y%m%d')
+            events = [("slack", 0.0), ("flood", 1.6), ("slack", 0.0), ("ebb", -1.9)] * 2
+            cp = [{"Time": (day + timedelta(hours=1.5 + 3.1 * i)).strftime('%Y-%m-%d %H:%M'), "Type": kind, "Velocity_Major": speed,
+                   "meanFloodDir": 70, "meanEbbDir": 250, "Bin": query.get("bin", "1")} for i, (kind, speed) in enumerate(events)]
+            return web.json_response({"current_predictions": {"cp": cp}})
+        return web.json_response(NOT_RECORDED)
+
+    async def mdapi(self, request):
+        await self.delay("mdapi")
+        station_id, resource = request.match_info["station"], request.match_info["resource"]
+        constants = self.constants(station_id) or {}
+        if resource == "tidepredoffsets" and constants:
+            return web.json_response(constants.get("offsets") or {"type": "R", "refStationId": station_id})
+        if resource in constants:
+            return web.json_response(constants[resource])
+        return web.Response(status=404)
+
+    async def points(self, request):
+        await self.delay("nws_points")
+        coords = request.match_info["coords"]
+        if self.recordings is not None:
+            recorded = self.replay("points", coords)
+            if recorded is None:
+                return web.json_response({"status": 404, "detail": "Unable to provide data for requested point"}, status=404)
+            # Point the recorded gridpoint URL at the stub
+            forecast = urlparse(recorded["properties"]["forecast"]).path
+            return web.json_response({**recorded, "properties": {**recorded["properties"], "forecast": self.base + forecast}},
+                                     content_type="application/geo+json")
+        lat, lng = (float(part) for part in coords.split(","))
+        # One grid cell per ~2.5 km, as NWS does
+        cell = f"{round(lat * 40)},{round(lng * 40)}"
+        return web.json_response({"properties": {"forecast": f"{self.base}/gridpoints/STB/{cell}/forecast"}},
+                                 content_type="application/geo+json")
+
+    async def forecast(self, request):
+        await self.delay("nws_forecast")
+        if self.recordings is not None:
+            recorded = self.replay("forecast", request.path)
+            if recorded is None:
+                return web.json_response({"status": 404, "detail": "Unknown gridpoint"}, status=404)
+            etag, body = recorded["etag"] or f'"{request.path}"', recorded["body"]
+        else:
+            etag = f'"{request.match_info["cell"]}-v1"'
+            body = {"properties": {"periods": [
+                {"number": i + 1, "name": name, "temperature": 84 - 8 * (i % 2), "temperatureUnit": "F",
+                 "windSpeed": f"{5 + 3 * i} mph", "windDirection": "E", "shortForecast": "Mostly Sunny",
+                 "detailedForecast": "Mostly sunny, with a high near 84."}
+                for i, name in enumerate(("Today", "Tonight", "Tomorrow", "Tomorrow Night"))]}}
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={self.forecast_max_age}"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.json_response(body, content_type="application/geo+json", headers=headers)
+
+    async def search(self, request):
+        await self.delay("nominatim")
+        city = request.query.get("q", "").rsplit(",", 1)[0].strip().lower()
+        if self.recordings is not None:
+            return web.json_response(self.replay("nominatim", city) or [])
+        if city not in self.places:
+            return web.json_response([])
+        lat, lng = self.places[city]
+        return web.json_response([{"lat": str(lat), "lon": str(lng), "display_name": request.query["q"], "place_id": 1}])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/datagetter", self.datagetter)
+        app.router.add_get("/mdapi/{station}/{resource}.json", self.mdapi)
+        app.router.add_get("/points/{coords}", self.points)
+        app.router.add_get("/gridpoints/{office}/{cell}/forecast", self.forecast)
+        app.router.add_get("/search", self.search)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        self.base = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+        return self.base
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+##### FAKE INTERACTIONS #####
+_message_ids = itertools.count(1_000_000)
+
+
+class FakeMessage:
+    def __init__(self, content=None):
+        self.id = next(_message_ids)
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    id = 1
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(content)
+
+
+class FakeContext:
+    """Just enough of an interactions SlashContext/ComponentContext for divebot's handlers"""
+
+    def __init__(self, user, custom_id=None, message=None):
+        self.author = SimpleNamespace(nickname=user, mention=f"<@{user}>", id=hash(user) & 0xFFFFFFFF)
+        self.custom_id = custom_id
+        self.message = message
+        self.message_id = message.id if message else None
+        self.sent = []
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+        return FakeMessage(content)
+
+
+def handler(command):
+    # slash_command/listen wrap the coroutine function; the wrapper keeps it as .callback
+    return getattr(command, "callback", command)
+
+
+##### RUNNER #####
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_scenario(name, job, places, requests, concurrency, stub, w):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], Counter()
+    stub.calls.clear()
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await job(i, places[i % len(places)])
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    # Harmonic constants are fetched in the background after a live answer; bill them here
+    await asyncio.gather(*w._background, return_exceptions=True)
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1),
+        "errors": dict(errors),
+        "upstream_calls": dict(sorted(stub.calls.items())),
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def print_result(result):
+    print(f"{result['scenario']:<14} {result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>7.1f}  "
+          f"p95 {result['p95_ms']:>7.1f}  p99 {result['p99_ms']:>7.1f} ms  peak RSS {result['peak_rss_kib'] / 1024:>6.1f} MiB")
+    calls = ", ".join(f"{route}={count}" for route, count in result["upstream_calls"].items()) or "none"
+    print(f"{'':<14} upstream: {calls}" + (f"  errors: {result['errors']}" if result["errors"] else ""))
+
+
+async def main(args):
+    # Only the modules' own caches are exercised, never the bot's on-disk ones
+    scratch = tempfile.mkdtemp(prefix="divebot-bench-")
+    for setting in ("GEOCODE_CACHE_PATH", "NWS_CACHE_PATH", "HARMONICS_CACHE_PATH", "GUIDE_STORE_PATH"):
+        os.environ[setting] = os.path.join(scratch, f"{setting.lower()}.sqlite3")
+    os.environ["METRICS_PORT"] = "0"
+
+    import geocache, harmonics, weather
+    from pipeline import ReportPipeline
+    w = weather.GetDiveWeather()
+
+    if not args.replay:
+        stations = [station for station in w.catalog.stations("tidepredictions") if station.state and len(station.state) == 2]
+        chosen = random.sample(stations, min(args.places, len(stations)))
+        # Nudged off the station so the nearest-station scan has work to do
+        coords = {station.name.lower(): (station.lat + 0.01, station.lng + 0.01) for station in chosen}
+        places = [(station.name, station.state) for station in chosen]
+        recordings = None
+    else:
+        recordings = recorded_upstream()
+        if not recordings["places"]:
+            raise SystemExit(f"--replay needs recorded upstream responses in {UPSTREAM_FIXTURE_DIR}; "
+                             "run python record_noaa_fixtures.py first, or drop --replay for synthetic payloads.")
+        places, coords = recordings["places"][:args.places], {}
+
+    stub = StubUpstream(args.latency, args.jitter, coords, lambda station_id: w.station_timezone(w.catalog.get(station_id)),
+                        args.forecast_max_age, recordings)
+    base = await stub.start()
+    weather.BASE_URL = weather.WATER_TEMP_URL = f"{base}/datagetter"
+    weather.BASE_NWS_URL = base
+    harmonics.MDAPI_URL = f"{base}/mdapi"
+    geocache.NOMINATIM_DOMAIN, geocache.NOMINATIM_SCHEME = base.split("://")[1], "http"
+
+    pipeline = ReportPipeline(w)
+
+    async def station_for(place):
+        lat, lng = await w.fetch_lat_long_for_city_async(*place)
+        return w.index.nearest_with_fallback(lat, lng)[0], lat, lng
+
+    async def tides(i, place):
+        station, _, _ = await station_for(place)
+        await w.fetch_tide_predictions_async(station.id)
+
+    async def water_temp(i, place):
+        station, _, _ = await station_for(place)
+        await w.fetch_water_temperature_async(station.id)
+
+    async def forecast(i, place):
+        _, lat, lng = await station_for(place)
+        await w.forecast_for_coords_async(lat, lng)
+
+    jobs = {
+        "geocode": lambda i, place: w.fetch_lat_long_for_city_async(*place),
+        "tides": tides,
+        "water_temp": water_temp,
+        "forecast": forecast,
+        "currents": lambda i, place: pipeline.run_currents(*place),
+        "report": lambda i, place: pipeline.run(*place),
+    }
+
+    wanted = args.scenario or list(METHOD_SCENARIOS + COMMAND_SCENARIOS)
+    if any(name in COMMAND_SCENARIOS for name in wanted):
+        try:
+            import divebot
+        except ImportError as e:
+            print(f"Skipping the slash-command scenarios: {e}\n")
+            wanted = [name for name in wanted if name not in COMMAND_SCENARIOS]
+        else:
+            divebot.bot.get_channel = lambda channel_id: FakeChannel()
+            requests_posted = []
+
+            async def cmd_weather(i, place):
+                await handler(divebot.weather)(FakeContext(f"diver{i}"), city=place[0], state=place[1])
+
+            async def cmd_guide(i, place):
+                await handler(divebot.guide)(FakeContext(f"diver{i}"), location=place[0], date="Saturday", time="09:00")
+
+            async def cmd_component(i, place):
+                # A burst of sign-ups and withdrawals on a handful of guide requests
+                if len(requests_posted) < 5:
+                    message = await FakeChannel().send(f"diver has requested a guided dive at {place[0]}!")
+                    divebot.guide_store.create(message.id, place[0], requester="diver")
+                    requests_posted.append(message)
+                message = requests_posted[i % len(requests_posted)]
+                ctx = FakeContext(f"guide{i % 7}", custom_id="guide_yes" if i % 3 else "guide_no", message=message)
+                await handler(divebot.on_component)(SimpleNamespace(ctx=ctx))
+
+            jobs.update({"cmd_weather": cmd_weather, "cmd_guide": cmd_guide, "cmd_component": cmd_component})
+
+    if not args.json:
+        print(f"{len(places)} places, {args.requests} requests per scenario, concurrency {args.concurrency}, "
+              f"upstream latency {args.latency:.0f}±{args.jitter:.0f} ms, "
+              + ("SYNTHETIC payloads\n" if recordings is None else f"replaying {len(places)} recorded places\n"))
+    try:
+        for name in wanted:
+            result = await run_scenario(name, jobs[name], places, args.requests, args.concurrency, stub, w)
+            if name == "cmd_component":
+                # Edits are debounced; count the time it takes them to go out
+                await divebot.guide_edits.drain()
+                result["edits"] = divebot.guide_edits.stats()
+            print(json.dumps(result)) if args.json else print_result(result)
+    finally:
+        await asyncio.gather(*w._background, return_exceptions=True)
+        await w.http.close()
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    random.seed(args.seed)
+    asyncio.run(main(args))
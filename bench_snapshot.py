@@ -0,0 +1,69 @@
+import argparse, json, os, resource, statistics, subprocess, sys, time
+
+##### STARTUP BENCHMARK: JSON LOADERS VS. MAPPED SNAPSHOT #####
+# Each mode runs in a fresh interpreter so start-up cost and RSS aren't shared between them.
+#     python snapshot.py && python bench_snapshot.py
+
+MODES = {
+    "weather.py JSON loaders": "weather_json",
+    "StationCatalog (6 JSON files)": "catalog_json",
+    "StationCatalog + first lookup": "catalog_json_query",
+    "SnapshotCatalog (mmap)": "snapshot",
+    "SnapshotCatalog + first lookup": "snapshot_query",
+}
+
+
+def rss_kib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def run_mode(mode):
+    # Import everything up front so only the loading itself is measured
+    from weather import GetDiveWeather
+    from stations import StationCatalog
+    from snapshot import SnapshotCatalog
+    from spatial import StationIndex
+
+    rss_before = rss_kib()
+    start = time.perf_counter()
+    if mode == "weather_json":
+        w = GetDiveWeather.__new__(GetDiveWeather)
+        loaded = (w.load_stations_from_file(), w.load__oceanographic_stations_from_file())
+    elif mode.startswith("catalog_json"):
+        loaded = StationCatalog().load()
+    else:
+        loaded = SnapshotCatalog()
+    if mode.endswith("_query"):
+        StationIndex(loaded).nearest_with_fallback(25.08, -80.45)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "ms": elapsed * 1000,
+        "rss_kib": rss_kib() - rss_before,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare station start-up cost of the JSON loaders and the snapshot")
+    parser.add_argument("-r", "--runs", type=int, default=5)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode)
+        sys.exit(0)
+
+    from snapshot import snapshot_is_current
+    if not snapshot_is_current():
+        sys.exit("Snapshot missing or older than the JSON files; run `python snapshot.py` first.")
+
+    print(f"{'mode':<32} {'load ms':>9} {'RSS +KiB':>10} {'peak RSS KiB':>13}")
+    for label, mode in MODES.items():
+        results = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, __file__, "--mode", mode], capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        print(f"{label:<32} {statistics.median(r['ms'] for r in results):>9.1f} "
+              f"{statistics.median(r['rss_kib'] for r in results):>10.0f} "
+              f"{statistics.median(r['peak_rss_kib'] for r in results):>13.0f}")
@@ -0,0 +1,109 @@
+import argparse, json, random, time
+from weather import GetDiveWeather
+from spatial import StationIndex
+from stations import get_catalog
+
+##### NEAREST-STATION BENCHMARK #####
+# Compares the original get_nearest_station linear scan (JSON reload + scalar
+# haversine over every station) with the shared catalog, the grid index and
+# the NumPy batch API.
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark nearest NOAA station lookups")
+    parser.add_argument("-n", "--queries", help="Number of random query points", type=int, default=500)
+    parser.add_argument("-k", help="Stations per query for the k-nearest run", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def linear_scan(w, lat, lng, threshold_distance=50):
+    """The pre-catalog implementation of get_nearest_station, minus the geocoder"""
+    with open("noaa_stations_tidepredictions.json", "r") as file:
+        all_noaa_stations = json.load(file)
+    with open("noaa_stations_physocean.json", "r") as file:
+        all_physocean_stations = json.load(file)
+
+    nearest_station_id = None
+    nearest_distance = float('inf')
+    for station in all_physocean_stations:
+        distance = w.haversine_distance(lat, lng, station['lat'], station['lng'])
+        if distance < nearest_distance:
+            nearest_distance = distance
+            nearest_station_id = station['id']
+    if not nearest_station_id or nearest_distance > threshold_distance:
+        for station in all_noaa_stations:
+            distance = w.haversine_distance(lat, lng, station['lat'], station['lng'])
+            if distance < nearest_distance:
+                nearest_distance = distance
+                nearest_station_id = station['id']
+    return nearest_station_id, nearest_distance
+
+
+def linear_scan_catalog(w, catalog, lat, lng, threshold_distance=50):
+    """Same scan, but over the already-parsed catalog"""
+    nearest_station_id = None
+    nearest_distance = float('inf')
+    for station in catalog.stations("physocean"):
+        distance = w.haversine_distance(lat, lng, station.lat, station.lng)
+        if distance < nearest_distance:
+            nearest_distance, nearest_station_id = distance, station.id
+    if not nearest_station_id or nearest_distance > threshold_distance:
+        for station in catalog.stations("tidepredictions"):
+            distance = w.haversine_distance(lat, lng, station.lat, station.lng)
+            if distance < nearest_distance:
+                nearest_distance, nearest_station_id = distance, station.id
+    return nearest_station_id, nearest_distance
+
+
+def timed(label, fn, points):
+    start = time.perf_counter()
+    results = [fn(lat, lng) for lat, lng in points]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed * 1000 / len(points):>10.3f} ms/query")
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    random.seed(args.seed)
+    catalog = get_catalog()
+    w = GetDiveWeather()
+    stations = catalog.stations("tidepredictions")
+
+    # Query near real stations (dive sites are coastal) plus a few open-ocean points
+    points = []
+    for _ in range(args.queries):
+        if random.random() < 0.9:
+            station = random.choice(stations)
+            points.append((station.lat + random.uniform(-0.5, 0.5), station.lng + random.uniform(-0.5, 0.5)))
+        else:
+            points.append((random.uniform(-20, 65), random.uniform(-180, -60)))
+
+    build_start = time.perf_counter()
+    index = StationIndex(catalog)
+    for product in ("physocean", "tidepredictions"):
+        index._grid(product)
+    print(f"Catalog load: {catalog.load_time * 1000:.1f} ms, index build: {(time.perf_counter() - build_start) * 1000:.1f} ms\n")
+
+    linear_points = points[:max(1, args.queries // 10)]
+    baseline = timed("linear scan (JSON reload per query)", lambda lat, lng: linear_scan(w, lat, lng), linear_points)
+    scanned = timed("linear scan (shared catalog)", lambda lat, lng: linear_scan_catalog(w, catalog, lat, lng), points)
+    indexed = timed("grid index (physocean-first)", lambda lat, lng: index.nearest_with_fallback(lat, lng), points)
+    timed(f"grid index ({args.k} nearest within 100 km)", lambda lat, lng: index.nearest(lat, lng, k=args.k, radius_km=100, product="tidepredictions"), points)
+
+    batch_start = time.perf_counter()
+    lats, lngs = zip(*points)
+    batch_ids, batch_distances = w.get_nearest_stations_batch(lats, lngs)
+    print(f"{'numpy batch (physocean-first)':<36} {(time.perf_counter() - batch_start) * 1000 / len(points):>10.3f} ms/query")
+
+    mismatches = 0
+    for (scan_id, scan_distance), batch_id, batch_distance in zip(scanned, batch_ids, batch_distances):
+        if batch_id != scan_id and abs(batch_distance - scan_distance) > 1e-9:
+            mismatches += 1
+    for (scan_id, scan_distance), (station, distance) in zip(scanned, indexed):
+        if station is None or (station.id != scan_id and abs(distance - scan_distance) > 1e-9):
+            mismatches += 1
+    for (scan_id, _), (catalog_id, _) in zip(baseline, scanned):
+        if scan_id != catalog_id:
+            mismatches += 1
+    print(f"\nResult mismatches vs. linear scan: {mismatches}")
@@ -0,0 +1,117 @@
+import os, threading, time
+from collections import deque
+import aiohttp, requests
+
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE") or 0.5)
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS") or 5)         # don't judge an upstream on one bad request
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW") or 20)              # most recent calls the failure rate is taken over
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS") or 5)  # slower answers count as failures
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS") or 30)  # wait before letting a probe through
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError, requests.ConnectionError):
+    """Raised instead of sending a request to an upstream whose circuit is open. It is both an
+    aiohttp and a requests connection error, so every existing fallback already handles it."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is failing; circuit open for another {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+##### CIRCUIT BREAKER #####
+class CircuitBreaker:
+    """Closed: requests flow and outcomes are recorded. Open (too many recent failures or slow
+    answers): requests fail immediately for `open_seconds`. Half-open: one probe goes out;
+    success closes the circuit, failure opens it again."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_rate=BREAKER_FAILURE_RATE, min_calls=BREAKER_MIN_CALLS, window=BREAKER_WINDOW,
+                 slow_seconds=BREAKER_SLOW_SECONDS, open_seconds=BREAKER_OPEN_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.outcomes = deque(maxlen=window)  # True for a failed or slow call
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpenError unless a request may go out now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.open_seconds - (self.clock() - self.opened_at)
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state, self.probing = self.HALF_OPEN, False
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0)
+                self.probing = True
+
+    def record(self, failed, elapsed=0.0):
+        failed = failed or elapsed > self.slow_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self._open("probe failed")
+                else:
+                    self.state = self.CLOSED
+                    print(f"Circuit for {self.name} closed")
+                return
+            self.outcomes.append(failed)
+            failures = sum(self.outcomes)
+            if self.state == self.CLOSED and len(self.outcomes) >= self.min_calls and failures >= self.failure_rate * len(self.outcomes):
+                self._open(f"{failures} of the last {len(self.outcomes)} calls failed or took over {self.slow_seconds:g}s")
+
+    def _open(self, reason):
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.opened += 1
+        self.outcomes.clear()
+        print(f"Circuit for {self.name} opened for {self.open_seconds:g}s: {reason}")
+
+    @property
+    def degraded(self):
+        return self.state != self.CLOSED
+
+    def stats(self):
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected,
+                "recent_failures": sum(self.outcomes), "recent_calls": len(self.outcomes)}
+
+
+class BreakerRegistry:
+    """One breaker per upstream host, shared by the async client and the sync fallbacks"""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, **self.settings)
+            return self.breakers[host]
+
+    def stats(self):
+        return {host: breaker.stats() for host, breaker in self.breakers.items()}
+
+
+_breakers = None
+
+def get_breakers():
+    global _breakers
+    if _breakers is None:
+        _breakers = BreakerRegistry()
+    return _breakers
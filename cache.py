@@ -0,0 +1,416 @@
+import asyncio, json, os, secrets, socket, sqlite3, threading, time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# Shared cache tier for running several bot processes: sqlite:///path/to/file or redis://host:port/db
+CACHE_URL = os.getenv("CACHE_URL") or ""
+CACHE_STORE_TIMEOUT = float(os.getenv("CACHE_STORE_TIMEOUT") or 0.25)  # longest a command waits on the store
+CACHE_STORE_RETRY = float(os.getenv("CACHE_STORE_RETRY") or 10)       # memory only for this long after a store failure
+
+
+##### PERSISTENT BACKING STORE #####
+class SqliteStore:
+    """Optional disk tier for TTLCache: JSON values with an absolute expiry, one table per cache"""
+
+    def __init__(self, path, table="cache"):
+        self.path = path
+        self.table = table
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        # WAL: several bot processes can share the file, readers never wait behind a writer
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache_leases (key TEXT PRIMARY KEY, expires REAL, owner TEXT)")
+        if "owner" not in [column[1] for column in self.db.execute("PRAGMA table_info(cache_leases)")]:
+            self.db.execute("ALTER TABLE cache_leases ADD COLUMN owner TEXT")
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row = self.db.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self.db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)", (key, json.dumps(value), expires))
+            self.db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self.db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.db.commit()
+
+    def purge_expired(self, now=None):
+        with self._lock:
+            self.db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now or time.time(),))
+            self.db.commit()
+
+    def lease(self, key, seconds, owner):
+        """True if owner now holds key's lease (nobody else does, or theirs lapsed)"""
+        now = time.time()
+        key = f"{self.table}:{key}"
+        with self._lock:
+            self.db.execute("DELETE FROM cache_leases WHERE key = ? AND expires <= ?", (key, now))
+            taken = self.db.execute("INSERT OR IGNORE INTO cache_leases (key, expires, owner) VALUES (?, ?, ?)",
+                                    (key, now + seconds, owner)).rowcount == 1
+            self.db.commit()
+        return taken
+
+    def release(self, key, owner):
+        """Give up key's lease if owner still holds it; a lapsed lease may belong to someone else now"""
+        with self._lock:
+            self.db.execute("DELETE FROM cache_leases WHERE key = ? AND owner = ?", (f"{self.table}:{key}", owner))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class RedisStore:
+    """The same store interface on a Redis-compatible server (Redis, Valkey, KeyDB, ...), so
+    bot processes on different hosts share one cache tier. Speaks just enough RESP for
+    GET/SET/DEL/EVAL over one connection; entries expire server-side at their own expiry."""
+
+    # Delete the lease only if it still carries our token
+    RELEASE_SCRIPT = 'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) else return 0 end'
+
+    def __init__(self, url, table="cache", timeout=2.0):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self.password = parsed.password
+        self.database = int(parsed.path.strip("/") or 0)
+        self.table = table
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.database:
+            self._send("SELECT", self.database)
+
+    def _send(self, *args):
+        command = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.sock.sendall(b"".join(command))
+        return self._reply()
+
+    def _reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            return None if int(rest) < 0 else self.reader.read(int(rest) + 2)[:-2].decode()
+        if kind == b"*":
+            return None if int(rest) < 0 else [self._reply() for _ in range(int(rest))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def command(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    return self._send(*args)
+                except OSError:
+                    # Reconnect once: the server may have restarted or dropped an idle connection
+                    self.close()
+                    if attempt:
+                        raise
+
+    def _key(self, key):
+        return f"divebot:{self.table}:{key}"
+
+    def get(self, key):
+        raw = self.command("GET", self._key(key))
+        if raw is None:
+            return None
+        value, expires = json.loads(raw)
+        return value, expires
+
+    def set(self, key, value, expires):
+        ttl_ms = int((expires - time.time()) * 1000)
+        if ttl_ms > 0:
+            self.command("SET", self._key(key), json.dumps([value, expires]), "PX", ttl_ms)
+
+    def delete(self, key):
+        self.command("DEL", self._key(key))
+
+    def purge_expired(self, now=None):
+        pass  # the server expires keys itself
+
+    def lease(self, key, seconds, owner):
+        return self.command("SET", self._key(f"lease:{key}"), owner, "NX", "PX", int(seconds * 1000)) == "OK"
+
+    def release(self, key, owner):
+        self.command("EVAL", self.RELEASE_SCRIPT, 1, self._key(f"lease:{key}"), owner)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = self.reader = None
+
+
+def shared_store(table, default_path=None):
+    """The store for one cache table: the CACHE_URL backend when one is configured, else a
+    local SQLite file if the cache has a default path, else None (memory only)"""
+    if CACHE_URL.startswith("redis://"):
+        return RedisStore(CACHE_URL, table)
+    if CACHE_URL.startswith("sqlite://"):
+        return SqliteStore(urlparse(CACHE_URL).path, table)
+    if CACHE_URL:
+        raise ValueError(f"Unsupported CACHE_URL {CACHE_URL!r}; expected sqlite:///path or redis://host:port/db")
+    return SqliteStore(default_path, table) if default_path else None
+
+
+##### BOUNDED TTL CACHE #####
+class TTLCache:
+    """LRU-bounded in-memory cache where every entry carries its own expiry time,
+    optionally backed by a store that survives restarts (or is shared between processes).
+    The store is best effort: a failing or slow one is skipped and the cache runs from memory.
+    Code on the event loop uses the *_async methods, which run store I/O in a worker thread."""
+
+    def __init__(self, name, max_entries=1024, default_ttl=None, store=None, clock=time.time,
+                 store_timeout=CACHE_STORE_TIMEOUT, store_retry=CACHE_STORE_RETRY):
+        self.name = name
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.store = store
+        self.clock = clock
+        self.store_timeout = store_timeout
+        self.store_retry = store_retry
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.store_errors = 0
+        self.store_down_until = 0.0
+        self._writes = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def store_key(key):
+        return json.dumps(key if not isinstance(key, tuple) else list(key))
+
+    def _store_up(self):
+        return self.store is not None and time.monotonic() >= self.store_down_until
+
+    def _store_failed(self, method, e):
+        self.store_errors += 1
+        self.store_down_until = time.monotonic() + self.store_retry
+        print(f"Cache store for {self.name} failed on {method} ({type(e).__name__}: {e}); memory only for {self.store_retry:g}s")
+
+    def store_call(self, method, *args, fallback=None):
+        """store.method(*args), or fallback when there is no store or it is failing"""
+        if not self._store_up():
+            return fallback
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            self._store_failed(method, e)
+            return fallback
+
+    async def store_call_async(self, method, *args, fallback=None):
+        """store_call in a worker thread, bounded by store_timeout, so a slow store never stalls the loop"""
+        if not self._store_up():
+            return fallback
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(getattr(self.store, method), *args), self.store_timeout)
+        except Exception as e:
+            self._store_failed(method, e)
+            return fallback
+
+    def _store_write(self, method, *args):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.store_call(method, *args)
+        # On the event loop: write behind, the memory tier already has the value
+        task = loop.create_task(self.store_call_async(method, *args))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            # Expired entries stay until LRU eviction so get_stale can still revalidate them
+        return False, None
+
+    def _stored_or_miss(self, key, stored, now, default):
+        if stored is not None and stored[1] > now:
+            with self._lock:
+                self._insert(key, stored[0], stored[1])
+                self.store_hits += 1
+            return stored[0]
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def get(self, key, default=None):
+        now = self.clock()
+        found, value = self._memory_get(key, now)
+        if found:
+            return value
+        return self._stored_or_miss(key, self.store_call("get", self.store_key(key)), now, default)
+
+    async def get_async(self, key, default=None):
+        now = self.clock()
+        found, value = self._memory_get(key, now)
+        if found:
+            return value
+        return self._stored_or_miss(key, await self.store_call_async("get", self.store_key(key)), now, default)
+
+    def _memory_stale(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry
+
+    def get_stale(self, key):
+        """Value for key even if it has expired (None if never cached); not counted in stats"""
+        entry = self._memory_stale(key)
+        if entry is not None:
+            return entry[0]
+        stored = self.store_call("get", self.store_key(key))
+        return stored[0] if stored is not None else None
+
+    async def get_stale_async(self, key):
+        entry = self._memory_stale(key)
+        if entry is not None:
+            return entry[0]
+        stored = await self.store_call_async("get", self.store_key(key))
+        return stored[0] if stored is not None else None
+
+    def expiry(self, key):
+        """Absolute expiry of key's in-memory entry, or None if it isn't held"""
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl=None, expires=None):
+        """Store value in memory now; from the event loop the store write happens behind"""
+        if expires is None:
+            expires = self.clock() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._insert(key, value, expires)
+        if self.store is not None:
+            self._store_write("set", self.store_key(key), value, expires)
+
+    def _insert(self, key, value, expires):
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+        if self.store is not None:
+            self._store_write("delete", self.store_key(key))
+
+    async def flush(self):
+        """Wait for store writes still running behind set/invalidate"""
+        while self._writes:
+            await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+    def stats(self):
+        lookups = self.hits + self.store_hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "store_errors": self.store_errors,
+            "hit_ratio": round((self.hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
+##### REQUEST COALESCING #####
+class SingleFlight:
+    """Concurrent callers asking for the same key share one in-flight upstream request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(factory())
+            self.inflight[key] = future
+            future.add_done_callback(lambda done: self.inflight.pop(key, None) if self.inflight.get(key) is done else None)
+        # shield: one impatient caller being cancelled must not cancel everyone's request
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {"name": self.name, "upstream_calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.inflight)}
+
+
+class SharedFlight(SingleFlight):
+    """SingleFlight across processes sharing cache's store: the process that takes the key's
+    lease fetches, the others wait for the result to land in the shared cache. Every store
+    call runs off the event loop, and waiting followers back off from `poll` to `max_poll`."""
+
+    def __init__(self, name, cache, lease_seconds=10.0, poll=0.05, max_poll=1.0):
+        super().__init__(name)
+        self.cache = cache
+        self.lease_seconds = lease_seconds
+        self.poll = poll
+        self.max_poll = max_poll
+        self.waited = 0
+
+    async def do(self, key, factory):
+        return await super().do(key, lambda: self._lead_or_follow(key, factory))
+
+    async def _lead_or_follow(self, key, factory):
+        if self.cache.store is None:
+            return await factory()
+        lease_key = f"{self.name}:{key}"
+        # Each attempt has its own token, so releasing never frees a lease someone else took over
+        owner = secrets.token_hex(8)
+        delay = self.poll
+        waiting = False
+        while True:
+            # Also taken once the leader releases it without a result, or dies and it lapses.
+            # An unreachable store means nobody can coordinate: fetch locally.
+            if await self.cache.store_call_async("lease", lease_key, self.lease_seconds, owner, fallback=True):
+                try:
+                    return await factory()
+                finally:
+                    # The result's store write must land before followers may take the lease
+                    await self.cache.flush()
+                    await self.cache.store_call_async("release", lease_key, owner)
+            if not waiting:
+                self.waited += 1
+                waiting = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+            value = await self.cache.get_async(key)
+            if value is not None:
+                return value
+
+    def stats(self):
+        return {**super().stats(), "waited_on_other_process": self.waited}
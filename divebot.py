@@ -4,25 +4,53 @@ from interactions import ButtonStyle, Button, ActionRow, slash_command, SlashCon
 # from geopy.geocoders import Nominatim
 from discord.ext import commands
 from dotenv import load_dotenv
+load_dotenv()  # before importing weather, whose cache modules read settings at import time
 from weather import GetDiveWeather, UpdateStations
+from pipeline import ReportPipeline
+from planner import DivePlanner, PLAN_MAX_SITES, parse_sites
+from guide_store import get_guide_store
+from edit_coalescer import EditCoalescer
+from region import REGION_RADIUS_KM, RegionSummary, region_stations
+from prefetch import PREFETCH_STATIONS, PrefetchScheduler
+from metrics import METRICS_PORT, get_metrics, start_metrics_server
+from observations import TrendReport
+from snapshot import catalog_version, load_catalog
+from stations import set_catalog
 # from asyncio import TimeoutError
-# import asyncio
+import asyncio
 from interactions.api.events import Component
 # interactions documentation: https://interactions-py.github.io/interactions.py/Guides/
 
-load_dotenv()
-
 #### INIT Weather Class ####
 w = GetDiveWeather()
 wu = UpdateStations()
+report_pipeline = ReportPipeline(w)
+planner = DivePlanner(w)
+guide_store = get_guide_store()
+guide_edits = EditCoalescer()
+region_summary = RegionSummary(w)
+region_edits = EditCoalescer(debounce=1.0)
+prefetcher = PrefetchScheduler(w)
+trend_report = TrendReport(w)
+metrics = get_metrics()
+metrics.gauge("guide_edit_queue_depth", lambda: len(guide_edits.pending))
+metrics.gauge("region_edit_queue_depth", lambda: len(region_edits.pending))
+metrics.gauge("report_cache_entries", lambda: len(report_pipeline.report_cache.entries))
+catalog_stats = w.catalog.stats()
+print(f"Loaded {catalog_stats['stations']} NOAA stations in {catalog_stats['load_time_ms']}ms ({catalog_stats['memory_bytes'] / 1024:.0f} KiB)")
 
 
 TOKEN = os.getenv('DISCORD_TOKEN')
 SECRET = os.getenv('CLIENT_SECRET')
 GUIDE_CHANNEL = os.getenv('GUIDE_CHANNEL')
+STATION_REFRESH_HOURS = float(os.getenv('STATION_REFRESH_HOURS') or 24)  # 0 disables the background refresh
+CATALOG_CHECK_SECONDS = float(os.getenv('CATALOG_CHECK_SECONDS') or 60)  # how often other shards look for shard 0's refresh
+# Set by shards.py when several gateway-sharded processes share the load (and CACHE_URL)
+SHARD_ID = int(os.getenv('SHARD_ID') or 0)
+SHARD_COUNT = int(os.getenv('SHARD_COUNT') or 1)
 
 # bot = commands.Bot(command_prefix='!', intents=intents)
-bot = Client(intents=Intents.DEFAULT)
+bot = Client(intents=Intents.DEFAULT, shard_id=SHARD_ID, total_shards=SHARD_COUNT)
 # slash = SlashCommand(bot, sync_commands=True)
 
 ##### GUIDE COMMAND #####
@@ -78,18 +106,177 @@ async def on_component(ctx):
     ]
 )
 async def weather(ctx, *, city: str, state: str):
+    with metrics.request("weather"):
+        with metrics.span("defer"):
+            await ctx.defer()
+        # Tides, water temperature and the NWS forecast are fetched concurrently, each with its own deadline
+        tide_message = await report_pipeline.run(city, state)
+        with metrics.span("send"):
+            if not tide_message:
+                await ctx.send(f"Could not find a nearby NOAA station for {city}, {state}.")
+                return
+
+            await ctx.send(tide_message)
+
+@slash_command(
+    name='currents',
+    description='Fetch the next slack, max flood and max ebb currents near a location',
+    options=[
+        {
+            "name": "city",
+            "description": "City",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "state",
+            "description": "State",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "depth",
+            "description": "Depth in feet to pick the closest prediction bin (optional)",
+            "type": OptionType.NUMBER,
+            "required": False
+        },
+    ]
+)
+async def currents(ctx, *, city: str, state: str, depth: float = None):
     await ctx.defer()
-    station_id = int(w.get_nearest_station(city, state)[0])
-    if not station_id:
-        await ctx.send(f"Could not find a nearby NOAA station for {city}, {state}.")
+    currents_message = await report_pipeline.run_currents(city, state, depth)
+    if not currents_message:
+        await ctx.send(f"Could not find a nearby NOAA current station for {city}, {state}.")
         return
 
-    tide_data = w.fetch_tide_predictions(station_id)
-    water_temp_data = w.fetch_water_temperature(station_id)
-    # air_temp_data = w.weather(city, state)
-    tide_message = w.format_tide_data(tide_data, water_temp_data, city, state)
-    
-    await ctx.send(tide_message)
+    await ctx.send(currents_message)
+
+@slash_command(
+    name='trend',
+    description='Daily water temperature or level for the past days, against the 30 days before',
+    options=[
+        {
+            "name": "city",
+            "description": "City",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "state",
+            "description": "State",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "product",
+            "description": "water_temperature (default) or water_level",
+            "type": OptionType.STRING,
+            "required": False
+        },
+        {
+            "name": "days",
+            "description": "How many days back (1-14, default 7)",
+            "type": OptionType.INTEGER,
+            "required": False
+        },
+    ]
+)
+async def trend(ctx, *, city: str, state: str, product: str = "water_temperature", days: int = 7):
+    await ctx.defer()
+    if product not in ("water_temperature", "water_level"):
+        await ctx.send("Product must be water_temperature or water_level.")
+        return
+    # Only the samples since the station's last stored one are fetched; the rest is read from disk
+    trend_message = await trend_report.run(city, state, product, max(1, min(days, 14)))
+    if not trend_message:
+        await ctx.send(f"Could not find a nearby NOAA station reporting {product.replace('_', ' ')} for {city}, {state}.")
+        return
+
+    await ctx.send(trend_message)
+
+@slash_command(
+    name='plan',
+    description='Rank the best dive windows across several sites',
+    options=[
+        {
+            "name": "sites",
+            "description": f"Up to {PLAN_MAX_SITES} sites separated by semicolons, e.g. Key Largo, FL; Jupiter, FL",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "days",
+            "description": "How many days ahead to plan (1-7, default 7)",
+            "type": OptionType.INTEGER,
+            "required": False
+        },
+    ]
+)
+async def plan(ctx, *, sites: str, days: int = 7):
+    await ctx.defer()
+    site_list = parse_sites(sites)
+    if not site_list:
+        await ctx.send("List sites as City, ST separated by semicolons.")
+        return
+
+    days = max(1, min(days, 7))
+    ranked = await planner.plan(site_list, days=days)
+    await ctx.send(planner.format_plan(ranked, days))
+
+@slash_command(
+    name='region',
+    description='Water temperature and next tide for every station near a city, or in a state',
+    options=[
+        {
+            "name": "state",
+            "description": "State",
+            "type": OptionType.STRING,
+            "required": True
+        },
+        {
+            "name": "city",
+            "description": "City to search around (optional; the whole state otherwise)",
+            "type": OptionType.STRING,
+            "required": False
+        },
+        {
+            "name": "radius_km",
+            "description": f"Search radius around the city in km (default {REGION_RADIUS_KM:g})",
+            "type": OptionType.NUMBER,
+            "required": False
+        },
+    ]
+)
+async def region(ctx, *, state: str, city: str = None, radius_km: float = None):
+    await ctx.defer()
+    if city:
+        try:
+            lat, lon = await w.fetch_lat_long_for_city_async(city, state)
+        except ValueError:
+            await ctx.send(f"Could not find {city}, {state}.")
+            return
+        radius_km = radius_km or REGION_RADIUS_KM
+        stations = region_stations(w.index, w.catalog, lat, lon, radius_km=radius_km)
+        title = f"within {radius_km:g} km of {city.title()}, {state.upper()}"
+    else:
+        stations = region_stations(w.index, w.catalog, state=w.convert_state_to_abbreviation(state))
+        title = f"in {w.convert_state_to_full_name(state.upper())}"
+    if not stations:
+        await ctx.send(f"No NOAA tide or water temperature stations {title}.")
+        return
+
+    header = f">>> ## __DiveBot Regional Summary: {len(stations)} stations {title}__\n"
+    message = await ctx.send(header + "*Fetching...*")
+    lines = []
+
+    # Lines are added as stations answer; the coalescer turns them into a few rate-limit friendly edits
+    async def edit():
+        await message.edit(content="\n".join([header, *lines]))
+
+    async for line in region_summary.lines(stations):
+        lines.append(line)
+        region_edits.submit(message.id, edit)
+    region_edits.submit(message.id, edit)
 
 @slash_command(
     name='guide', 
@@ -116,6 +303,10 @@ async def weather(ctx, *, city: str, state: str):
     ]
 )
 async def guide(ctx: SlashContext, location: str, date: str = None, time: str = None):
+    with metrics.request("guide"):
+        await post_guide_request(ctx, location, date, time)
+
+async def post_guide_request(ctx, location, date, time):
     user = ctx.author.nickname
     channel = bot.get_channel(1146846581874770011)
     # 1146846581874770011
@@ -129,56 +320,97 @@ async def guide(ctx: SlashContext, location: str, date: str = None, time: str =
         'date': date,
         'time': time
     }
-    if time is None:
-        await channel.send(
-            content=f"{ctx.author.nickname} has requested a guided dive at {location}!",
-            components=[action_row]
-            )
-    else:
-        await channel.send(
-            content=f"{user} has requested a guided dive at {location} at {date} - {time}!",
-            components=[action_row]
-            )
+    with metrics.span("post_request"):
+        if time is None:
+            message = await channel.send(
+                content=f"{ctx.author.nickname} has requested a guided dive at {location}!",
+                components=[action_row]
+                )
+        else:
+            message = await channel.send(
+                content=f"{user} has requested a guided dive at {location} at {date} - {time}!",
+                components=[action_row]
+                )
+    # The buttons' clicks look the request up by this message's id
+    with metrics.span("guide_store"):
+        await guide_store.create_async(message.id, location, date, time, requester=user, requester_id=ctx.author.id, channel_id=channel.id)
     
-    await ctx.send(f"Your request for a guided dive at {location} has been received!", ephemeral=True)
+    with metrics.span("send"):
+        await ctx.send(f"Your request for a guided dive at {location} has been received!", ephemeral=True)
+
+def guide_request_content(request):
+    when = f" at {request['date']} - {request['time']}" if request['time'] else ""
+    content = f"{request['requester']} has requested a guided dive at {request['location']}{when}!"
+    if request['guides']:
+        content += f" Guides: {', '.join(request['guides'])}"
+    return content
+
+def queue_guide_edit(message):
+    # Clicks inside the debounce window share one edit rendered from the latest stored state
+    async def edit():
+        await message.edit(content=guide_request_content(await guide_store.get_async(message.id)))
+    guide_edits.submit(message.id, edit)
 
 @listen()
 async def on_component(event: Component):
     ctx = event.ctx
-    match ctx.custom_id:
-        case "guide_yes":
-            await ctx.send(f"{ctx.author.mention} has volunteered to guide this dive!")
-            
-            # Extract details from the original message
-            location_pattern = r"requested a guided dive at ([^!]+)"
-            original_message = await ctx.channel.fetch_message(ctx.message_id)
-
-            match = re.search(location_pattern, original_message.content)
-
-
-            location = match.group(1) if match else "unknown location"
-            
-            # Create event details
-            event_details = {
-                'title': f"Guided Dive at {location}",
-                'description': f"Guided by: {ctx.author.mention}",
-                'date': None,  # Can be updated later
-                'time': None  # Can be updated later
-            }
-            event_details['description'] += f", {ctx.author.mention}"
-            
-            # You might need to store event_details somewhere (e.g., a database or in-memory store).
-            # This will allow you to update event details later.
-
-        case "guide_no":
-            await ctx.send(f"{ctx.author.mention} has declined to guide this dive.")
+    if ctx.custom_id not in ("guide_yes", "guide_no"):
+        return
+    with metrics.request("on_component"):
+        with metrics.span("guide_store"):
+            if ctx.custom_id == "guide_yes":
+                request = await guide_store.add_guide_async(ctx.message_id, ctx.author.mention)
+            else:
+                request = await guide_store.remove_guide_async(ctx.message_id, ctx.author.mention)
+        if request is None:
+            await ctx.send("This guide request is no longer on file.", ephemeral=True)
+            return
+        with metrics.span("defer"):
+            await ctx.defer(edit_origin=True)
+        queue_guide_edit(ctx.message)
+
+##### STATION LIST REFRESH #####
+async def refresh_stations_periodically():
+    while True:
+        await asyncio.sleep(STATION_REFRESH_HOURS * 3600)
+        try:
+            # Downloads run in a worker thread; the new catalog is swapped in when they're done
+            await asyncio.to_thread(wu.update_stations_file)
+        except Exception as e:
+            print(f"Station refresh failed: {e}")
+
+async def reload_catalog_when_changed():
+    # Only shard 0 downloads the lists; the others reload whenever its refresh rewrites them
+    version = await asyncio.to_thread(catalog_version)
+    while True:
+        await asyncio.sleep(CATALOG_CHECK_SECONDS)
+        try:
+            current = await asyncio.to_thread(catalog_version)
+            if current != version:
+                set_catalog(await asyncio.to_thread(load_catalog))
+                version = current
+                print("Reloaded the station catalog after a refresh on shard 0")
+        except Exception as e:
+            print(f"Station catalog reload failed: {e}")
 
 @listen()
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
+    print(f'{bot.user} has connected to Discord! (shard {SHARD_ID + 1} of {SHARD_COUNT})')
     print()
     print(f'{bot.user} is connected to the following guilds:')
     for guild in bot.guilds:
         print(f'    {guild.name}(id: {guild.id})')
+    # Upstream housekeeping runs once per deployment, not once per shard; the caches are shared
+    if SHARD_ID == 0 and STATION_REFRESH_HOURS > 0 and not getattr(bot, 'station_refresh', None):
+        bot.station_refresh = asyncio.create_task(refresh_stations_periodically())
+    if SHARD_ID != 0 and STATION_REFRESH_HOURS > 0 and not getattr(bot, 'station_refresh', None):
+        bot.station_refresh = asyncio.create_task(reload_catalog_when_changed())
+    # The prefetcher ranks every shard's lookups through the popularity counts they publish
+    if SHARD_ID == 0 and PREFETCH_STATIONS > 0 and not getattr(bot, 'prefetch', None):
+        bot.prefetch = asyncio.create_task(prefetcher.run())
+    if METRICS_PORT > 0 and not getattr(bot, 'metrics_server', None):
+        bot.metrics_server = await start_metrics_server(metrics, port=METRICS_PORT + SHARD_ID)
 
-bot.start(TOKEN)
+# Guarded so bench_commands.py can import the handlers without connecting to Discord
+if __name__ == "__main__":
+    bot.start(TOKEN)
@@ -0,0 +1,96 @@
+import asyncio, os, statistics, time
+from collections import deque
+
+EDIT_DEBOUNCE = float(os.getenv("EDIT_DEBOUNCE") or 1.5)  # seconds of clicks folded into one edit
+EDIT_MAX_RETRIES = int(os.getenv("EDIT_MAX_RETRIES") or 5)
+
+
+def retry_after(error):
+    """Seconds Discord asked us to wait if error is a 429, otherwise None"""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status != 429:
+        return None
+    delay = getattr(error, "retry_after", None)
+    if delay is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        delay = headers.get("Retry-After")
+    try:
+        return max(0.0, float(delay))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+##### DEBOUNCED MESSAGE EDITS #####
+class EditCoalescer:
+    """Folds bursts of edits to the same message into one. Each submit replaces the pending
+    edit for its key; the flush runs whatever is latest once the key has been quiet for
+    `debounce` seconds (from the first submit), honouring 429 retry_after."""
+
+    def __init__(self, debounce=EDIT_DEBOUNCE, max_retries=EDIT_MAX_RETRIES, clock=time.monotonic):
+        self.debounce = debounce
+        self.max_retries = max_retries
+        self.clock = clock
+        self.pending = {}   # key -> (edit coroutine factory, first queued at)
+        self.tasks = {}
+        self.submitted = 0
+        self.flushed = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=512)
+
+    def submit(self, key, edit):
+        """Queue edit (an async callable) for key, superseding any edit not yet sent"""
+        self.submitted += 1
+        queued = self.pending[key][1] if key in self.pending else self.clock()
+        self.pending[key] = (edit, queued)
+        if key not in self.tasks:
+            self._schedule(key)
+
+    def _schedule(self, key):
+        task = asyncio.ensure_future(self._flush(key))
+        self.tasks[key] = task
+        task.add_done_callback(lambda done: self.tasks.pop(key, None) if self.tasks.get(key) is done else None)
+
+    async def _flush(self, key):
+        await asyncio.sleep(self.debounce)
+        for attempt in range(self.max_retries + 1):
+            # Take the latest edit, including any that arrived while we were backing off
+            edit, queued = self.pending.pop(key)
+            try:
+                await edit()
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None or attempt == self.max_retries:
+                    self.failed += 1
+                    print(f"Message edit for {key} failed: {e}")
+                    break
+                self.rate_limited += 1
+                self.pending.setdefault(key, (edit, queued))
+                print(f"Rate limited editing {key}; retrying in {delay:.2f}s ({len(self.pending)} edits queued)")
+                await asyncio.sleep(delay)
+                continue
+            self.flushed += 1
+            self.latencies.append(self.clock() - queued)
+            break
+        if key in self.pending:
+            # Clicked again while the edit was in flight (or failing): go round once more
+            self._schedule(key)
+
+    async def drain(self):
+        """Wait for every queued edit to be sent"""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks.values()), return_exceptions=True)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": len(self.pending),
+            "submitted": self.submitted,
+            "flushed": self.flushed,
+            "coalesced": self.submitted - self.flushed - self.failed - len(self.pending),
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "flush_latency_p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            "flush_latency_max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+        }
@@ -0,0 +1,181 @@
+import argparse, bisect, csv, difflib, mmap, os, struct, threading
+from collections import OrderedDict
+
+# Optional offline place index. Build it once from the Census Gazetteer places file
+# (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html)
+# or from a name,state,lat,lng CSV:
+#     python gazetteer.py 2023_Gaz_place_national.txt -o gazetteer.bin
+# When the file exists, fetch_lat_long_for_city answers from it before trying Nominatim.
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.bin")
+
+MAGIC = b"DBGAZ001"
+HEADER = struct.Struct("<8sI")
+# Fixed-width records sorted by key, so lookups are a binary search over the mmap.
+# key = b"<st>\0<place name>", lowercased and zero padded.
+KEY_SIZE = 64
+RECORD = struct.Struct(f"<{KEY_SIZE}sff")
+FUZZY_MEMO_SIZE = 1024  # recent fuzzy answers (and misses), so a repeated typo costs one scan
+
+# Census place names carry their legal/statistical type as a suffix ("Key Largo CDP")
+PLACE_SUFFIXES = ("cdp", "city", "town", "village", "borough", "municipality", "city and borough",
+                  "consolidated government", "unified government", "metropolitan government", "urban county")
+
+
+def place_key(state, name):
+    return f"{state.lower()}\0{' '.join(name.lower().split())}".encode("utf-8")
+
+
+def strip_place_suffix(name):
+    lowered = name.lower()
+    for suffix in sorted(PLACE_SUFFIXES, key=len, reverse=True):
+        if lowered.endswith(" " + suffix):
+            return name[:-len(suffix) - 1].strip()
+    return name.strip()
+
+
+##### BUILD #####
+def read_places(filename):
+    with open(filename, "r", encoding="utf-8", errors="replace", newline="") as file:
+        first_line = file.readline()
+        file.seek(0)
+        if "\t" in first_line:
+            # Census Gazetteer: USPS, GEOID, ..., NAME, ..., INTPTLAT, INTPTLONG
+            reader = csv.DictReader(file, delimiter="\t")
+            reader.fieldnames = [field.strip() for field in reader.fieldnames]
+            for row in reader:
+                yield row["USPS"], strip_place_suffix(row["NAME"]), float(row["INTPTLAT"]), float(row["INTPTLONG"])
+        else:
+            for row in csv.DictReader(file):
+                yield row["state"], row["name"], float(row["lat"]), float(row["lng"])
+
+
+def build_gazetteer(sources, output=GAZETTEER_PATH):
+    records = {}
+    for filename in sources:
+        for state, name, lat, lng in read_places(filename):
+            key = place_key(state, name)
+            if len(key) <= KEY_SIZE and key not in records:
+                records[key] = (lat, lng)
+
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            file.write(RECORD.pack(key, *records[key]))
+    os.replace(tmp, output)
+    return len(records)
+
+
+##### LOOKUP #####
+class Gazetteer:
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        with open(path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a DiveBot gazetteer")
+        self.keys = _Keys(self)
+        self._fuzzy = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _record(self, i):
+        key, lat, lng = RECORD.unpack_from(self.mm, HEADER.size + i * RECORD.size)
+        return key.rstrip(b"\0"), lat, lng
+
+    def _range(self, prefix):
+        """Record indices whose key starts with prefix"""
+        start = bisect.bisect_left(self.keys, prefix)
+        stop = start
+        while stop < self.count and self.keys[stop].startswith(prefix):
+            stop += 1
+        return range(start, stop)
+
+    def exact(self, city, state):
+        key = place_key(state, city)
+        i = bisect.bisect_left(self.keys, key)
+        if i < self.count and self.keys[i] == key:
+            _, lat, lng = self._record(i)
+            return lat, lng
+        return None
+
+    def prefix(self, city, state, limit=10):
+        """(name, lat, lng) for places in state whose name starts with city"""
+        matches = []
+        for i in self._range(place_key(state, city))[:limit]:
+            key, lat, lng = self._record(i)
+            matches.append((key.split(b"\0", 1)[1].decode("utf-8"), lat, lng))
+        return matches
+
+    def fuzzy(self, city, state, cutoff=0.85):
+        """Closest place name in the state, for typos like 'key lago'. Only names sharing the
+        first letter are compared, so a miss scans one slice of the state, not all of it."""
+        city = " ".join(city.lower().split())
+        if not city:
+            return None
+        memo_key = (state.lower(), city, cutoff)
+        with self._lock:
+            if memo_key in self._fuzzy:
+                self._fuzzy.move_to_end(memo_key)
+                return self._fuzzy[memo_key]
+        names = {}
+        for i in self._range(place_key(state, city[0])):
+            key, lat, lng = self._record(i)
+            names[key.split(b"\0", 1)[1].decode("utf-8")] = (lat, lng)
+        match = difflib.get_close_matches(city, names, n=1, cutoff=cutoff)
+        found = (match[0], *names[match[0]]) if match else None
+        with self._lock:
+            self._fuzzy[memo_key] = found
+            while len(self._fuzzy) > FUZZY_MEMO_SIZE:
+                self._fuzzy.popitem(last=False)
+        return found
+
+    def resolve(self, city, state):
+        """(name, lat, lng) by exact, then unique-prefix, then fuzzy match; None on a miss"""
+        coords = self.exact(city, state)
+        if coords:
+            return (" ".join(city.lower().split()), *coords)
+        prefixed = self.prefix(city, state, limit=2)
+        if len(prefixed) == 1:
+            return prefixed[0]
+        return self.fuzzy(city, state)
+
+    def close(self):
+        self.mm.close()
+
+
+class _Keys:
+    """Sequence view of the record keys, so bisect can search the mmap directly"""
+    def __init__(self, gazetteer):
+        self.mm = gazetteer.mm
+        self.count = gazetteer.count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        offset = HEADER.size + i * RECORD.size
+        return self.mm[offset:offset + KEY_SIZE].rstrip(b"\0")
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+def get_gazetteer():
+    """Shared Gazetteer, or None when no gazetteer file has been built"""
+    global _gazetteer
+    if _gazetteer is None and os.path.exists(GAZETTEER_PATH):
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(GAZETTEER_PATH)
+    return _gazetteer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline DiveBot gazetteer")
+    parser.add_argument("sources", nargs="+", help="Census Gazetteer place files and/or name,state,lat,lng CSVs")
+    parser.add_argument("-o", "--output", default=GAZETTEER_PATH)
+    args = parser.parse_args()
+    count = build_gazetteer(args.sources, args.output)
+    print(f"Wrote {count} places to {args.output}")
@@ -0,0 +1,171 @@
+import os, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from cache import TTLCache, shared_store
+
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite3")
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL") or 30 * 24 * 3600)  # places don't move; a month keeps us polite to Nominatim
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN") or "nominatim.openstreetmap.org"  # a self-hosted instance or the benchmark stub
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME") or "https"
+
+
+def normalize_place(city, state):
+    """Cache key for a city/state pair: lowercased with whitespace collapsed"""
+    return " ".join(city.lower().split()), " ".join(state.lower().split())
+
+
+def nominatim_geocoder():
+    from geopy.geocoders import Nominatim
+    geolocator = Nominatim(user_agent="DiveBot", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+
+    def geocode(city, state):
+        location = geolocator.geocode(f"{city}, {state}")
+        return (location.latitude, location.longitude) if location else None
+    return geocode
+
+
+##### TWO-TIER GEOCODE CACHE #####
+class GeocodeCache:
+    def __init__(self, geocoder=None, path=GEOCODE_CACHE_PATH, ttl=GEOCODE_CACHE_TTL, max_entries=1024, clock=time.time, store=None):
+        self.geocoder = geocoder
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.memory = OrderedDict()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.coalesced = 0
+        # Misses being geocoded right now; concurrent lookups of the same place wait on them
+        self.inflight = {}
+        self._lock = threading.Lock()
+        # A shared store (CACHE_URL) replaces the local file as the second tier. It's best
+        # effort, like every other cache's: calls go through TTLCache.store_call, which logs a
+        # failure and skips the store for a while instead of failing the lookup
+        self.store = store
+        self.shared = TTLCache("geocode", store=store) if store is not None else None
+        self.db = None
+        if path and store is None:
+            self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS geocode (city TEXT, state TEXT, lat REAL, lng REAL, stored REAL, PRIMARY KEY (city, state))")
+            self.db.commit()
+
+    def _geocoder(self):
+        # Build the Nominatim client once, and only if we ever actually miss
+        if self.geocoder is None:
+            self.geocoder = nominatim_geocoder()
+        return self.geocoder
+
+    def _remember(self, key, coords, stored):
+        self.memory[key] = (coords, stored)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _memory_get(self, key, now):
+        entry = self.memory.get(key)
+        if entry and now - entry[1] < self.ttl:
+            self.memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return entry[0]
+        return None
+
+    def lookup(self, city, state):
+        key = normalize_place(city, state)
+        now = self.clock()
+        with self._lock:
+            coords = self._memory_get(key, now)
+            if coords is not None:
+                return coords
+
+            if self.db is not None:
+                row = self.db.execute("SELECT lat, lng, stored FROM geocode WHERE city = ? AND state = ?", key).fetchone()
+                if row and now - row[2] < self.ttl:
+                    coords = (row[0], row[1])
+                    self._remember(key, coords, row[2])
+                    self.hits["disk"] += 1
+                    return coords
+
+        if self.shared is not None:
+            # Outside the lock, so a slow store doesn't hold up lookups the memory tier can answer
+            stored = self.shared.store_call("get", "|".join(key))
+            if stored and now < stored[1]:
+                coords = tuple(stored[0])
+                with self._lock:
+                    self._remember(key, coords, stored[1] - self.ttl)
+                    self.hits["disk"] += 1
+                return coords
+
+        with self._lock:
+            # Someone may have finished geocoding the place while we were asking the store
+            coords = self._memory_get(key, now)
+            if coords is not None:
+                return coords
+            pending = self.inflight.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self.inflight[key] = Future()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            # Another command is already asking Nominatim about this place
+            return pending.result()
+        try:
+            coords = self._fetch(key, city, state, now)
+        except BaseException as e:
+            with self._lock:
+                self.inflight.pop(key, None)
+            pending.set_exception(e)
+            raise
+        pending.set_result(coords)
+        # Waiters have their answer; sharing it with the other processes can't fail the lookup
+        if self.shared is not None:
+            self.shared.store_call("set", "|".join(key), list(coords), now + self.ttl)
+        return coords
+
+    def _fetch(self, key, city, state, now):
+        coords = self._geocoder()(city, state)
+        if not coords:
+            raise ValueError(f"Could not fetch coordinates for {city}, {state}")
+        coords = (float(coords[0]), float(coords[1]))
+
+        with self._lock:
+            self._remember(key, coords, now)
+            self.inflight.pop(key, None)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)", (*key, *coords, now))
+                self.db.commit()
+        return coords
+
+    def stats(self):
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "store_errors": self.shared.store_errors if self.shared is not None else 0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+_geocode_cache = None
+_geocode_cache_lock = threading.Lock()
+
+def get_geocode_cache():
+    global _geocode_cache
+    if _geocode_cache is None:
+        with _geocode_cache_lock:
+            if _geocode_cache is None:
+                _geocode_cache = GeocodeCache(store=shared_store("geocode"))
+    return _geocode_cache
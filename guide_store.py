@@ -0,0 +1,84 @@
+import asyncio, os, sqlite3, threading, time
+
+GUIDE_STORE_PATH = os.getenv("GUIDE_STORE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "guide_requests.sqlite3")
+
+
+##### GUIDE REQUEST STORE #####
+class GuideRequestStore:
+    """Guided-dive requests keyed by the Discord message id carrying their buttons, so a click
+    is a single indexed write instead of fetching and re-parsing the message."""
+
+    def __init__(self, path=GUIDE_STORE_PATH, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL: lookups don't wait behind a click being written
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS guide_requests (
+            message_id TEXT PRIMARY KEY, channel_id TEXT, location TEXT, date TEXT, time TEXT,
+            requester TEXT, requester_id TEXT, created REAL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS guide_volunteers (
+            message_id TEXT, guide TEXT, joined REAL, PRIMARY KEY (message_id, guide))""")
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def create(self, message_id, location, date=None, time=None, requester=None, requester_id=None, channel_id=None):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO guide_requests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (str(message_id), None if channel_id is None else str(channel_id), location, date, time,
+                             requester, None if requester_id is None else str(requester_id), self.clock()))
+            self.db.commit()
+        return self.get(message_id)
+
+    def get(self, message_id):
+        """The request as a dict with its guides in sign-up order, or None if it isn't stored"""
+        with self._lock:
+            row = self.db.execute("SELECT message_id, channel_id, location, date, time, requester, requester_id, created "
+                                  "FROM guide_requests WHERE message_id = ?", (str(message_id),)).fetchone()
+            if row is None:
+                return None
+            guides = [guide for guide, in self.db.execute(
+                "SELECT guide FROM guide_volunteers WHERE message_id = ? ORDER BY joined, rowid", (str(message_id),))]
+        keys = ("message_id", "channel_id", "location", "date", "time", "requester", "requester_id", "created")
+        return {**dict(zip(keys, row)), "guides": guides}
+
+    def add_guide(self, message_id, guide):
+        """Volunteer guide for a request; returns the updated request (None if unknown)"""
+        with self._lock:
+            self.db.execute("INSERT OR IGNORE INTO guide_volunteers "
+                            "SELECT message_id, ?, ? FROM guide_requests WHERE message_id = ?", (guide, self.clock(), str(message_id)))
+            self.db.commit()
+        return self.get(message_id)
+
+    def remove_guide(self, message_id, guide):
+        with self._lock:
+            self.db.execute("DELETE FROM guide_volunteers WHERE message_id = ? AND guide = ?", (str(message_id), guide))
+            self.db.commit()
+        return self.get(message_id)
+
+    ##### FROM THE EVENT LOOP #####
+    # SQLite commits wait on the disk, so command handlers run them in a worker thread
+    async def create_async(self, message_id, location, date=None, time=None, requester=None, requester_id=None, channel_id=None):
+        return await asyncio.to_thread(self.create, message_id, location, date, time, requester, requester_id, channel_id)
+
+    async def get_async(self, message_id):
+        return await asyncio.to_thread(self.get, message_id)
+
+    async def add_guide_async(self, message_id, guide):
+        return await asyncio.to_thread(self.add_guide, message_id, guide)
+
+    async def remove_guide_async(self, message_id, guide):
+        return await asyncio.to_thread(self.remove_guide, message_id, guide)
+
+    def close(self):
+        self.db.close()
+
+
+_store = None
+
+def get_guide_store():
+    global _store
+    if _store is None:
+        _store = GuideRequestStore()
+    return _store
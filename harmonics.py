@@ -0,0 +1,331 @@
+import asyncio, math, os, threading
+from datetime import datetime, timedelta
+import numpy as np
+import requests
+from cache import TTLCache, shared_store
+
+# Local tide predictions from NOAA's published harmonic constants, used when the datagetter
+# is unreachable. Subordinate (type S) stations apply NOAA's time and height offsets to their
+# reference station's curve. HILO_TIME_TOLERANCE and HILO_HEIGHT_TOLERANCE are the agreement
+# test_harmonics.py requires with NOAA's own hilo predictions, but only for stations whose
+# responses record_noaa_fixtures.py has recorded into fixtures/harmonics. Nothing checks the
+# accuracy until those recordings are committed.
+MDAPI_URL = "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations"
+HARMONICS_CACHE_PATH = os.getenv("HARMONICS_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "harmonics.sqlite3")
+HARMONICS_TTL = float(os.getenv("HARMONICS_TTL") or 90 * 24 * 3600)  # constants are re-derived every few years
+
+HILO_TIME_TOLERANCE = timedelta(minutes=6)
+HILO_HEIGHT_TOLERANCE = 0.1  # feet
+
+SAMPLE_SECONDS = 360  # extremes are bracketed on a 6-minute grid, then interpolated
+
+
+##### ASTRONOMICAL ARGUMENTS #####
+# Extended Doodson numbers over (tau, s, h, p, N, p1, 90°), tau being the mean lunar time
+# T + h - s. Nodal corrections are named by the u/f family they use (Schureman, 1958).
+BASE_CONSTITUENTS = {
+    "SA":   ((0, 0, 1, 0, 0, 0, 0), None),
+    "SSA":  ((0, 0, 2, 0, 0, 0, 0), None),
+    "MM":   ((0, 1, 0, -1, 0, 0, 0), "Mm"),
+    "MF":   ((0, 2, 0, 0, 0, 0, 0), "Mf"),
+    "2Q1":  ((1, -3, 0, 2, 0, 0, 1), "O1"),
+    "Q1":   ((1, -2, 0, 1, 0, 0, 1), "O1"),
+    "RHO":  ((1, -2, 2, -1, 0, 0, 1), "O1"),
+    "O1":   ((1, -1, 0, 0, 0, 0, 1), "O1"),
+    "M1":   ((1, 0, 0, 1, 0, 0, -1), "M1"),
+    "P1":   ((1, 1, -2, 0, 0, 0, 1), None),
+    "S1":   ((1, 1, -1, 0, 0, 0, 0), None),
+    "K1":   ((1, 1, 0, 0, 0, 0, -1), "K1"),
+    "J1":   ((1, 2, 0, -1, 0, 0, -1), "J1"),
+    "OO1":  ((1, 3, 0, 0, 0, 0, -1), "OO1"),
+    "2N2":  ((2, -2, 0, 2, 0, 0, 0), "M2"),
+    "N2":   ((2, -1, 0, 1, 0, 0, 0), "M2"),
+    "NU2":  ((2, -1, 2, -1, 0, 0, 0), "M2"),
+    "M2":   ((2, 0, 0, 0, 0, 0, 0), "M2"),
+    "LAM2": ((2, 1, -2, 1, 0, 0, 2), "M2"),
+    "L2":   ((2, 1, 0, -1, 0, 0, 2), "L2"),
+    "T2":   ((2, 2, -3, 0, 0, 1, 0), None),
+    "S2":   ((2, 2, -2, 0, 0, 0, 0), None),
+    "R2":   ((2, 2, -1, 0, 0, -1, 2), None),
+    "K2":   ((2, 2, 0, 0, 0, 0, 0), "K2"),
+    "M3":   ((3, 0, 0, 0, 0, 0, 0), "M3"),
+}
+# Shallow-water and compound tides as sums of the constituents above
+COMPOUND_CONSTITUENTS = {
+    "MSF":  {"S2": 1, "M2": -1},
+    "MU2":  {"M2": 2, "S2": -1},
+    "2SM2": {"S2": 2, "M2": -1},
+    "MK3":  {"M2": 1, "K1": 1},
+    "2MK3": {"M2": 2, "K1": -1},
+    "M4":   {"M2": 2},
+    "MN4":  {"M2": 1, "N2": 1},
+    "MS4":  {"M2": 1, "S2": 1},
+    "S4":   {"S2": 2},
+    "M6":   {"M2": 3},
+    "S6":   {"S2": 3},
+    "M8":   {"M2": 4},
+}
+
+# Rates of (tau, s, h, p, N, p1, 90°) in degrees per hour
+ARGUMENT_SPEEDS = np.array([
+    15.0 + 0.0410686387 - 0.5490165321, 0.5490165321, 0.0410686387, 0.0046418326, -0.0022064139, 0.0000019610, 0.0,
+])
+
+
+def _doodson(name):
+    if name in BASE_CONSTITUENTS:
+        return np.array(BASE_CONSTITUENTS[name][0], dtype=float)
+    return sum(count * _doodson(part) for part, count in COMPOUND_CONSTITUENTS[name].items())
+
+
+def constituent_speeds(names):
+    """Angular speeds (degrees per hour) NOAA lists alongside each constituent"""
+    return np.array([_doodson(name) @ ARGUMENT_SPEEDS for name in names])
+
+
+def astronomical_arguments(epochs):
+    """(len(epochs), 7) array of tau, s, h, p, N, p1 and 90°, in degrees, at unix times"""
+    epochs = np.atleast_1d(np.asarray(epochs, dtype=float))
+    T = (epochs / 86400.0 + 2440587.5 - 2451545.0) / 36525.0  # Julian centuries since J2000
+    s = 218.3164591 + 481267.88134236 * T - 0.0013268 * T ** 2 + T ** 3 / 538841.0
+    h = 280.46645 + 36000.7697489 * T + 0.0003032 * T ** 2
+    p = 83.3532430 + 4069.0137111 * T - 0.0103238 * T ** 2 - T ** 3 / 80053.0
+    N = 125.0445550 - 1934.1361849 * T + 0.0020762 * T ** 2 + T ** 3 / 467410.0
+    p1 = 282.94 + 1.7192 * T
+    hour_angle = 180.0 + 360.0 * np.mod(epochs / 86400.0, 1.0)  # mean sun, 180° at 00:00 UTC
+    return np.column_stack([hour_angle + h - s, s, h, p, N, p1, np.full_like(T, 90.0)])
+
+
+def nodal_corrections(epoch):
+    """{family: (f, u)} node factors and equilibrium phase corrections (degrees) at epoch"""
+    T = (epoch / 86400.0 + 2440587.5 - 2451545.0) / 36525.0
+    _, _, _, p, N, _, _ = astronomical_arguments([epoch])[0]
+    omega = math.radians(23.4392911 - 0.0130042 * T)  # obliquity of the ecliptic
+    i = math.radians(5.145)                          # inclination of the lunar orbit
+    N = math.radians((N + 180.0) % 360.0 - 180.0)
+
+    I = math.acos(math.cos(i) * math.cos(omega) - math.sin(i) * math.sin(omega) * math.cos(N))
+    half = 0.5 * N
+    e1 = math.atan2(math.cos(0.5 * (omega - i)) / math.cos(0.5 * (omega + i)) * math.sin(half), math.cos(half)) - half
+    e2 = math.atan2(math.sin(0.5 * (omega - i)) / math.sin(0.5 * (omega + i)) * math.sin(half), math.cos(half)) - half
+    xi, nu = -(e1 + e2), e1 - e2
+    nu_p = math.atan2(math.sin(2 * I) * math.sin(nu), math.sin(2 * I) * math.cos(nu) + 0.3347)
+    nu_pp2 = math.atan2(math.sin(I) ** 2 * math.sin(2 * nu), math.sin(I) ** 2 * math.cos(2 * nu) + 0.0727)
+
+    P = math.radians(p) - xi
+    tan_half = math.tan(0.5 * I)
+    R = math.atan2(math.sin(2 * P), 1.0 / (6.0 * tan_half ** 2) - math.cos(2 * P))
+    inv_Ra = math.sqrt(1.0 - 12.0 * tan_half ** 2 * math.cos(2 * P) + 36.0 * tan_half ** 4)
+    Q = math.atan2((5.0 * math.cos(I) - 1.0) * math.sin(P), (7.0 * math.cos(I) + 1.0) * math.cos(P))
+    inv_Qa = math.sqrt(0.25 + 1.5 * math.cos(I) * math.cos(2 * P) / math.cos(0.5 * I) ** 2
+                       + 2.25 * math.cos(I) ** 2 / math.cos(0.5 * I) ** 4)
+
+    f_O1 = math.sin(I) * math.cos(0.5 * I) ** 2 / 0.3800
+    f_M2 = math.cos(0.5 * I) ** 4 / 0.9154
+    corrections = {
+        "Mm": ((2.0 / 3.0 - math.sin(I) ** 2) / 0.5021, 0.0),
+        "Mf": (math.sin(I) ** 2 / 0.1578, -2 * xi),
+        "O1": (f_O1, 2 * xi - nu),
+        "M1": (f_O1 * inv_Qa, xi - nu + Q),
+        "K1": (math.sqrt(0.8965 * math.sin(2 * I) ** 2 + 0.6001 * math.sin(2 * I) * math.cos(nu) + 0.1006), -nu_p),
+        "J1": (math.sin(2 * I) / 0.7214, -nu),
+        "OO1": (math.sin(I) * math.sin(0.5 * I) ** 2 / 0.0164, -2 * xi - nu),
+        "M2": (f_M2, 2 * xi - 2 * nu),
+        "L2": (f_M2 * inv_Ra, 2 * xi - 2 * nu - R),
+        "K2": (math.sqrt(19.0444 * math.sin(I) ** 4 + 2.7702 * math.sin(I) ** 2 * math.cos(2 * nu) + 0.0981), -nu_pp2),
+        "M3": (f_M2 ** 1.5, 3 * xi - 3 * nu),
+    }
+    return {family: (f, math.degrees(u)) for family, (f, u) in corrections.items()}
+
+
+def _node_factor(name, corrections):
+    if name in BASE_CONSTITUENTS:
+        family = BASE_CONSTITUENTS[name][1]
+        return corrections[family] if family else (1.0, 0.0)
+    f, u = 1.0, 0.0
+    for part, count in COMPOUND_CONSTITUENTS[name].items():
+        part_f, part_u = _node_factor(part, corrections)
+        f *= part_f ** abs(count)
+        u += count * part_u
+    return f, u
+
+
+##### HARMONIC MODEL #####
+class HarmonicModel:
+    """Heights above MLLW from a station's amplitudes and Greenwich phase lags (phase_GMT)"""
+
+    def __init__(self, constituents, msl_above_mllw=0.0):
+        known = [c for c in constituents if c["name"].upper() in BASE_CONSTITUENTS or c["name"].upper() in COMPOUND_CONSTITUENTS]
+        self.names = [c["name"].upper() for c in known if c["amplitude"]]
+        self.amplitudes = np.array([c["amplitude"] for c in known if c["amplitude"]], dtype=float)
+        self.phases = np.array([c["phase_GMT"] for c in known if c["amplitude"]], dtype=float)
+        self.doodson = np.array([_doodson(name) for name in self.names]).reshape(-1, 7)
+        self.speeds = np.radians(self.doodson @ ARGUMENT_SPEEDS) / 3600.0  # radians per second
+        self.msl = msl_above_mllw
+        self._nodal = (None, None, None)
+
+    @classmethod
+    def from_noaa(cls, harcon, datums):
+        """Build from mdapi harcon.json and datums.json payloads (units=english)"""
+        levels = {datum["name"]: datum["value"] for datum in datums.get("datums", []) if datum.get("value") is not None}
+        return cls(harcon.get("HarmonicConstituents", []), levels.get("MSL", 0.0) - levels.get("MLLW", 0.0))
+
+    def _node_factors(self, epoch):
+        # Node factors drift over the 18.6-year nodal cycle; once a day is plenty
+        day = int(epoch // 86400)
+        if self._nodal[0] != day:
+            corrections = nodal_corrections(day * 86400.0 + 43200.0)
+            f, u = np.array([_node_factor(name, corrections) for name in self.names]).reshape(-1, 2).T
+            self._nodal = (day, f, u)
+        return self._nodal[1], self._nodal[2]
+
+    def _terms(self, epochs):
+        f, u = self._node_factors(float(np.mean(epochs)))
+        phase = np.radians(astronomical_arguments(epochs) @ self.doodson.T + u - self.phases)
+        return f * self.amplitudes, phase
+
+    def heights(self, epochs):
+        amplitude, phase = self._terms(epochs)
+        return self.msl + np.cos(phase) @ amplitude
+
+    def extremes(self, begin, end):
+        """(epochs, heights, is_high) of every high and low water between two unix times"""
+        epochs = np.arange(begin - SAMPLE_SECONDS, end + 2 * SAMPLE_SECONDS, SAMPLE_SECONDS, dtype=float)
+        amplitude, phase = self._terms(epochs)
+        slope = -np.sin(phase) @ (amplitude * self.speeds)
+        turns = np.flatnonzero(np.sign(slope[:-1]) * np.sign(slope[1:]) < 0)
+        # Linear interpolation of the slope's zero crossing inside each 6-minute bracket
+        fraction = slope[turns] / (slope[turns] - slope[turns + 1])
+        times = epochs[turns] + fraction * SAMPLE_SECONDS
+        is_high = slope[turns] > 0
+        keep = (times >= begin) & (times < end)
+        times, is_high = times[keep], is_high[keep]
+        return times, self.heights(times) if len(times) else np.empty(0), is_high
+
+
+def apply_offsets(epochs, heights, is_high, offsets):
+    """Shift a reference station's extremes onto a subordinate station (tidepredoffsets.json)"""
+    minutes = np.where(is_high, offsets.get("timeOffsetHighTide") or 0, offsets.get("timeOffsetLowTide") or 0)
+    adjust = np.where(is_high, offsets.get("heightOffsetHighTide", 1.0), offsets.get("heightOffsetLowTide", 1.0)).astype(float)
+    if offsets.get("heightAdjustedType") == "A":
+        adjust_heights = heights + adjust
+    else:
+        adjust_heights = heights * adjust
+    return epochs + minutes * 60.0, adjust_heights, is_high
+
+
+def hilo_predictions(epochs, heights, is_high, tz):
+    """NOAA datagetter-shaped hilo predictions in the station's local time (lst_ldt)"""
+    predictions = []
+    for epoch, height, high in zip(epochs.tolist(), heights.tolist(), is_high.tolist()):
+        local = datetime.fromtimestamp(round(epoch / 60) * 60, tz)
+        predictions.append({"t": local.strftime('%Y-%m-%d %H:%M'), "v": f"{height:.3f}", "type": "H" if high else "L"})
+    return {"predictions": predictions, "source": "harmonic"}
+
+
+##### STATION CONSTANTS + PREDICTOR #####
+class HarmonicPredictor:
+    """Caches each station's harmonic constants (or subordinate offsets) and predicts hi/lo
+    tides from them without touching the network."""
+
+    def __init__(self, cache=None, http=None):
+        self.cache = cache
+        self.http = http
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def constants(self, station_id):
+        """Cached constants for a station: {"type": "R", "harcon", "datums"} or {"type": "S", "offsets"}"""
+        return self.cache.get(str(station_id))
+
+    async def constants_async(self, station_id):
+        """constants, reading the store off the event loop; a subordinate's reference station
+        is loaded too, so predict() then runs from memory"""
+        constants = await self.cache.get_async(str(station_id))
+        if constants is not None and constants.get("type") == "S":
+            await self.cache.get_async(str(constants["offsets"].get("refStationId")))
+        return constants
+
+    def model(self, station_id):
+        constants = self.constants(station_id)
+        if constants is None or constants.get("type") != "R":
+            return None
+        with self._lock:
+            model = self.models.get(str(station_id))
+            if model is None:
+                model = self.models[str(station_id)] = HarmonicModel.from_noaa(constants["harcon"], constants["datums"])
+        return model
+
+    def predict(self, station_id, begin, end, tz):
+        """Hilo predictions between two unix times, or None when the constants aren't cached"""
+        constants = self.constants(station_id)
+        if constants is None:
+            return None
+        if constants.get("type") == "S":
+            offsets = constants["offsets"]
+            model = self.model(offsets.get("refStationId"))
+            if model is None:
+                return None
+            # Offsets can move an extreme across the window edge, so look a little wider
+            margin = 6 * 3600
+            epochs, heights, is_high = apply_offsets(*model.extremes(begin - margin, end + margin), offsets)
+            keep = (epochs >= begin) & (epochs < end)
+            return hilo_predictions(epochs[keep], heights[keep], is_high[keep], tz)
+        model = self.model(station_id)
+        return hilo_predictions(*model.extremes(begin, end), tz)
+
+    @staticmethod
+    def is_subordinate(station_id, offsets):
+        reference = offsets.get("refStationId")
+        return offsets.get("type") == "S" and bool(reference) and str(reference) != str(station_id)
+
+    def fetch_constants(self, station_id):
+        """Download a station's constants (and its reference station's) from the NOAA metadata API"""
+        def get(resource):
+            response = requests.get(f"{MDAPI_URL}/{station_id}/{resource}.json", params={"units": "english"}, timeout=10)
+            response.raise_for_status()
+            return response.json()
+
+        offsets = get("tidepredoffsets")
+        if self.is_subordinate(station_id, offsets):
+            constants = {"type": "S", "offsets": offsets}
+            if self.constants(offsets["refStationId"]) is None:
+                self.fetch_constants(offsets["refStationId"])
+        else:
+            constants = {"type": "R", "harcon": get("harcon"), "datums": get("datums")}
+        self.cache.set(str(station_id), constants)
+        return constants
+
+    async def fetch_constants_async(self, station_id):
+        async def get(resource):
+            return await self.http.get_json(f"{MDAPI_URL}/{station_id}/{resource}.json", params={"units": "english"})
+
+        offsets = await get("tidepredoffsets")
+        if self.is_subordinate(station_id, offsets):
+            constants = {"type": "S", "offsets": offsets}
+            if await self.constants_async(offsets["refStationId"]) is None:
+                await self.fetch_constants_async(offsets["refStationId"])
+        else:
+            harcon, datums = await asyncio.gather(get("harcon"), get("datums"))
+            constants = {"type": "R", "harcon": harcon, "datums": datums}
+        self.cache.set(str(station_id), constants)
+        return constants
+
+    async def ensure_constants_async(self, station_id):
+        """Background warm-up after a live prediction, so the fallback is ready before it's needed"""
+        if await self.constants_async(station_id) is not None:
+            return
+        try:
+            await self.fetch_constants_async(station_id)
+        except Exception as e:
+            print(f"Could not fetch harmonic constants for station {station_id}: {e}")
+
+
+_predictor = None
+
+def get_harmonic_predictor(http=None):
+    global _predictor
+    if _predictor is None:
+        store = shared_store("harmonic_constants", HARMONICS_CACHE_PATH)
+        _predictor = HarmonicPredictor(TTLCache("harmonic_constants", max_entries=4096, default_ttl=HARMONICS_TTL, store=store), http)
+    return _predictor
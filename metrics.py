@@ -0,0 +1,158 @@
+import contextvars, os, threading, time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 9108)  # 0 disables the endpoint
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS") or 0)  # 0 disables the slow-request log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_trace = contextvars.ContextVar("divebot_trace", default=None)
+
+
+##### LATENCY HISTOGRAM #####
+class Histogram:
+    """Cumulative Prometheus buckets plus a sliding window of recent samples for quantiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+##### METRICS REGISTRY #####
+class Metrics:
+    def __init__(self, slow_request_seconds=SLOW_REQUEST_SECONDS):
+        self.slow_request_seconds = slow_request_seconds
+        self.stages = defaultdict(Histogram)    # (command, stage) -> Histogram
+        self.requests = defaultdict(Histogram)  # command -> Histogram
+        self.upstream = defaultdict(int)        # (host, status) -> count
+        self.gauges = {}                        # name -> callable returning a number
+        self._lock = threading.Lock()
+
+    def observe(self, command, stage, seconds):
+        with self._lock:
+            self.stages[(command, stage)].observe(seconds)
+
+    def count_upstream(self, host, status):
+        with self._lock:
+            self.upstream[(host, str(status))] += 1
+
+    def gauge(self, name, read):
+        """Export read() as divebot_<name> on every scrape (queue depths, cache sizes...)"""
+        self.gauges[name] = read
+
+    @contextmanager
+    def request(self, command):
+        """Time a whole command; spans opened inside it (in any task it spawns) are attached"""
+        trace = {"command": command, "spans": []}
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            elapsed = time.perf_counter() - start
+            _trace.reset(token)
+            with self._lock:
+                self.requests[command].observe(elapsed)
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in trace["spans"])
+                print(f"Slow /{command}: {elapsed * 1000:.0f}ms ({breakdown})")
+
+    @contextmanager
+    def span(self, stage):
+        trace = _trace.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            command = trace["command"] if trace else "background"
+            self.observe(command, stage, elapsed)
+            if trace is not None:
+                trace["spans"].append((stage, elapsed))
+
+    async def timed(self, stage, awaitable):
+        """Await awaitable inside a span"""
+        with self.span(stage):
+            return await awaitable
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
+            lines.append(f"# HELP {name}_quantile Recent {help_text.lower()} at p50/p95/p99")
+            lines.append(f"# TYPE {name}_quantile gauge")
+            for labels, hist in series:
+                for q in QUANTILES:
+                    lines.append(f'{name}_quantile{{{labels},quantile="{q}"}} {hist.quantile(q):.6f}')
+
+        with self._lock:
+            histogram("divebot_request_seconds", "Command latency in seconds",
+                      [(f'command="{command}"', hist) for command, hist in sorted(self.requests.items())])
+            histogram("divebot_stage_seconds", "Per-stage latency in seconds",
+                      [(f'command="{command}",stage="{stage}"', hist) for (command, stage), hist in sorted(self.stages.items())])
+            lines.append("# HELP divebot_upstream_requests_total Upstream HTTP requests by host and status")
+            lines.append("# TYPE divebot_upstream_requests_total counter")
+            for (host, status), count in sorted(self.upstream.items()):
+                lines.append(f'divebot_upstream_requests_total{{host="{host}",status="{status}"}} {count}')
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.append(f"# TYPE divebot_{name} gauge")
+            lines.append(f"divebot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(metrics, host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics from the bot's event loop; returns the aiohttp runner"""
+    from aiohttp import web
+
+    async def handler(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+_metrics = None
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
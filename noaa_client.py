@@ -0,0 +1,169 @@
+import asyncio, os, time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+import aiohttp, requests
+from yarl import URL
+from breaker import CircuitOpenError, get_breakers
+from metrics import get_metrics
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT") or 10)  # seconds, per request
+HTTP_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_CONNECTIONS_PER_HOST") or 10)
+
+
+def http_expiry(headers, default_ttl, now=None):
+    """Absolute expiry time for a response from its Cache-Control / Expires headers"""
+    now = time.time() if now is None else now
+    headers = {name.lower(): value for name, value in headers.items()}
+    cache_control = {}
+    for directive in (headers.get("cache-control") or "").split(","):
+        name, _, value = directive.strip().partition("=")
+        cache_control[name.lower()] = value.strip('"')
+
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return now
+    for name in ("s-maxage", "max-age"):
+        if cache_control.get(name, "").isdigit():
+            age = headers.get("age", "0")
+            age = int(age) if age.isdigit() else 0
+            return now + max(0, int(cache_control[name]) - age)
+    if headers.get("expires"):
+        try:
+            expires = parsedate_to_datetime(headers["expires"]).timestamp()
+            served = parsedate_to_datetime(headers["date"]).timestamp() if headers.get("date") else now
+            # Relative to the server's clock, in case ours disagrees
+            return now + max(0, expires - served)
+        except (TypeError, ValueError):
+            return now
+    return now + default_ttl
+
+
+def upstream_stage(url):
+    """Span name for a request: which NOAA/NWS API it hits, not the full URL"""
+    url = URL(url)
+    if "datagetter" in url.path:
+        return "noaa_datagetter"
+    if "mdapi" in url.path:
+        return "noaa_mdapi"
+    if url.path.startswith("/points"):
+        return "nws_points"
+    if url.host == "api.weather.gov" or url.path.endswith("/forecast"):
+        return "nws_forecast"
+    return url.host
+
+
+def upstream_failed(status):
+    """Statuses that say the upstream itself is in trouble (a 404 is a working server)"""
+    return status >= 500 or status == 429
+
+
+##### ASYNC HTTP CLIENT #####
+class AsyncNoaaClient:
+    """One pooled aiohttp session per upstream host (tidesandcurrents, api.weather.gov, ...),
+    created lazily inside the running event loop."""
+
+    def __init__(self, timeout=HTTP_TIMEOUT, connections_per_host=HTTP_CONNECTIONS_PER_HOST, metrics=None, breakers=None):
+        self.timeout = timeout
+        self.connections_per_host = connections_per_host
+        self.metrics = metrics or get_metrics()
+        self.breakers = breakers or get_breakers()
+        self.sessions = {}
+
+    def session(self, url):
+        host = URL(url).host
+        session = self.sessions.get(host)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.connections_per_host, ttl_dns_cache=300)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self.sessions[host] = session
+        return session
+
+    @asynccontextmanager
+    async def request(self, url, params=None, headers=None, timeout=None):
+        """The open response, timed as a span, counted by host and status, and refused with
+        CircuitOpenError while the host's circuit is open"""
+        host = URL(url).host
+        breaker = self.breakers.get(host)
+        try:
+            breaker.before()
+        except CircuitOpenError:
+            self.metrics.count_upstream(host, "circuit_open")
+            raise
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        failed = True  # until a response says otherwise; a cancelled request counts against the upstream
+        start = time.perf_counter()
+        with self.metrics.span(upstream_stage(url)):
+            try:
+                async with self.session(url).get(url, params=params, headers=headers, timeout=request_timeout) as response:
+                    self.metrics.count_upstream(host, response.status)
+                    failed = upstream_failed(response.status)
+                    yield response
+            except asyncio.TimeoutError:
+                self.metrics.count_upstream(host, "timeout")
+                raise
+            except aiohttp.ClientConnectionError:
+                self.metrics.count_upstream(host, "error")
+                raise
+            finally:
+                breaker.record(failed, time.perf_counter() - start)
+
+    def degraded(self, url):
+        """Whether url's host currently has an open or half-open circuit"""
+        return self.breakers.get(URL(url).host).degraded
+
+    async def get_json(self, url, params=None, headers=None, timeout=None):
+        """GET url and decode the JSON body; raises aiohttp.ClientResponseError on non-2xx
+        and asyncio.TimeoutError when the request takes longer than timeout seconds"""
+        async with self.request(url, params, headers, timeout) as response:
+            response.raise_for_status()
+            # api.weather.gov answers with application/geo+json
+            return await response.json(content_type=None)
+
+    async def get_response(self, url, params=None, headers=None, timeout=None):
+        """(status, headers, decoded JSON or None) without raising for 304 Not Modified"""
+        async with self.request(url, params, headers, timeout) as response:
+            if response.status == 304:
+                return response.status, response.headers.copy(), None
+            response.raise_for_status()
+            return response.status, response.headers.copy(), await response.json(content_type=None)
+
+    async def close(self):
+        sessions, self.sessions = self.sessions, {}
+        await asyncio.gather(*(session.close() for session in sessions.values()))
+
+
+def get_sync(url, params=None, headers=None, timeout=HTTP_TIMEOUT, breakers=None, metrics=None):
+    """requests.get with a timeout, behind the same per-host circuit breakers and counters as
+    AsyncNoaaClient. Raises requests.RequestException (CircuitOpenError included)."""
+    host = URL(url).host
+    breaker = (breakers or get_breakers()).get(host)
+    metrics = metrics or get_metrics()
+    try:
+        breaker.before()
+    except CircuitOpenError:
+        metrics.count_upstream(host, "circuit_open")
+        raise
+    failed = True
+    start = time.perf_counter()
+    with metrics.span(upstream_stage(url)):
+        try:
+            response = requests.get(url, params=params, headers=headers, timeout=timeout)
+            metrics.count_upstream(host, response.status_code)
+            failed = upstream_failed(response.status_code)
+            return response
+        except requests.Timeout:
+            metrics.count_upstream(host, "timeout")
+            raise
+        except requests.ConnectionError:
+            metrics.count_upstream(host, "error")
+            raise
+        finally:
+            breaker.record(failed, time.perf_counter() - start)
+
+
+_client = None
+
+def get_async_client():
+    global _client
+    if _client is None:
+        _client = AsyncNoaaClient()
+    return _client
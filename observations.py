@@ -0,0 +1,295 @@
+import argparse, asyncio, fcntl, os, threading, time
+from datetime import datetime, timezone
+import aiohttp
+import numpy as np
+
+# Append-only observation history, one pair of column files per station and product:
+#     <OBSERVATIONS_DIR>/<product>/<station>.t   int64 epoch seconds (UTC), ascending
+#     <OBSERVATIONS_DIR>/<product>/<station>.v   float32 value (°F, or ft above MLLW)
+# Queries memory-map the columns, so nothing is parsed and nothing is fetched to answer them.
+#     python observations.py 8723214 --product water_temperature   # fetch what's new, print the last week
+OBSERVATIONS_DIR = os.getenv("OBSERVATIONS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "observations")
+OBSERVATIONS_BACKFILL_DAYS = int(os.getenv("OBSERVATIONS_BACKFILL_DAYS") or 45)  # first fetch: enough for a 30-day baseline
+OBSERVATIONS_EMPTY_RETRY = float(os.getenv("OBSERVATIONS_EMPTY_RETRY") or 6 * 3600)  # seconds before asking a silent station again
+DATAGETTER_URL = "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter"
+
+# datagetter product -> station list that reports it
+PRODUCTS = {"water_temperature": "watertemp", "water_level": "waterlevels"}
+SAMPLE_SECONDS = 360       # NOAA's 6-minute observations
+MAX_REQUEST_DAYS = 30      # the datagetter refuses longer 6-minute ranges
+ANOMALY_BASELINE_DAYS = 30
+TREND_RADIUS_KM = 100
+UNITS = {"water_temperature": "°F", "water_level": "ft"}
+
+
+def observation_params(product, station_id, begin, end):
+    params = {
+        "begin_date": datetime.fromtimestamp(begin, timezone.utc).strftime('%Y%m%d %H:%M'),
+        "end_date": datetime.fromtimestamp(end, timezone.utc).strftime('%Y%m%d %H:%M'),
+        "station": station_id,
+        "product": product,
+        "units": "english",
+        "time_zone": "gmt",
+        "format": "json",
+    }
+    if product == "water_level":
+        params["datum"] = "MLLW"
+    return params
+
+
+def parse_observations(data):
+    """(epochs, values) from a datagetter payload, skipping the blanks NOAA reports for gaps"""
+    rows = [(row["t"], row["v"]) for row in (data or {}).get("data", []) if row.get("v") not in (None, "")]
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.float32)
+    times = np.array([t for t, _ in rows], dtype="datetime64[s]").astype(np.int64)
+    return times, np.array([float(v) for _, v in rows], dtype=np.float32)
+
+
+def fetch_ranges(last, now, backfill_days=OBSERVATIONS_BACKFILL_DAYS):
+    """(begin, end) windows covering what's missing after `last`, each short enough for one request"""
+    begin = last + SAMPLE_SECONDS if last is not None else now - backfill_days * 86400
+    ranges = []
+    while begin <= now:
+        end = min(now, begin + MAX_REQUEST_DAYS * 86400 - SAMPLE_SECONDS)
+        ranges.append((begin, end))
+        begin = end + SAMPLE_SECONDS
+    return ranges
+
+
+##### COLUMNAR STORE #####
+class ObservationStore:
+    def __init__(self, directory=OBSERVATIONS_DIR, http=None, clock=time.time):
+        self.directory = directory
+        self.http = http
+        self.clock = clock
+        self.fetches = 0
+        self.appended = 0
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, product, station_id):
+        base = os.path.join(self.directory, product, str(station_id))
+        return base + ".t", base + ".v"
+
+    def columns(self, product, station_id):
+        """Memory-mapped (epochs, values), empty if nothing has been stored"""
+        t_path, v_path = self._paths(product, station_id)
+        if not os.path.exists(t_path) or os.path.getsize(t_path) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        # Map whole records only: a torn append can leave a partial one at the end of either file
+        times = self._map(t_path, np.int64)
+        values = self._map(v_path, np.float32)
+        # A crash between the two appends leaves one column longer; the shorter one is the truth
+        n = min(len(times), len(values))
+        return times[:n], values[:n]
+
+    @staticmethod
+    def _map(path, dtype):
+        count = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,)) if count else np.empty(0, dtype)
+
+    def last_time(self, product, station_id):
+        times, _ = self.columns(product, station_id)
+        return int(times[-1]) if len(times) else None
+
+    def append(self, product, station_id, times, values):
+        """Append samples newer than the last stored one; returns how many were written"""
+        t_path, v_path = self._paths(product, station_id)
+        os.makedirs(os.path.dirname(t_path), exist_ok=True)
+        with open(t_path, "ab") as t_file, open(v_path, "ab") as v_file:
+            # Shards may update the same station; the lock keeps their appends from interleaving
+            fcntl.flock(t_file, fcntl.LOCK_EX)
+            try:
+                last = self.last_time(product, station_id)
+                order = np.argsort(times, kind="stable")
+                times, values = np.asarray(times, np.int64)[order], np.asarray(values, np.float32)[order]
+                keep = np.ones(len(times), bool) if last is None else times > last
+                keep[1:] &= times[1:] != times[:-1]
+                times, values = times[keep], values[keep]
+                if len(times):
+                    self._truncate_to_times(t_path, v_path)
+                    v_file.write(values.tobytes())
+                    v_file.flush()
+                    t_file.write(times.tobytes())
+                    t_file.flush()
+            finally:
+                fcntl.flock(t_file, fcntl.LOCK_UN)
+        self.appended += len(times)
+        return len(times)
+
+    @staticmethod
+    def _truncate_to_times(t_path, v_path):
+        # Drop whatever a torn earlier append left past the last complete sample
+        count = min(os.path.getsize(t_path) // 8, os.path.getsize(v_path) // 4)
+        if os.path.getsize(t_path) != count * 8:
+            os.truncate(t_path, count * 8)
+        if os.path.getsize(v_path) != count * 4:
+            os.truncate(v_path, count * 4)
+
+    def checked_empty(self, product, station_id):
+        """When a backfill last found nothing for the station, or None"""
+        path = os.path.join(self.directory, product, f"{station_id}.empty")
+        try:
+            with open(path) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def mark_empty(self, product, station_id, now):
+        path = os.path.join(self.directory, product, f"{station_id}.empty")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(str(now))
+
+    def _station_lock(self, product, station_id):
+        with self._lock:
+            return self._locks.setdefault((product, str(station_id)), asyncio.Lock())
+
+    async def update_async(self, product, station_id):
+        """Fetch only what's newer than the last stored sample; returns samples added. The
+        file reads, writes and flock run in a worker thread, off the event loop."""
+        async with self._station_lock(product, station_id):
+            added = 0
+            now = self.clock()
+            last = await asyncio.to_thread(self.last_time, product, station_id)
+            if last is None:
+                # A station that reported nothing for the whole backfill isn't asked again for a while
+                checked = await asyncio.to_thread(self.checked_empty, product, station_id)
+                if checked is not None and now - checked < OBSERVATIONS_EMPTY_RETRY:
+                    return 0
+            for begin, end in fetch_ranges(last, now):
+                self.fetches += 1
+                data = await self.http.get_json(DATAGETTER_URL, params=observation_params(product, station_id, begin, end))
+                added += await asyncio.to_thread(lambda: self.append(product, station_id, *parse_observations(data)))
+            if last is None and not added:
+                await asyncio.to_thread(self.mark_empty, product, station_id, now)
+            return added
+
+    ##### QUERIES #####
+    def range(self, product, station_id, begin, end):
+        """(epochs, values) with begin <= epoch < end"""
+        times, values = self.columns(product, station_id)
+        lo, hi = np.searchsorted(times, [begin, end])
+        return np.asarray(times[lo:hi]), np.asarray(values[lo:hi])
+
+    def daily(self, product, station_id, begin, end, utc_offset_hours=0):
+        """Per local day: (day start epochs, min, max, mean, count) arrays"""
+        times, values = self.range(product, station_id, begin, end)
+        if not len(times):
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty, empty, empty.astype(np.int64)
+        offset = int(utc_offset_hours * 3600)
+        days = (times + offset) // 86400
+        # Samples are sorted, so each day is one contiguous run
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        counts = np.diff(np.r_[starts, len(days)])
+        values = values.astype(np.float64)
+        return (days[starts] * 86400 - offset, np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts),
+                np.add.reduceat(values, starts) / counts, counts)
+
+    def anomalies(self, product, station_id, days=7, baseline_days=ANOMALY_BASELINE_DAYS, utc_offset_hours=0, now=None):
+        """Each of the last `days` local days' mean against the mean of the `baseline_days` days
+        before it, as a list of dicts (oldest first)"""
+        now = self.clock() if now is None else now
+        offset = int(utc_offset_hours * 3600)
+        today = (int(now) + offset) // 86400 * 86400 - offset
+        first = today - (days - 1) * 86400
+        starts, lows, highs, means, counts = self.daily(product, station_id, first - baseline_days * 86400, today + 86400, utc_offset_hours)
+        results = []
+        for start, low, high, mean, count in zip(starts.tolist(), lows.tolist(), highs.tolist(), means.tolist(), counts.tolist()):
+            if start < first:
+                continue
+            window = (starts >= start - baseline_days * 86400) & (starts < start)
+            baseline = means[window]
+            results.append({
+                "day": start, "min": low, "max": high, "mean": mean, "samples": count,
+                "baseline_mean": float(baseline.mean()) if len(baseline) else None,
+                "anomaly": mean - float(baseline.mean()) if len(baseline) else None,
+                "zscore": (mean - float(baseline.mean())) / float(baseline.std()) if len(baseline) > 1 and baseline.std() > 0 else None,
+            })
+        return results
+
+    def stats(self):
+        return {"fetches": self.fetches, "appended": self.appended}
+
+
+_observations = None
+
+def get_observation_store(http=None):
+    global _observations
+    if _observations is None:
+        _observations = ObservationStore(http=http)
+    return _observations
+
+
+##### /trend REPORT #####
+def format_trend(station, distance, product, days, utc_offset_hours):
+    unit = UNITS[product]
+    label = "Water temperature" if product == "water_temperature" else "Water level (MLLW)"
+    output = [f"__**{label} at {station.name}** ({station.id}, {round(distance)} km)__"]
+    if not days:
+        output.append("No observations stored for this station yet.")
+        return "\n".join(output)
+    for day in days:
+        date = datetime.fromtimestamp(day["day"] + utc_offset_hours * 3600, timezone.utc).strftime('%a %m/%d')
+        versus = f" ({day['anomaly']:+.1f}{unit} vs prior 30 days)" if day["anomaly"] is not None else ""
+        output.append(f"- {date}: {day['min']:.1f}–{day['max']:.1f}{unit}, mean {day['mean']:.1f}{unit}{versus}")
+    anomalies = [day["anomaly"] for day in days if day["anomaly"] is not None]
+    if anomalies:
+        change = sum(anomalies) / len(anomalies)
+        words = ("warmer", "cooler") if product == "water_temperature" else ("higher", "lower")
+        trend = words[0] if change > 0 else words[1]
+        output.append(f"\nThese {len(days)} days ran {abs(change):.1f}{unit} {trend} than the 30 days before them.")
+    return "\n".join(output)
+
+
+class TrendReport:
+    """Daily ranges and anomalies for the station nearest a place, from the local history
+    after fetching whatever is new since its last sample"""
+
+    def __init__(self, w, store=None):
+        self.w = w
+        self.store = store or get_observation_store(w.http)
+
+    async def run(self, city, state, product="water_temperature", days=7):
+        """The rendered report, or None when no station near the place reports the product"""
+        lat, lng = await self.w.fetch_lat_long_for_city_async(city, state)
+        found = self.w.index.nearest(lat, lng, k=1, radius_km=TREND_RADIUS_KM, product=PRODUCTS[product])
+        if not found:
+            return None
+        distance, station = found[0]
+        try:
+            await self.store.update_async(product, station.id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Whatever is already on disk still answers the question
+            print(f"Could not update {product} history for station {station.id}: {e}")
+        offset = self.w.station_offset(station)
+        days = await asyncio.to_thread(self.store.anomalies, product, station.id, days=days, utc_offset_hours=offset)
+        return format_trend(station, distance, product, days, offset)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update and query the local observation history")
+    parser.add_argument("stations", nargs="+")
+    parser.add_argument("--product", choices=list(PRODUCTS), default="water_temperature")
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    async def main():
+        from noaa_client import AsyncNoaaClient
+        client = AsyncNoaaClient()
+        store = ObservationStore(http=client)
+        try:
+            for station_id in args.stations:
+                start = time.perf_counter()
+                added = await store.update_async(args.product, station_id)
+                print(f"{station_id}: {added} new samples in {time.perf_counter() - start:.2f}s")
+                for day in store.anomalies(args.product, station_id, days=args.days):
+                    anomaly = f"{day['anomaly']:+.2f}" if day["anomaly"] is not None else "n/a"
+                    print(f"  {datetime.fromtimestamp(day['day'], timezone.utc):%Y-%m-%d}  min {day['min']:.2f}  "
+                          f"max {day['max']:.2f}  mean {day['mean']:.2f}  vs 30 days {anomaly}")
+        finally:
+            await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+import asyncio, os, time
+from cache import TTLCache
+from geocache import normalize_place
+from metrics import get_metrics
+from weather import DATA_UNAVAILABLE, OBSERVATION_TTL
+
+# Seconds each upstream gets before the report goes out without it
+SOURCE_DEADLINES = {
+    "tides": float(os.getenv("TIDES_DEADLINE") or 6),
+    "water_temp": float(os.getenv("WATER_TEMP_DEADLINE") or 4),
+    "forecast": float(os.getenv("FORECAST_DEADLINE") or 6),
+    "currents": float(os.getenv("CURRENTS_DEADLINE") or 6),
+}
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE") or 512)
+
+
+async def gather_with_deadlines(sources, deadlines):
+    """Run {name: coroutine} concurrently. Returns ({name: result}, {name: reason}); a source
+    that raised or missed its deadline is reported as None with the reason recorded."""
+    names = list(sources)
+
+    async def bounded(name):
+        return await asyncio.wait_for(sources[name], deadlines.get(name))
+
+    outcomes = await asyncio.gather(*(bounded(name) for name in names), return_exceptions=True)
+    results, failures = {}, {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            results[name], failures[name] = None, "timed out"
+        elif isinstance(outcome, Exception):
+            results[name], failures[name] = None, f"{type(outcome).__name__}: {outcome}"
+        else:
+            results[name] = outcome
+    return results, failures
+
+
+##### /weather REQUEST PIPELINE #####
+class ReportPipeline:
+    """Resolve the location once, then fetch tides, water temperature and the NWS
+    forecast side by side, so a report costs the slowest source rather than the sum."""
+
+    def __init__(self, w, deadlines=None, report_cache=None, metrics=None):
+        self.w = w
+        self.metrics = metrics or get_metrics()
+        self.deadlines = {**SOURCE_DEADLINES, **(deadlines or {})}
+        # Finished reports, reused until the first of their inputs goes stale
+        self.report_cache = report_cache if report_cache is not None else TTLCache("rendered_reports", max_entries=REPORT_CACHE_SIZE)
+        self.time_saved = 0.0
+
+    async def report_key(self, station_id, lat, lon, city, state):
+        """(station, NWS grid cell, place) once the grid cell is known, else None. The place is
+        part of the key because the report names it."""
+        points_key, _ = self.w.nws_points(lat, lon)
+        forecast_url = await self.w.nws_points_cache.get_async(points_key)
+        return None if forecast_url is None else (str(station_id), forecast_url, *normalize_place(city, state))
+
+    def report_expiry(self, station_id, forecast_url):
+        now = time.time()
+        expiries = [
+            self.w.observation_cache.expiry(str(station_id)) or now + OBSERVATION_TTL,
+            self.w.nws_forecast_cache.expiry(forecast_url),
+            self.w.station_midnight(station_id, now),
+        ]
+        return min(expiry for expiry in expiries if expiry is not None)
+
+    def stats(self):
+        return {**self.report_cache.stats(), "time_saved_s": round(self.time_saved, 3)}
+
+    def sources(self, station_id, lat, lon):
+        return {
+            "tides": self.metrics.timed("tides", self.w.fetch_tide_predictions_async(station_id)),
+            "water_temp": self.metrics.timed("water_temp", self.w.fetch_water_temperature_async(station_id)),
+            "forecast": self.metrics.timed("forecast", self.w.forecast_for_coords_async(lat, lon)),
+        }
+
+    async def run(self, city, state):
+        """The rendered report, or None when there is no NOAA station near the location"""
+        with self.metrics.span("geocode"):
+            lat, lon = await self.w.fetch_lat_long_for_city_async(city, state)
+        with self.metrics.span("nearest_station"):
+            station_id, station_msg = self.w.nearest_station_message(lat, lon, city, state)
+        if not station_id:
+            return None
+
+        key = await self.report_key(station_id, lat, lon, city, state)
+        cached = await self.report_cache.get_async(key) if key is not None else None
+        if cached is not None:
+            self.time_saved += cached["cost"]
+            return cached["report"]
+
+        start = time.perf_counter()
+        # Last good payloads as of now, for sources that fail or miss their deadline
+        fallbacks = {"water_temp": await self.w.stale_water_temperature_async(station_id),
+                     "forecast": await self.w.stale_forecast_async(lat, lon)}
+        results, failures = await gather_with_deadlines(self.sources(station_id, lat, lon), self.deadlines)
+        for name, reason in failures.items():
+            print(f"{name} for station {station_id} unavailable after {time.perf_counter() - start:.2f}s: {reason}")
+        if results["tides"] is None:
+            # Missing the deadline leaves no time for a round-trip, but the harmonic engine needs none
+            with self.metrics.span("harmonic_tides"):
+                results["tides"] = await self.w.local_tide_predictions_async(station_id)
+        if results["water_temp"] is None:
+            results["water_temp"] = fallbacks["water_temp"]
+        if results["forecast"] is None:
+            results["forecast"] = fallbacks["forecast"]
+
+        forecast = results["forecast"][0] if results["forecast"] else f"__**Today's Weather Forecast:**__\nForecast: {DATA_UNAVAILABLE}\n"
+        with self.metrics.span("format_tide_data"):
+            report = self.w.format_tide_data(results["tides"], results["water_temp"], city, state,
+                                             forecast=forecast, station_msg=station_msg)
+
+        # Degraded reports aren't kept, so the next request gets another go at the missing source
+        complete = (not failures and results["water_temp"] and not results["water_temp"].get("stale")
+                    and (results["tides"] or {}).get("source") != "harmonic")
+        key = key or await self.report_key(station_id, lat, lon, city, state)
+        if complete and key is not None:
+            self.report_cache.set(key, {"report": report, "cost": time.perf_counter() - start},
+                                  expires=self.report_expiry(station_id, key[1]))
+        return report
+
+    async def run_currents(self, city, state, depth=None):
+        """The rendered /currents report, or None when there is no current station near the location"""
+        lat, lon = await self.w.fetch_lat_long_for_city_async(city, state)
+        station, current_bin, distance = self.w.nearest_current_station(lat, lon, depth)
+        if station is None:
+            return None
+
+        results, failures = await gather_with_deadlines(
+            {"currents": self.w.fetch_current_predictions_async(station.id, current_bin[0])}, self.deadlines)
+        for name, reason in failures.items():
+            print(f"{name} for station {station.id} unavailable: {reason}")
+        return self.w.format_current_data(results["currents"], station, current_bin, distance, city, state)
@@ -0,0 +1,183 @@
+import asyncio, os, re, time
+from datetime import datetime, timedelta
+import numpy as np
+from pipeline import SOURCE_DEADLINES, gather_with_deadlines
+
+# How much each factor counts towards a window's score (they're each scored 0..1)
+PLAN_WEIGHTS = {"tide": 0.5, "water_temp": 0.2, "wind": 0.3}
+PLAN_MAX_SITES = int(os.getenv("PLAN_MAX_SITES") or 20)
+PLAN_DAY_START, PLAN_DAY_END = 7, 18  # local hours a dive can start
+PLAN_STEP_MINUTES = 30
+SLACK_HOURS = 1.0      # a window this far from high/low water scores e^-1 of a slack one
+LOW_SLACK_WEIGHT = 0.8  # high slack usually brings the clearer water
+WATER_TEMP_RANGE = (60.0, 80.0)  # °F scored 0 → 1
+WIND_RANGE = (5.0, 20.0)         # mph scored 1 → 0
+UNKNOWN_SCORE = 0.5              # no nearby sensor, or past the NWS forecast horizon
+
+
+def parse_sites(text):
+    """'Key Largo, FL; Jupiter, FL' -> [("Key Largo", "FL"), ("Jupiter", "FL")]"""
+    sites = []
+    for part in re.split(r"[;\n]", text):
+        city, _, state = part.rpartition(",")
+        if city.strip() and state.strip():
+            sites.append((city.strip(), state.strip()))
+    return sites
+
+
+def wind_mph(wind_speed):
+    """Upper bound of an NWS windSpeed string such as '5 to 10 mph'"""
+    speeds = [int(value) for value in re.findall(r"\d+", wind_speed or "")]
+    return max(speeds) if speeds else np.nan
+
+
+def score_windows(window_epochs, event_epochs, event_weights, water_temps, winds, weights=PLAN_WEIGHTS):
+    """Score every (site, day, window) at once.
+
+    window_epochs: (sites, days, windows) unix times of candidate dive starts
+    event_epochs / event_weights: (sites, events) high/low water times, padded with nan
+    water_temps: (sites,) °F; winds: (sites, days) mph; nan where unknown
+    """
+    hours = np.abs(window_epochs[..., None] - event_epochs[:, None, None, :]) / 3600.0
+    slack = np.nan_to_num(event_weights[:, None, None, :] * np.exp(-(hours / SLACK_HOURS) ** 2), nan=0.0).max(axis=-1)
+
+    low, high = WATER_TEMP_RANGE
+    temp = np.where(np.isnan(water_temps), UNKNOWN_SCORE, np.clip((water_temps - low) / (high - low), 0, 1))
+    calm, windy = WIND_RANGE
+    wind = np.where(np.isnan(winds), UNKNOWN_SCORE, np.clip(1 - (winds - calm) / (windy - calm), 0, 1))
+
+    return (weights["tide"] * slack
+            + weights["water_temp"] * temp[:, None, None]
+            + weights["wind"] * wind[:, :, None])
+
+
+##### DIVE WINDOW PLANNER #####
+class DivePlanner:
+    """Ranks dive windows over days × sites. Each tide station, water temperature sensor and
+    NWS grid cell is fetched once for the whole plan, through the same caches as /weather."""
+
+    def __init__(self, w, weights=None, deadlines=None):
+        self.w = w
+        self.weights = {**PLAN_WEIGHTS, **(weights or {})}
+        self.deadlines = {**SOURCE_DEADLINES, **(deadlines or {})}
+
+    async def locate(self, sites):
+        coords = await asyncio.gather(*(self.w.fetch_lat_long_for_city_async(city, state) for city, state in sites),
+                                      return_exceptions=True)
+        located = [(site, coord) for site, coord in zip(sites, coords) if not isinstance(coord, Exception) and coord[0] is not None]
+        for site, coord in zip(sites, coords):
+            if isinstance(coord, Exception):
+                print(f"Could not locate {site[0]}, {site[1]} for the plan: {coord}")
+        return located
+
+    async def gather(self, sources):
+        """Run {(kind, key): coroutine} with the per-kind deadlines"""
+        results, failures = await gather_with_deadlines(sources, {name: self.deadlines[name[0]] for name in sources})
+        for (kind, key), reason in failures.items():
+            print(f"{kind} for {key} unavailable for the plan: {reason}")
+        return results
+
+    async def tide_predictions(self, station_id, days):
+        # A week of hi/lo is derived locally when the station's harmonic constants are cached
+        local = await self.w.local_tide_predictions_async(station_id, self.w.tide_prediction_params(station_id, days))
+        return local if local is not None else await self.w.fetch_tide_predictions_async(station_id, days)
+
+    def tide_events(self, tide_data, tz):
+        events = []
+        for prediction in (tide_data or {}).get("predictions", []):
+            local = tz.localize(datetime.strptime(prediction["t"], '%Y-%m-%d %H:%M'))
+            events.append((local.timestamp(), 1.0 if prediction["type"] == "H" else LOW_SLACK_WEIGHT, prediction["type"]))
+        return events
+
+    def daily_winds(self, forecast_data, dates):
+        winds = {}
+        for period in ((forecast_data or {}).get("properties") or {}).get("periods", []):
+            if period.get("isDaytime", True) and period.get("startTime"):
+                winds.setdefault(period["startTime"][:10], wind_mph(period.get("windSpeed")))
+        return [winds.get(date.isoformat(), np.nan) for date in dates]
+
+    async def plan(self, sites, days=7, top=10, now=None):
+        """Best window per site and day, ranked best first"""
+        located = await self.locate(sites[:PLAN_MAX_SITES])
+        if not located:
+            return []
+        lats = np.array([coord[0] for _, coord in located])
+        lngs = np.array([coord[1] for _, coord in located])
+        tide_ids, _ = self.w.index.nearest_batch(lats, lngs, product="tidepredictions")
+        temp_ids, temp_distances = self.w.index.nearest_with_fallback_batch(lats, lngs, preferred="watertemp", fallback="physocean")
+        temp_ids[temp_distances > 50] = None
+
+        # One request per distinct station / grid cell, however many sites share it
+        grid_urls = await self.gather({("forecast", (lat, lng)): self.w.forecast_url_async(lat, lng)
+                                       for lat, lng in set(zip(lats.tolist(), lngs.tolist()))})
+        sources = {("tides", station_id): self.tide_predictions(station_id, days) for station_id in set(tide_ids) if station_id}
+        sources.update({("water_temp", station_id): self.w.fetch_water_temperature_async(station_id) for station_id in set(temp_ids) if station_id})
+        sources.update({("forecast", url): self.w.fetch_forecast_async(url) for url in set(grid_urls.values()) if url})
+        results = await self.gather(sources)
+
+        now = now if now is not None else time.time()
+        offsets = np.arange(PLAN_DAY_START * 60, PLAN_DAY_END * 60, PLAN_STEP_MINUTES) * 60.0
+        stations = [self.w.catalog.get(station_id) for station_id in tide_ids]
+        zones = [self.w.station_timezone(station) for station in stations]
+        dates = [[(datetime.fromtimestamp(now, tz).date() + timedelta(days=day)) for day in range(days)] for tz in zones]
+
+        midnights = np.array([[tz.localize(datetime.combine(date, datetime.min.time())).timestamp() for date in site_dates]
+                              for tz, site_dates in zip(zones, dates)])
+        window_epochs = midnights[:, :, None] + offsets[None, None, :]
+
+        events = [self.tide_events(results.get(("tides", station_id)), tz) for station_id, tz in zip(tide_ids, zones)]
+        width = max([len(site_events) for site_events in events] + [1])
+        event_epochs = np.full((len(located), width), np.nan)
+        event_weights = np.full((len(located), width), np.nan)
+        for row, site_events in enumerate(events):
+            if site_events:
+                event_epochs[row, :len(site_events)] = [event[0] for event in site_events]
+                event_weights[row, :len(site_events)] = [event[1] for event in site_events]
+
+        water_temps = np.array([self.latest_water_temp(results.get(("water_temp", station_id))) for station_id in temp_ids])
+        winds = np.array([self.daily_winds(results.get(("forecast", grid_urls.get(("forecast", (lat, lng))))), site_dates)
+                          for lat, lng, site_dates in zip(lats.tolist(), lngs.tolist(), dates)], dtype=float).reshape(len(located), days)
+
+        scores = score_windows(window_epochs, event_epochs, event_weights, water_temps, winds, self.weights)
+        scores[window_epochs < now] = -np.inf  # today's windows that have already gone by
+        best_window = np.argmax(scores, axis=2)
+        best_score = np.take_along_axis(scores, best_window[..., None], axis=2)[..., 0]
+
+        ranked = []
+        for flat in np.argsort(-best_score, axis=None, kind="stable")[:top]:
+            site_row, day = np.unravel_index(flat, best_score.shape)
+            if not np.isfinite(best_score[site_row, day]):
+                break
+            start = window_epochs[site_row, day, best_window[site_row, day]]
+            (city, state), _ = located[site_row]
+            slack = min(events[site_row], key=lambda event: abs(event[0] - start)) if events[site_row] else None
+            ranked.append({
+                "city": city,
+                "state": state,
+                "station_id": tide_ids[site_row],
+                "start": datetime.fromtimestamp(start, zones[site_row]),
+                "slack": (datetime.fromtimestamp(slack[0], zones[site_row]), slack[2]) if slack else None,
+                "water_temp": None if np.isnan(water_temps[site_row]) else float(water_temps[site_row]),
+                "wind_mph": None if np.isnan(winds[site_row, day]) else float(winds[site_row, day]),
+                "score": round(float(best_score[site_row, day]), 3),
+            })
+        return ranked
+
+    @staticmethod
+    def latest_water_temp(water_temp_data):
+        readings = [reading.get("v") for reading in (water_temp_data or {}).get("data", []) if reading.get("v")]
+        return float(readings[-1]) if readings else np.nan
+
+    def format_plan(self, ranked, days):
+        output = [f">>> ## __DiveBot Dive Plan for the next {days} day{'s' if days != 1 else ''}__\n"]
+        if not ranked:
+            output.append("No dive windows found for those sites.")
+        for place, entry in enumerate(ranked, 1):
+            details = [entry["start"].strftime('%a %m/%d at %I:%M %p')]
+            if entry["slack"]:
+                slack_time, tide_type = entry["slack"]
+                details.append(f"{'high' if tide_type == 'H' else 'low'} slack {slack_time.strftime('%I:%M %p')}")
+            details.append(f"water {entry['water_temp']}°F" if entry["water_temp"] is not None else "water temp n/a")
+            details.append(f"wind {entry['wind_mph']:.0f} mph" if entry["wind_mph"] is not None else "wind n/a")
+            output.append(f"{place}. **{entry['city'].title()}, {entry['state'].upper()}** - {', '.join(details)} (score {entry['score']:.2f})")
+        return "\n".join(output)
@@ -0,0 +1,164 @@
+import asyncio, os, threading, time
+from cache import TTLCache, shared_store
+
+PREFETCH_STATIONS = int(os.getenv("PREFETCH_STATIONS") or 20)  # 0 disables the warm-up loop
+PREFETCH_BUDGET = float(os.getenv("PREFETCH_BUDGET") or 120)    # upstream requests per hour, at most
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL") or 60)  # seconds between passes
+POPULARITY_HALF_LIFE = 7 * 24 * 3600  # last week's favourite site shouldn't outrank today's
+POPULARITY_PUBLISH_SECONDS = float(os.getenv("POPULARITY_PUBLISH_SECONDS") or 60)  # how often a shard shares its counts
+SHARD_ID = int(os.getenv("SHARD_ID") or 0)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 1)
+
+
+##### STATION POPULARITY #####
+class StationPopularity:
+    """Exponentially decaying count of how often each station answers a lookup. With a shared
+    cache, each shard publishes its counts there so top_all_shards can rank every shard's traffic."""
+
+    def __init__(self, half_life=POPULARITY_HALF_LIFE, max_stations=1024, clock=time.time, shared=None,
+                 shard_id=SHARD_ID, shard_count=SHARD_COUNT, publish_every=POPULARITY_PUBLISH_SECONDS):
+        self.half_life = half_life
+        self.max_stations = max_stations
+        self.clock = clock
+        self.shared = shared
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.publish_every = publish_every
+        self.published = None
+        self.scores = {}  # station id -> (score, last updated)
+        self._lock = threading.Lock()
+
+    def _decayed(self, score, updated, now):
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record(self, station_id):
+        now = self.clock()
+        with self._lock:
+            score, updated = self.scores.get(str(station_id), (0.0, now))
+            self.scores[str(station_id)] = (self._decayed(score, updated, now) + 1.0, now)
+            if len(self.scores) > self.max_stations:
+                coldest = min(self.scores, key=lambda key: self._decayed(*self.scores[key], now))
+                del self.scores[coldest]
+            publish = self.shared is not None and (self.published is None or now - self.published >= self.publish_every)
+        if publish:
+            self.publish()
+
+    def publish(self):
+        """Share this shard's counts; from the event loop the store write happens behind"""
+        now = self.clock()
+        with self._lock:
+            scores = dict(self.scores)
+            self.published = now
+        self.shared.set(f"shard:{self.shard_id}", scores, expires=now + self.half_life)
+
+    def top(self, n):
+        """The n most popular stations by this process's lookups"""
+        now = self.clock()
+        with self._lock:
+            ranked = sorted(self.scores.items(), key=lambda item: -self._decayed(*item[1], now))
+        return [station_id for station_id, _ in ranked[:n]]
+
+    async def top_all_shards(self, n):
+        """The n most popular stations by every shard's lookups, as last published"""
+        if self.shared is None or self.shard_count <= 1:
+            return self.top(n)
+        now = self.clock()
+        with self._lock:
+            totals = {station_id: self._decayed(*entry, now) for station_id, entry in self.scores.items()}
+        for shard in range(self.shard_count):
+            if shard == self.shard_id:
+                continue
+            # Straight from the store: the memory tier would keep serving the first copy it saw
+            stored = await self.shared.store_call_async("get", self.shared.store_key(f"shard:{shard}"))
+            if stored is None or stored[1] <= now:
+                continue
+            for station_id, (score, updated) in stored[0].items():
+                totals[station_id] = totals.get(station_id, 0.0) + self._decayed(score, updated, now)
+        return sorted(totals, key=lambda station_id: -totals[station_id])[:n]
+
+
+_popularity = None
+
+def get_station_popularity():
+    global _popularity
+    if _popularity is None:
+        # One process has nothing to share
+        store = shared_store("station_popularity") if SHARD_COUNT > 1 else None
+        _popularity = StationPopularity(shared=TTLCache("station_popularity", max_entries=SHARD_COUNT, store=store) if store else None)
+    return _popularity
+
+
+##### BACKGROUND PREFETCH #####
+class PrefetchScheduler:
+    """Keeps the most requested stations warm: tide predictions are fetched again as soon as
+    the station's day rolls over (they expire at local midnight), and water temperature is
+    refreshed just before its observation entry expires. A token bucket caps the upstream
+    requests this costs; the most popular stations get the tokens first."""
+
+    def __init__(self, w, popularity=None, stations=PREFETCH_STATIONS, budget=PREFETCH_BUDGET,
+                 interval=PREFETCH_INTERVAL, clock=time.time):
+        self.w = w
+        self.popularity = popularity or get_station_popularity()
+        self.stations = stations
+        self.budget = budget
+        self.interval = interval
+        self.clock = clock
+        self.tokens = budget
+        self.refilled = clock()
+        self.counts = {"tides": 0, "water_temp": 0, "over_budget": 0, "errors": 0}
+
+    def take_token(self):
+        now = self.clock()
+        self.tokens = min(self.budget, self.tokens + (now - self.refilled) * self.budget / 3600.0)
+        self.refilled = now
+        if self.tokens < 1:
+            self.counts["over_budget"] += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def due(self, station_id, now):
+        """Which of a station's cached inputs need fetching before the next pass"""
+        jobs = []
+        station = self.w.catalog.get(station_id)
+        if station is None:
+            return jobs
+        if station.supports("tidepredictions"):
+            expires = self.w.tide_cache.expiry(self.w.tide_cache_key(self.w.tide_prediction_params(station_id)))
+            if expires is None or expires <= now:
+                jobs.append("tides")
+        if station.supports("watertemp") or station.supports("physocean"):
+            expires = self.w.observation_cache.expiry(str(station_id))
+            if expires is None or expires - now < self.interval:
+                jobs.append("water_temp")
+        return jobs
+
+    async def warm(self, station_id, job):
+        try:
+            if job == "tides":
+                await self.w.fetch_tide_predictions_async(station_id)
+            else:
+                # Through the single-flight, so a user asking at the same moment shares the request
+                await self.w.observation_flight.do(str(station_id), lambda: self.w._fetch_water_temperature_upstream(station_id))
+            self.counts[job] += 1
+        except Exception as e:
+            self.counts["errors"] += 1
+            print(f"Prefetch of {job} for station {station_id} failed: {e}")
+
+    async def tick(self):
+        now = self.clock()
+        work = []
+        for station_id in await self.popularity.top_all_shards(self.stations):
+            for job in self.due(station_id, now):
+                if not self.take_token():
+                    return await asyncio.gather(*work)
+                work.append(self.warm(station_id, job))
+        return await asyncio.gather(*work)
+
+    async def run(self):
+        while True:
+            await self.tick()
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {**self.counts, "tokens": round(self.tokens, 1), "tracked_stations": len(self.popularity.scores)}
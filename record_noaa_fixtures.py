@@ -0,0 +1,111 @@
+import argparse, json, os, re
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import requests
+from cache import TTLCache
+from harmonics import HARMONICS_TTL, HarmonicPredictor
+from weather import BASE_URL, HEADERS, WATER_TEMP_URL
+
+# Records NOAA's harmonic constants and hilo predictions for test_harmonics.py, and every
+# upstream answer a report for a place needs (Nominatim, NWS points and forecast, NOAA tides,
+# water temperature and currents) for bench_commands.py to replay. Commit the output
+# (fixtures/harmonics/*.json, fixtures/upstream/*.json); CI fails without it:
+#     python record_noaa_fixtures.py                      # the default stations and places below
+#     python record_noaa_fixtures.py 8723214 9414290 --begin 20240101 --place "Key Largo, FL"
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "harmonics")
+UPSTREAM_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "upstream")
+# Reference stations at Virginia Key, the Battery, Lake Worth Pier and the Golden Gate
+DEFAULT_STATIONS = ["8723214", "8518750", "8722670", "9414290"]
+DEFAULT_PLACES = ["Key Largo, FL", "Miami, FL", "Monterey, CA", "Seattle, WA", "Morehead City, NC"]
+
+
+def record(station_id, begin, days):
+    predictor = HarmonicPredictor(TTLCache("harmonic_constants", default_ttl=HARMONICS_TTL))
+    constants = predictor.fetch_constants(station_id)
+    stations = {station_id: constants}
+    if constants["type"] == "S":
+        reference = constants["offsets"]["refStationId"]
+        stations[reference] = predictor.constants(reference)
+
+    params = {
+        "begin_date": begin.strftime('%Y%m%d'),
+        "end_date": (begin + timedelta(days=days - 1)).strftime('%Y%m%d'),
+        "station": station_id,
+        "product": "predictions",
+        "datum": "MLLW",
+        "units": "english",
+        "time_zone": "gmt",
+        "interval": "hilo",
+        "format": "json",
+    }
+    response = requests.get(BASE_URL, params=params, timeout=30)
+    response.raise_for_status()
+    fixture = {"station": station_id, "params": params, "constants": stations, "predictions": response.json()}
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(FIXTURE_DIR, f"{station_id}.json")
+    with open(path, "w") as f:
+        json.dump(fixture, f, indent=1)
+    return path, len(fixture["predictions"].get("predictions", []))
+
+
+def fetch(url, params=None, headers=None):
+    response = requests.get(url, params=params, headers=headers, timeout=30)
+    response.raise_for_status()
+    return response
+
+
+def record_place(place, w):
+    """Every upstream answer a report, forecast and currents lookup for place needs, keyed the
+    way bench_commands.py's stub looks them up"""
+    from geocache import NOMINATIM_DOMAIN, NOMINATIM_SCHEME
+    city, state = (part.strip() for part in place.rsplit(",", 1))
+    search = fetch(f"{NOMINATIM_SCHEME}://{NOMINATIM_DOMAIN}/search", headers={"User-Agent": "DiveBot"},
+                      params={"q": f"{city}, {w.convert_state_to_full_name(state)}", "format": "json", "limit": 1}).json()
+    if not search:
+        raise ValueError(f"Nominatim doesn't know {place}")
+    lat, lng = float(search[0]["lat"]), float(search[0]["lon"])
+    fixture = {"place": [city, state], "nominatim": search, "datagetter": {}, "points": {}, "forecast": {}}
+
+    station = w.index.nearest_with_fallback(lat, lng)[0]
+    tide_params = w.tide_prediction_params(station.id)
+    fixture["datagetter"][f"predictions:{station.id}"] = fetch(BASE_URL, tide_params).json()
+    fixture["datagetter"][f"water_temperature:{station.id}"] = fetch(WATER_TEMP_URL, w.water_temperature_params(station.id)).json()
+    current_station, current_bin, _ = w.nearest_current_station(lat, lng)
+    if current_station is not None:
+        params = w.current_prediction_params(current_station.id, current_bin[0])
+        fixture["datagetter"][f"currents_predictions:{current_station.id}:{current_bin[0]}"] = fetch(BASE_URL, params).json()
+
+    _, points_url = w.nws_points(lat, lng)
+    points = fetch(points_url, headers=HEADERS).json()
+    fixture["points"][points_url.rsplit("/", 1)[1]] = points
+    forecast_url = points["properties"]["forecast"]
+    forecast = fetch(forecast_url, headers=HEADERS)
+    fixture["forecast"][urlparse(forecast_url).path] = {"etag": forecast.headers.get("ETag"), "body": forecast.json()}
+
+    os.makedirs(UPSTREAM_FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(UPSTREAM_FIXTURE_DIR, re.sub(r"[^a-z0-9]+", "_", place.lower()).strip("_") + ".json")
+    with open(path, "w") as f:
+        json.dump(fixture, f, indent=1)
+    # The bench computes tides for other dates from the station's constants
+    if not os.path.exists(os.path.join(FIXTURE_DIR, f"{station.id}.json")):
+        record(station.id, datetime.utcnow(), 2)
+    return path, len(fixture["datagetter"]) + len(fixture["points"]) + len(fixture["forecast"]) + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record NOAA, NWS and Nominatim responses as test and benchmark fixtures")
+    parser.add_argument("stations", nargs="*", default=DEFAULT_STATIONS)
+    parser.add_argument("--begin", default=datetime.utcnow().strftime('%Y%m%d'), help="first day (yyyymmdd, GMT)")
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--place", action="append", help='"City, ST" to record for the benchmark (repeatable)')
+    args = parser.parse_args()
+    for station_id in args.stations:
+        path, count = record(station_id, datetime.strptime(args.begin, '%Y%m%d'), args.days)
+        print(f"Recorded {count} predictions for {station_id} to {path}")
+
+    from weather import GetDiveWeather
+    w = GetDiveWeather()
+    for place in args.place or DEFAULT_PLACES:
+        path, count = record_place(place, w)
+        print(f"Recorded {count} responses for {place} to {path}")
@@ -0,0 +1,131 @@
+import asyncio, os, random, time
+from datetime import datetime
+import aiohttp
+
+REGION_RADIUS_KM = float(os.getenv("REGION_RADIUS_KM") or 50)
+REGION_MAX_STATIONS = int(os.getenv("REGION_MAX_STATIONS") or 25)  # keeps the reply inside one Discord message
+REGION_CONCURRENCY = int(os.getenv("REGION_CONCURRENCY") or 8)
+REGION_RETRIES = int(os.getenv("REGION_RETRIES") or 2)
+REGION_BACKOFF = 0.5  # seconds before the first retry, doubled each time, with ±50% jitter
+
+REGION_PRODUCTS = ("watertemp", "tidepredictions")
+
+
+def region_stations(index, catalog, lat=None, lng=None, state=None, radius_km=REGION_RADIUS_KM, limit=REGION_MAX_STATIONS):
+    """(distance_km or None, station) pairs reporting water temperature or tides, either within
+    radius_km of a point (closest first) or in a state (water temperature sensors first)"""
+    if lat is not None and lng is not None:
+        found = {}
+        for product in REGION_PRODUCTS:
+            for distance, station in index.nearest(lat, lng, k=limit, radius_km=radius_km, product=product):
+                found[station.id] = (distance, station)
+        return sorted(found.values(), key=lambda pair: pair[0])[:limit]
+
+    found = {}
+    for product in REGION_PRODUCTS:
+        for station in catalog.stations(product):
+            if station.state == state and len(found) < limit:
+                found.setdefault(station.id, (None, station))
+    return list(found.values())
+
+
+##### BULK STATION FETCH #####
+class BulkFetcher:
+    """Fetches tides and water temperature for many stations at once, at most `concurrency`
+    stations in flight, over the shared per-host connection pools. Results are yielded in
+    completion order so replies can fill in as they arrive."""
+
+    def __init__(self, w, concurrency=REGION_CONCURRENCY, retries=REGION_RETRIES, backoff=REGION_BACKOFF):
+        self.w = w
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.attempts = 0
+        self.retried = 0
+
+    async def with_retries(self, factory):
+        """Await factory(), retrying failures (exceptions or a None payload) with jittered backoff"""
+        for attempt in range(self.retries + 1):
+            self.attempts += 1
+            try:
+                result = await factory()
+                if result is not None:
+                    return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    print(f"Bulk fetch gave up after {attempt + 1} attempts: {e}")
+                    return None
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        return None
+
+    async def fetch_station(self, semaphore, distance, station):
+        async with semaphore:
+            tide = temp = None
+            fetches = []
+            if station.supports("tidepredictions"):
+                fetches.append(self.with_retries(lambda: self.w.fetch_tide_predictions_async(station.id)))
+            if station.supports("watertemp"):
+                fetches.append(self.with_retries(lambda: self.w.fetch_water_temperature_async(station.id)))
+            results = await asyncio.gather(*fetches, return_exceptions=True)
+            for i, result in enumerate(results):
+                # Anything that isn't worth a retry (an open breaker, a malformed payload) costs
+                # this station its reading, not the rest of the region its lines
+                if isinstance(result, Exception):
+                    print(f"Bulk fetch for station {station.id} failed: {type(result).__name__}: {result}")
+                    results[i] = None
+            if station.supports("tidepredictions"):
+                tide = results.pop(0)
+            if station.supports("watertemp"):
+                temp = results.pop(0)
+            return distance, station, tide, temp
+
+    async def stream(self, stations):
+        """Yield (distance, station, tide_data, water_temp_data) as each station completes"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.ensure_future(self.fetch_station(semaphore, distance, station)) for distance, station in stations]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def format_region_line(w, distance, station, tide_data, water_temp_data, now=None):
+    details = []
+    readings = [reading.get("v") for reading in (water_temp_data or {}).get("data", []) if reading.get("v")]
+    if readings:
+        details.append(f"{readings[-1]}°F")
+    elif station.supports("watertemp"):
+        details.append("water temp unavailable")
+
+    if station.supports("tidepredictions"):
+        local_now = (now or datetime.now(w.station_timezone(station))).replace(tzinfo=None)
+        upcoming = [prediction for prediction in (tide_data or {}).get("predictions", [])
+                    if datetime.strptime(prediction["t"], '%Y-%m-%d %H:%M') > local_now]
+        if upcoming:
+            tide = upcoming[0]
+            tide_time = datetime.strptime(tide["t"], '%Y-%m-%d %H:%M').strftime('%I:%M %p')
+            details.append(f"next {'High' if tide['type'] == 'H' else 'Low'} at {tide_time} ({tide['v']}ft)")
+        else:
+            details.append("tides unavailable")
+
+    where = f", {round(distance)} km" if distance is not None else ""
+    return f"- **{station.name}** ({station.id}{where}): {', '.join(details)}"
+
+
+class RegionSummary:
+    """Renders /region replies progressively: the header first, then a line per station"""
+
+    def __init__(self, w, fetcher=None):
+        self.w = w
+        self.fetcher = fetcher or BulkFetcher(w)
+
+    async def lines(self, stations):
+        start = time.perf_counter()
+        async for distance, station, tide, temp in self.fetcher.stream(stations):
+            yield format_region_line(self.w, distance, station, tide, temp)
+        print(f"Region summary for {len(stations)} stations took {time.perf_counter() - start:.2f}s "
+              f"({self.fetcher.attempts} fetches, {self.fetcher.retried} retries)")
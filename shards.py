@@ -0,0 +1,52 @@
+import argparse, os, signal, subprocess, sys, time
+
+##### SHARDED LAUNCHER #####
+# Runs DiveBot as several gateway-sharded processes, so geocoding, JSON parsing and report
+# rendering get one event loop per shard instead of one for everything. The shards share
+# their caches through CACHE_URL, so an extra process adds capacity, not upstream calls:
+#     python shards.py -n 4                                    # shared SQLite (WAL) file
+#     CACHE_URL=redis://cache:6379/0 python shards.py -n 4     # any Redis-compatible server
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "divebot.py")
+DEFAULT_CACHE_URL = "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_cache.sqlite3")
+RESTART_DELAY = 5  # seconds before a crashed shard is started again
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run DiveBot as several gateway shards sharing one cache tier")
+    parser.add_argument("-n", "--shards", type=int, default=int(os.getenv("SHARD_COUNT") or os.cpu_count() or 1))
+    parser.add_argument("--cache-url", default=os.getenv("CACHE_URL") or DEFAULT_CACHE_URL,
+                        help="sqlite:///path or redis://host:port/db (default: a SQLite file next to the bot)")
+    return parser.parse_args()
+
+
+def start_shard(shard_id, shards, cache_url):
+    env = {**os.environ, "SHARD_ID": str(shard_id), "SHARD_COUNT": str(shards), "CACHE_URL": cache_url}
+    process = subprocess.Popen([sys.executable, BOT], env=env)
+    print(f"Started shard {shard_id + 1}/{shards} (pid {process.pid})")
+    return process
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    processes = {shard_id: start_shard(shard_id, args.shards, args.cache_url) for shard_id in range(args.shards)}
+    stopping = False
+
+    def stop(signum, frame):
+        global stopping
+        stopping = True
+        for process in processes.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        time.sleep(1)
+        for shard_id, process in list(processes.items()):
+            if process.poll() is not None and not stopping:
+                print(f"Shard {shard_id + 1} exited with {process.returncode}; restarting in {RESTART_DELAY}s")
+                time.sleep(RESTART_DELAY)
+                processes[shard_id] = start_shard(shard_id, args.shards, args.cache_url)
+    for process in processes.values():
+        process.wait()
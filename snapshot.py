@@ -0,0 +1,250 @@
+import argparse, mmap, os, struct, sys, threading, time
+import numpy as np
+from stations import PRODUCT_BITS, STATION_DIR, STATION_TYPES, Station, StationCatalog
+
+# One file holding every station list in columns, memory-mapped at startup instead of
+# parsing ~8 MB of JSON. Build it after the JSON lists change:
+#     python snapshot.py
+SNAPSHOT_NAME = "noaa_stations.snapshot"
+SNAPSHOT_PATH = os.getenv("STATION_SNAPSHOT") or os.path.join(STATION_DIR, SNAPSHOT_NAME)
+
+MAGIC = b"DBSNAP01"
+# magic, station count, bin count, string count, product-type count
+HEADER = struct.Struct("<8sIIII")
+
+COLUMNS = [
+    ("lat", np.float64), ("lng", np.float64), ("timezonecorr", np.float32),
+    ("id", np.uint32), ("name", np.uint32), ("state", np.uint32), ("type", np.uint32), ("reference_id", np.uint32),
+    ("bins_start", np.uint32), ("products", np.uint8),
+]
+BIN_DTYPE = np.dtype([("currbin", np.int16), ("depth", np.float64), ("type", np.uint32)])
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+##### BUILD #####
+def build_snapshot(directory=STATION_DIR, output=SNAPSHOT_PATH):
+    catalog = StationCatalog(directory).load()
+    stations = sorted(catalog.stations(), key=lambda station: station.id)
+
+    strings, string_ids = [], {}
+    def intern(value):
+        value = value or ""
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+    intern("")
+
+    n = len(stations)
+    columns = {name: np.zeros(n, dtype=dtype) for name, dtype in COLUMNS}
+    bins = []
+    for row, station in enumerate(stations):
+        columns["lat"][row] = station.lat
+        columns["lng"][row] = station.lng
+        columns["timezonecorr"][row] = np.nan if station.timezonecorr is None else station.timezonecorr
+        for name in ("id", "name", "state", "type", "reference_id"):
+            columns[name][row] = intern(getattr(station, name))
+        columns["products"][row] = station.products
+        columns["bins_start"][row] = len(bins)
+        for currbin, depth, bin_type in station.bins or ():
+            bins.append((-1 if currbin is None else currbin, np.nan if depth is None else depth, intern(bin_type)))
+    bins_start = np.append(columns.pop("bins_start"), np.uint32(len(bins)))
+    bins = np.array(bins, dtype=BIN_DTYPE)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    string_offsets[1:] = np.cumsum([len(value) for value in encoded])
+
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n, len(bins), len(strings), len(STATION_TYPES)))
+        f.write(",".join(STATION_TYPES).encode("ascii").ljust(128, b"\0"))
+        for array in [*columns.values(), bins_start, bins, string_offsets]:
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(array.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(tmp, output)
+    return n
+
+
+##### MEMORY-MAPPED CATALOG #####
+class SnapshotCatalog:
+    """Read-only StationCatalog backed by a memory-mapped snapshot. Columns are NumPy views
+    into the mapping; Station records are only materialized for the products asked for."""
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        start = time.perf_counter()
+        self.path = path
+        self.directory = os.path.dirname(path)
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, bin_count, string_count, type_count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a DiveBot station snapshot")
+        self.types = bytes(self.mm[HEADER.size:HEADER.size + 128]).rstrip(b"\0").decode("ascii").split(",")
+        if self.types != STATION_TYPES[:type_count]:
+            raise ValueError(f"{path} was built for station types {self.types}")
+
+        offset = HEADER.size + 128
+        self.columns = {}
+        for name, dtype in COLUMNS:
+            if name == "bins_start":
+                continue
+            offset = _align(offset)
+            self.columns[name] = np.frombuffer(self.mm, dtype=dtype, count=n, offset=offset)
+            offset += n * np.dtype(dtype).itemsize
+        offset = _align(offset)
+        self.bins_start = np.frombuffer(self.mm, dtype=np.uint32, count=n + 1, offset=offset)
+        offset = _align(offset + (n + 1) * 4)
+        self.bins = np.frombuffer(self.mm, dtype=BIN_DTYPE, count=bin_count, offset=offset)
+        offset = _align(offset + bin_count * BIN_DTYPE.itemsize)
+        self.string_offsets = np.frombuffer(self.mm, dtype=np.uint32, count=string_count + 1, offset=offset)
+        self.string_base = offset + (string_count + 1) * 4
+
+        self.count = n
+        self._ids = None
+        self._strings = None
+        self._records = {}
+        self._by_product = {}
+        self._lock = threading.Lock()
+        self.load_time = time.perf_counter() - start
+
+    def load(self):
+        return self
+
+    def string(self, ref):
+        if self._strings is None:
+            # One pass over the string table is far cheaper than decoding per field
+            blob = self.mm[self.string_base:self.string_base + int(self.string_offsets[-1])]
+            offsets = self.string_offsets.tolist()
+            text = blob.decode("utf-8")
+            if len(text) == len(blob):
+                # Pure ASCII: byte offsets are character offsets, so slice the decoded text
+                self._strings = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            else:
+                self._strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        return self._strings[ref]
+
+    def _row_ids(self):
+        if self._ids is None:
+            self._ids = {self.string(ref): row for row, ref in enumerate(self.columns["id"].tolist())}
+        return self._ids
+
+    def _station(self, row):
+        station = self._records.get(row)
+        if station is None:
+            self._materialize([row])
+            station = self._records[row]
+        return station
+
+    def _materialize(self, rows):
+        """Build Station records for rows, reading each column in bulk"""
+        rows = [row for row in rows if row not in self._records]
+        if not rows:
+            return
+        c = self.columns
+        index = np.asarray(rows)
+        values = {name: column[index].tolist() for name, column in c.items()}
+        bins_start = self.bins_start.tolist()
+        string = self.string
+        for i, row in enumerate(rows):
+            timezonecorr = values["timezonecorr"][i]
+            bins = None
+            if bins_start[row + 1] > bins_start[row]:
+                bins = [(None if currbin < 0 else currbin, None if depth != depth else depth, string(bin_type))
+                        for currbin, depth, bin_type in self.bins[bins_start[row]:bins_start[row + 1]].tolist()]
+            self._records[row] = Station(
+                string(values["id"][i]), string(values["name"][i]), values["lat"][i], values["lng"][i],
+                state=string(values["state"][i]), type=string(values["type"][i]), products=values["products"][i],
+                timezonecorr=None if timezonecorr != timezonecorr else (int(timezonecorr) if timezonecorr.is_integer() else timezonecorr),
+                reference_id=string(values["reference_id"][i]), bins=bins,
+            )
+
+    def get(self, station_id):
+        if station_id is None:
+            return None
+        row = self._row_ids().get(str(station_id))
+        return None if row is None else self._station(row)
+
+    def rows(self, product=None):
+        if product is None:
+            return np.arange(self.count)
+        return np.flatnonzero(self.columns["products"] & PRODUCT_BITS[product])
+
+    def stations(self, product=None):
+        stations = self._by_product.get(product)
+        if stations is None:
+            with self._lock:
+                rows = self.rows(product).tolist()
+                self._materialize(rows)
+                stations = [self._records[row] for row in rows]
+                self._by_product[product] = stations
+        return stations
+
+    @property
+    def by_id(self):
+        return {station_id: self._station(row) for station_id, row in self._row_ids().items()}
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, station_id):
+        return str(station_id) in self._row_ids()
+
+    def memory_usage(self):
+        """Bytes of Python objects built so far; the mapped columns live in the page cache"""
+        total = sum(sys.getsizeof(station) for station in self._records.values())
+        total += sys.getsizeof(self._ids or {}) + sum(sys.getsizeof(stations) for stations in self._by_product.values())
+        return total
+
+    def stats(self):
+        return {
+            "stations": self.count,
+            "per_product": {station_type: int(len(self.rows(station_type))) for station_type in self.types},
+            "load_time_ms": round(self.load_time * 1000, 2),
+            "memory_bytes": self.memory_usage(),
+            "snapshot_bytes": len(self.mm),
+        }
+
+
+def snapshot_path(directory=STATION_DIR):
+    return SNAPSHOT_PATH if directory == STATION_DIR else os.path.join(directory, SNAPSHOT_NAME)
+
+
+def snapshot_is_current(directory=STATION_DIR):
+    path = snapshot_path(directory)
+    if not os.path.exists(path):
+        return False
+    built = os.path.getmtime(path)
+    for station_type in STATION_TYPES:
+        filename = os.path.join(directory, f"noaa_stations_{station_type}.json")
+        if os.path.exists(filename) and os.path.getmtime(filename) > built:
+            return False
+    return True
+
+
+def catalog_version(directory=STATION_DIR):
+    """Modification times of the snapshot and the JSON lists; changes whenever a station
+    refresh rewrites them, so processes that didn't run the refresh know to reload"""
+    paths = [snapshot_path(directory)] + [os.path.join(directory, f"noaa_stations_{station_type}.json") for station_type in STATION_TYPES]
+    return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+
+def load_catalog(directory=STATION_DIR):
+    """Snapshot-backed catalog when an up-to-date snapshot exists, parsed JSON otherwise"""
+    if snapshot_is_current(directory):
+        return SnapshotCatalog(snapshot_path(directory))
+    return StationCatalog(directory).load()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the noaa_stations_*.json lists into a memory-mappable snapshot")
+    parser.add_argument("-d", "--directory", default=STATION_DIR)
+    parser.add_argument("-o", "--output", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    count = build_snapshot(args.directory, args.output)
+    print(f"Wrote {count} stations to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KiB) in {time.perf_counter() - start:.2f}s")
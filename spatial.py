@@ -0,0 +1,205 @@
+import heapq, math, threading
+import numpy as np
+from stations import get_catalog
+
+EARTH_RADIUS_KM = 6371  # same radius GetDiveWeather.haversine_distance uses
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    a = math.sin(dLat/2) ** 2 + math.sin(dLon/2) ** 2 * math.cos(math.radians(lat1)) * math.cos(math.radians(lat2))
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+def haversine_batch(lats, lngs, station_lats, station_lngs):
+    """Distance matrix in km between every query point and every station, shape (queries, stations).
+    Same formula as haversine_km, evaluated with NumPy broadcasting."""
+    lat1 = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lngs, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(station_lats, dtype=np.float64))[None, :]
+    lon2 = np.radians(np.asarray(station_lngs, dtype=np.float64))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.sin((lon2 - lon1) / 2) ** 2 * np.cos(lat1) * np.cos(lat2)
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+##### LAT/LNG GRID INDEX #####
+class _Grid:
+    def __init__(self, stations, cell_degrees):
+        self.cell = cell_degrees
+        self.rows = int(math.ceil(180 / cell_degrees))
+        self.cols = int(math.ceil(360 / cell_degrees))
+        self.cells = {}
+        for station in stations:
+            self.cells.setdefault(self._key(station.lat, station.lng), []).append(station)
+        self.size = len(stations)
+
+    def _key(self, lat, lng):
+        row = min(int((lat + 90) // self.cell), self.rows - 1)
+        col = int(((lng + 180) % 360) // self.cell)
+        return row, col
+
+    def ring(self, row, col, r):
+        """Occupied cells whose Chebyshev distance from (row, col) is exactly r"""
+        if r == 0:
+            bucket = self.cells.get((row, col))
+            return [bucket] if bucket else []
+        buckets = []
+        cols_in_ring = min(2 * r + 1, self.cols)
+        for dr in range(-r, r + 1):
+            ring_row = row + dr
+            if ring_row < 0 or ring_row >= self.rows:
+                continue
+            if abs(dr) == r:
+                dcs = range(-r, -r + cols_in_ring)
+            else:
+                dcs = (-r, r) if 2 * r - 1 < self.cols else ()
+            seen_cols = set()
+            for dc in dcs:
+                ring_col = (col + dc) % self.cols
+                if ring_col in seen_cols:
+                    continue
+                seen_cols.add(ring_col)
+                bucket = self.cells.get((ring_row, ring_col))
+                if bucket:
+                    buckets.append(bucket)
+        return buckets
+
+    def outside_bound_km(self, lat, lng, row, col, r):
+        """Lower bound on the distance from (lat, lng) to any cell outside ring r"""
+        south_edge = (row - r) * self.cell - 90
+        north_edge = (row + r + 1) * self.cell - 90
+        lat_gap = min(lat - south_edge if south_edge > -90 else math.inf,
+                      north_edge - lat if north_edge < 90 else math.inf)
+        bound = math.radians(lat_gap) * EARTH_RADIUS_KM
+
+        if 2 * r + 1 < self.cols:
+            west_edge = (col - r) * self.cell - 180
+            east_edge = (col + r + 1) * self.cell - 180
+            lng_norm = ((lng + 180) % 360) - 180
+            lon_gap = min(lng_norm - west_edge, east_edge - lng_norm)
+            # Closest approach of a great circle to a meridian lon_gap degrees away
+            if lon_gap < 90:
+                cross = math.asin(min(1.0, math.cos(math.radians(lat)) * math.sin(math.radians(lon_gap))))
+            else:
+                # Past 90 degrees the closest point of the meridian is the nearer pole
+                cross = math.radians(90 - abs(lat))
+            bound = min(bound, cross * EARTH_RADIUS_KM)
+        return bound
+
+
+class StationIndex:
+    def __init__(self, catalog=None, cell_degrees=1.0):
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.cell_degrees = cell_degrees
+        self.grids = {}
+        self.arrays = {}
+        self._lock = threading.Lock()
+
+    def _grid(self, product):
+        grid = self.grids.get(product)
+        if grid is None:
+            with self._lock:
+                grid = self.grids.get(product)
+                if grid is None:
+                    grid = _Grid(self.catalog.stations(product), self.cell_degrees)
+                    self.grids[product] = grid
+        return grid
+
+    def _arrays(self, product):
+        arrays = self.arrays.get(product)
+        if arrays is None:
+            stations = self.catalog.stations(product)
+            arrays = (
+                np.array([station.id for station in stations], dtype=object),
+                np.array([station.lat for station in stations], dtype=np.float64),
+                np.array([station.lng for station in stations], dtype=np.float64),
+            )
+            self.arrays[product] = arrays
+        return arrays
+
+    def nearest(self, lat, lng, k=1, radius_km=math.inf, product=None):
+        """Up to k (distance_km, station) pairs within radius_km, closest first"""
+        lat, lng = float(lat), float(lng)
+        grid = self._grid(product)
+        if not grid.size:
+            return []
+        row, col = grid._key(lat, lng)
+        best = []  # max-heap of (-distance, tiebreak, station)
+        max_ring = max(grid.rows, grid.cols)
+        for r in range(max_ring):
+            for bucket in grid.ring(row, col, r):
+                for station in bucket:
+                    distance = haversine_km(lat, lng, station.lat, station.lng)
+                    if distance > radius_km:
+                        continue
+                    item = (-distance, id(station), station)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, item)
+            bound = grid.outside_bound_km(lat, lng, row, col, r)
+            if bound > radius_km:
+                break
+            if len(best) == k and -best[0][0] <= bound:
+                break
+        return sorted(((-neg, station) for neg, _, station in best), key=lambda pair: pair[0])
+
+    def nearest_with_fallback(self, lat, lng, preferred="physocean", fallback="tidepredictions", threshold_distance=50):
+        """Nearest preferred station, unless it is further than threshold_distance and a
+        fallback station is closer. Mirrors the original linear scan in get_nearest_station."""
+        found = self.nearest(lat, lng, k=1, product=preferred)
+        distance, station = found[0] if found else (math.inf, None)
+        if station is None or distance > threshold_distance:
+            found = self.nearest(lat, lng, k=1, radius_km=distance, product=fallback)
+            if found and found[0][0] < distance:
+                distance, station = found[0]
+        return station, distance
+
+    ##### BATCH QUERIES #####
+    def nearest_batch(self, lats, lngs, product=None, chunk_size=512):
+        """Nearest station id and distance (km) for every query point, as two arrays.
+        Points with no candidate station get id None and distance inf."""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lngs = np.asarray(lngs, dtype=np.float64).ravel()
+        ids, station_lats, station_lngs = self._arrays(product)
+        nearest_ids = np.full(len(lats), None, dtype=object)
+        nearest_distances = np.full(len(lats), np.inf)
+        if not len(ids):
+            return nearest_ids, nearest_distances
+
+        # Chunk the queries so the distance matrix stays a few MB regardless of batch size
+        for start in range(0, len(lats), chunk_size):
+            stop = start + chunk_size
+            distances = haversine_batch(lats[start:stop], lngs[start:stop], station_lats, station_lngs)
+            best = np.argmin(distances, axis=1)
+            nearest_ids[start:stop] = ids[best]
+            nearest_distances[start:stop] = distances[np.arange(len(best)), best]
+        return nearest_ids, nearest_distances
+
+    def nearest_with_fallback_batch(self, lats, lngs, preferred="physocean", fallback="tidepredictions", threshold_distance=50):
+        """Vectorized nearest_with_fallback: returns (station ids, distances) arrays"""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lngs = np.asarray(lngs, dtype=np.float64).ravel()
+        ids, distances = self.nearest_batch(lats, lngs, product=preferred)
+        far = np.flatnonzero(distances > threshold_distance)
+        if len(far):
+            fallback_ids, fallback_distances = self.nearest_batch(lats[far], lngs[far], product=fallback)
+            closer = fallback_distances < distances[far]
+            ids[far[closer]] = fallback_ids[closer]
+            distances[far[closer]] = fallback_distances[closer]
+        return ids, distances
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_station_index():
+    global _index
+    catalog = get_catalog()
+    # Rebuilt when the station refresh swaps in a new catalog
+    if _index is None or _index.catalog is not catalog:
+        with _index_lock:
+            if _index is None or _index.catalog is not catalog:
+                _index = StationIndex(catalog)
+    return _index
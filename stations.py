@@ -0,0 +1,179 @@
+import json, os, sys, threading, time
+
+STATION_DIR = os.path.dirname(os.path.abspath(__file__))
+STATION_TYPES = ["watertemp", "physocean", "tidepredictions", "currentpredictions", "currents", "waterlevels"]
+
+# One bit per mdapi station list, so "which products does this station support"
+# is a single int per record instead of six membership lists.
+PRODUCT_BITS = {station_type: 1 << i for i, station_type in enumerate(STATION_TYPES)}
+
+
+##### COMPACT STATION RECORD #####
+class Station:
+    __slots__ = ("id", "name", "lat", "lng", "state", "type", "products", "timezonecorr", "reference_id", "bins")
+
+    def __init__(self, id, name, lat, lng, state="", type="", products=0, timezonecorr=None, reference_id="", bins=None):
+        self.id = id
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.state = state
+        self.type = type
+        self.products = products
+        self.timezonecorr = timezonecorr
+        self.reference_id = reference_id
+        # (currbin, depth, type) tuples for current prediction stations, None otherwise
+        self.bins = bins
+
+    def supports(self, product):
+        return bool(self.products & PRODUCT_BITS[product])
+
+    def product_names(self):
+        return [station_type for station_type in STATION_TYPES if self.supports(station_type)]
+
+    # Lets existing callers keep using station['name'] / station['id'] lookups
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"Station({self.id!r}, {self.name!r}, {self.lat}, {self.lng}, products={self.product_names()})"
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+##### PROCESS-WIDE STATION CATALOG #####
+class StationCatalog:
+    def __init__(self, directory=STATION_DIR, types=STATION_TYPES):
+        self.directory = directory
+        self.types = list(types)
+        self.by_id = {}
+        self.by_product = {}
+        self.load_time = 0.0
+
+    def load(self):
+        start = time.perf_counter()
+        by_id = {}
+        for station_type in self.types:
+            filename = os.path.join(self.directory, f"noaa_stations_{station_type}.json")
+            if not os.path.exists(filename):
+                print(f"Station list {filename} is missing, skipping.")
+                continue
+            with open(filename, "r") as file:
+                raw_stations = json.load(file)
+            self._merge(by_id, station_type, raw_stations)
+
+        by_product = {station_type: [] for station_type in self.types}
+        for station in by_id.values():
+            for station_type in self.types:
+                if station.products & PRODUCT_BITS[station_type]:
+                    by_product[station_type].append(station)
+
+        self.by_id = by_id
+        self.by_product = by_product
+        self.load_time = time.perf_counter() - start
+        return self
+
+    def _merge(self, by_id, station_type, raw_stations):
+        bit = PRODUCT_BITS[station_type]
+        for raw in raw_stations:
+            lat, lng = _to_float(raw.get("lat")), _to_float(raw.get("lng"))
+            if lat is None or lng is None:
+                continue
+            station_id = sys.intern(str(raw["id"]))
+            station = by_id.get(station_id)
+            if station is None:
+                station = Station(station_id, raw.get("name") or "", lat, lng)
+                by_id[station_id] = station
+            station.products |= bit
+
+            if not station.state and raw.get("state"):
+                station.state = sys.intern(raw["state"])
+            if station_type == "tidepredictions":
+                station.type = sys.intern(raw.get("type") or "")
+                station.reference_id = raw.get("reference_id") or ""
+            if station.timezonecorr is None and raw.get("timezonecorr") is not None:
+                station.timezonecorr = raw["timezonecorr"]
+            if station_type == "currentpredictions":
+                # Current prediction stations are listed once per bin/depth
+                if station.bins is None:
+                    station.bins = []
+                station.bins.append((raw.get("currbin"), raw.get("depth"), raw.get("type") or ""))
+
+    def get(self, station_id):
+        if station_id is None:
+            return None
+        return self.by_id.get(str(station_id))
+
+    def stations(self, product=None):
+        if product is None:
+            return list(self.by_id.values())
+        return self.by_product.get(product, [])
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, station_id):
+        return str(station_id) in self.by_id
+
+    def memory_usage(self):
+        """Approximate bytes held by the catalog (records, their fields and the lookup tables)"""
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = size(self.by_id) + size(self.by_product)
+        for stations in self.by_product.values():
+            total += size(stations)
+        for station_id, station in self.by_id.items():
+            total += size(station_id) + size(station)
+            for field in Station.__slots__:
+                value = getattr(station, field)
+                total += size(value)
+                if field == "bins" and value:
+                    for entry in value:
+                        total += size(entry) + sum(size(item) for item in entry)
+        return total
+
+    def stats(self):
+        return {
+            "stations": len(self.by_id),
+            "per_product": {station_type: len(stations) for station_type, stations in self.by_product.items()},
+            "load_time_ms": round(self.load_time * 1000, 2),
+            "memory_bytes": self.memory_usage(),
+        }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                from snapshot import load_catalog
+                _catalog = load_catalog()
+    return _catalog
+
+
+def set_catalog(catalog):
+    """Hot-swap the process-wide catalog; readers pick it up on their next lookup"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = catalog
+    return catalog
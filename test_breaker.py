@@ -0,0 +1,81 @@
+import asyncio, time
+import pytest, requests
+import test_noaa_client
+from breaker import BreakerRegistry, CircuitBreaker, CircuitOpenError
+from cache import TTLCache
+from noaa_client import AsyncNoaaClient
+from test_noaa_client import UPSTREAM_CALLS, StubGeocodeCache, offline_caches, run_with_stub
+from weather import DATA_UNAVAILABLE, GetDiveWeather
+
+# Run with: python -m pytest test_breaker.py
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    clock = Clock()
+    breaker = CircuitBreaker("noaa", failure_rate=0.5, min_calls=4, open_seconds=30, clock=clock)
+    for failed in (False, True, False, True):
+        breaker.before()
+        breaker.record(failed)
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+
+    clock.now += 31
+    breaker.before()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before()  # everyone else waits for it
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before()
+
+
+def test_slow_answers_count_as_failures():
+    breaker = CircuitBreaker("nws", min_calls=2, slow_seconds=1.0, clock=Clock())
+    breaker.record(False, elapsed=2.5)
+    breaker.record(False, elapsed=3.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_open_circuit_serves_the_last_reading_without_waiting(monkeypatch):
+    breakers = BreakerRegistry(min_calls=2, open_seconds=60)
+
+    async def scenario(w):
+        await w.fetch_water_temperature_async("8723214")
+        await asyncio.sleep(0.1)  # the reading expires
+        test_noaa_client.FAIL_NEXT = 2
+        failed = [await w.fetch_water_temperature_async("8723214") for _ in range(2)]
+        calls = len(UPSTREAM_CALLS)
+        start = time.perf_counter()
+        served = await w.fetch_water_temperature_async("8723214")
+        return failed, served, time.perf_counter() - start, len(UPSTREAM_CALLS) - calls
+
+    monkeypatch.setattr(test_noaa_client, "FAIL_NEXT", 0)
+    failed, served, elapsed, calls = run_with_stub(monkeypatch, scenario, breakers=breakers,
+                                                   observation_cache=TTLCache("test", default_ttl=0.05))
+    assert all(data["stale"] and data["data"][0]["v"] == "81.3" for data in failed)
+    assert served["stale"] and elapsed < 0.05 and calls == 0
+    assert breakers.get("127.0.0.1").state == CircuitBreaker.OPEN
+
+
+def test_weather_reports_unavailable_instead_of_crashing_on_nws_errors(monkeypatch, tmp_path):
+    class ServiceUnavailable:
+        status_code = 503
+        headers = {}
+
+        def raise_for_status(self):
+            raise requests.HTTPError("503 Service Unavailable")
+
+        def json(self):
+            return {"status": 503, "detail": "Service Unavailable"}
+
+    monkeypatch.setattr(requests, "get", lambda *args, **kwargs: ServiceUnavailable())
+    w = GetDiveWeather(geocode_cache=StubGeocodeCache(), http=AsyncNoaaClient(breakers=BreakerRegistry()), **offline_caches(tmp_path))
+    today, extended = w.weather("key largo", "FL")
+    assert DATA_UNAVAILABLE in today and extended == []
@@ -0,0 +1,83 @@
+import asyncio
+from edit_coalescer import EditCoalescer, retry_after
+
+# Run with: python -m pytest test_edit_coalescer.py
+
+
+class RateLimited(Exception):
+    status = 429
+
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests")
+        self.retry_after = retry_after
+
+
+def test_burst_of_clicks_becomes_one_edit():
+    edits = []
+
+    async def scenario():
+        coalescer = EditCoalescer(debounce=0.05)
+        for guide in range(20):
+            async def edit(guides=guide + 1):
+                edits.append(guides)
+            coalescer.submit("message-1", edit)
+        assert coalescer.stats()["queue_depth"] == 1
+        await coalescer.drain()
+        return coalescer.stats()
+
+    stats = asyncio.run(scenario())
+    assert edits == [20]  # only the latest state is sent
+    assert stats["flushed"] == 1 and stats["coalesced"] == 19 and stats["queue_depth"] == 0
+    assert stats["flush_latency_p50_ms"] >= 50
+
+
+def test_429_backs_off_for_retry_after_then_sends_the_latest():
+    attempts = []
+
+    async def scenario():
+        coalescer = EditCoalescer(debounce=0.01)
+
+        async def first():
+            attempts.append("first")
+            # Another click lands while Discord is telling us to slow down
+            coalescer.submit("message-1", second)
+            raise RateLimited(0.05)
+
+        async def second():
+            attempts.append("second")
+
+        coalescer.submit("message-1", first)
+        await coalescer.drain()
+        return coalescer.stats()
+
+    stats = asyncio.run(scenario())
+    assert attempts == ["first", "second"]
+    assert stats["rate_limited"] == 1 and stats["flushed"] == 1 and stats["failed"] == 0
+
+
+def test_edit_queued_during_a_failed_attempt_is_still_sent():
+    attempts = []
+
+    async def scenario():
+        coalescer = EditCoalescer(debounce=0.01)
+
+        async def first():
+            attempts.append("first")
+            coalescer.submit("message-1", second)
+            raise ConnectionError("Discord is unreachable")
+
+        async def second():
+            attempts.append("second")
+
+        coalescer.submit("message-1", first)
+        await coalescer.drain()
+        return coalescer.stats()
+
+    stats = asyncio.run(scenario())
+    assert attempts == ["first", "second"]
+    assert stats["failed"] == 1 and stats["flushed"] == 1 and stats["queue_depth"] == 0
+
+
+def test_retry_after_only_for_429():
+    assert retry_after(RateLimited(2.5)) == 2.5
+    assert retry_after(ValueError("boom")) is None
@@ -0,0 +1,53 @@
+import pytest
+from gazetteer import Gazetteer, build_gazetteer
+
+# Run with: python -m pytest test_gazetteer.py
+
+PLACES = [
+    ("Key Largo", "FL", 25.0865, -80.4473),
+    ("Key West", "FL", 24.5551, -81.78),
+    ("Key Biscayne", "FL", 25.6937, -80.1628),
+    ("Jupiter", "FL", 26.9342, -80.0942),
+    ("Monterey", "CA", 36.6002, -121.8947),
+    ("Montecito", "CA", 34.4364, -119.6321),
+]
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    csv_path = tmp_path / "places.csv"
+    csv_path.write_text("name,state,lat,lng\n" + "".join(f"{name},{state},{lat},{lng}\n" for name, state, lat, lng in PLACES))
+    census_path = tmp_path / "places.txt"
+    census_path.write_text("USPS\tGEOID\tNAME\tINTPTLAT\tINTPTLONG \nFL\t1\tTavernier CDP\t25.0104\t-80.5153\n")
+    path = str(tmp_path / "gazetteer.bin")
+    assert build_gazetteer([str(csv_path), str(census_path)], path) == len(PLACES) + 1
+    gazetteer = Gazetteer(path)
+    yield gazetteer
+    gazetteer.close()
+
+
+def test_exact_lookup_ignores_case_and_spacing(gazetteer):
+    assert gazetteer.exact("key  LARGO", "fl") == pytest.approx((25.0865, -80.4473), abs=1e-4)
+    assert gazetteer.exact("Tavernier", "FL") == pytest.approx((25.0104, -80.5153), abs=1e-4)  # "CDP" stripped
+    assert gazetteer.exact("Key Largo", "CA") is None
+
+
+def test_prefix_stays_inside_the_state(gazetteer):
+    assert [name for name, _, _ in gazetteer.prefix("key", "FL")] == ["key biscayne", "key largo", "key west"]
+    assert [name for name, _, _ in gazetteer.prefix("monte", "CA")] == ["montecito", "monterey"]
+    assert gazetteer.prefix("monte", "FL") == []
+
+
+def test_fuzzy_matches_typos_and_remembers_the_answer(gazetteer):
+    assert gazetteer.fuzzy("key lago", "FL")[0] == "key largo"
+    assert ("fl", "key lago", 0.85) in gazetteer._fuzzy
+    assert gazetteer.fuzzy("Atlantis", "FL") is None
+    # Only names with the same first letter are compared
+    assert gazetteer.fuzzy("ley largo", "FL") is None
+
+
+def test_resolve_prefers_exact_then_unique_prefix_then_fuzzy(gazetteer):
+    assert gazetteer.resolve("Key Largo", "FL")[0] == "key largo"
+    assert gazetteer.resolve("jup", "FL")[0] == "jupiter"
+    assert gazetteer.resolve("montery", "CA")[0] == "monterey"
+    assert gazetteer.resolve("key", "FL") is None  # ambiguous prefix, nothing close enough
@@ -0,0 +1,116 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+from geocache import GeocodeCache
+from test_noaa_client import offline_caches
+from weather import GetDiveWeather
+
+# Run with: python -m pytest test_geocache.py
+
+class StubGeocoder:
+    def __init__(self, places):
+        self.places = places
+        self.calls = []
+
+    def __call__(self, city, state):
+        self.calls.append((city, state))
+        return self.places.get((city.lower(), state.lower()))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_tier_hits_geocoder_once(tmp_path):
+    stub = StubGeocoder({("key largo", "florida"): (25.08, -80.45)})
+    cache = GeocodeCache(stub, path=str(tmp_path / "geo.sqlite3"))
+    for _ in range(3):
+        assert cache.lookup("Key Largo", "Florida") == (25.08, -80.45)
+    assert len(stub.calls) == 1
+    assert cache.stats()["memory_hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_abbreviation_and_full_state_share_an_entry(tmp_path):
+    stub = StubGeocoder({("key largo", "florida"): (25.08, -80.45)})
+    w = GetDiveWeather(geocode_cache=GeocodeCache(stub, path=str(tmp_path / "geo.sqlite3")), **offline_caches(tmp_path))
+    assert w.fetch_lat_long_for_city("key largo", "FL") == (25.08, -80.45)
+    assert w.fetch_lat_long_for_city("Key  Largo", "florida") == (25.08, -80.45)
+    assert stub.calls == [("key largo", "Florida")]
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "geo.sqlite3")
+    stub = StubGeocoder({("monterey", "california"): (36.6, -121.89)})
+    GeocodeCache(stub, path=path).lookup("Monterey", "California")
+
+    restarted = GeocodeCache(stub, path=path)
+    assert restarted.lookup("monterey", "california") == (36.6, -121.89)
+    assert len(stub.calls) == 1
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_ttl_expiry_refetches(tmp_path):
+    clock = Clock()
+    stub = StubGeocoder({("monterey", "california"): (36.6, -121.89)})
+    cache = GeocodeCache(stub, path=str(tmp_path / "geo.sqlite3"), ttl=60, clock=clock)
+    cache.lookup("Monterey", "California")
+    clock.now += 61
+    cache.lookup("Monterey", "California")
+    assert len(stub.calls) == 2
+
+
+def test_lru_evicts_oldest(tmp_path):
+    stub = StubGeocoder({("a", "x"): (1, 1), ("b", "x"): (2, 2), ("c", "x"): (3, 3)})
+    cache = GeocodeCache(stub, path=None, max_entries=2)
+    for city in ("a", "b", "c"):
+        cache.lookup(city, "x")
+    assert list(cache.memory) == [("b", "x"), ("c", "x")]
+
+
+def test_unknown_place_raises(tmp_path):
+    cache = GeocodeCache(StubGeocoder({}), path=None)
+    try:
+        cache.lookup("Atlantis", "Nowhere")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_concurrent_misses_for_one_place_share_a_request(tmp_path):
+    stub = StubGeocoder({("key largo", "florida"): (25.08, -80.45)})
+    release = threading.Event()
+
+    def slow(city, state):
+        release.wait(1)
+        return stub(city, state)
+
+    cache = GeocodeCache(slow, path=None)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        lookups = [pool.submit(cache.lookup, city, "Florida") for city in ["Key Largo", "key  largo"] * 3]
+        time.sleep(0.1)
+        release.set()
+        assert [lookup.result() for lookup in lookups] == [(25.08, -80.45)] * 6
+    assert len(stub.calls) == 1
+    assert cache.stats()["coalesced"] == 5
+
+
+class BrokenStore:
+    def get(self, key):
+        raise ConnectionError("store is down")
+
+    def set(self, key, value, expires):
+        raise ConnectionError("store is down")
+
+
+def test_a_failing_shared_store_does_not_fail_lookups(tmp_path):
+    stub = StubGeocoder({("key largo", "florida"): (25.08, -80.45)})
+    cache = GeocodeCache(stub, path=None, store=BrokenStore())
+    assert cache.lookup("Key Largo", "Florida") == (25.08, -80.45)
+    assert cache.lookup("Key Largo", "Florida") == (25.08, -80.45)
+    assert len(stub.calls) == 1
+    assert cache.stats()["store_errors"] == 1  # then skipped until the store's retry interval passes
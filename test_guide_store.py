@@ -0,0 +1,63 @@
+import asyncio, threading
+from guide_store import GuideRequestStore
+
+# Run with: python -m pytest test_guide_store.py
+
+
+def test_guides_toggle_without_touching_the_message(tmp_path):
+    store = GuideRequestStore(str(tmp_path / "guides.sqlite3"))
+    store.create(1146900000000000001, "Blue Heron Bridge", "10/21", "10am", requester="Morgan", requester_id=42, channel_id=7)
+
+    store.add_guide(1146900000000000001, "<@1>")
+    store.add_guide(1146900000000000001, "<@2>")
+    request = store.add_guide(1146900000000000001, "<@1>")  # a second click doesn't duplicate
+    assert request["location"] == "Blue Heron Bridge" and request["date"] == "10/21" and request["time"] == "10am"
+    assert request["requester"] == "Morgan"
+    assert request["guides"] == ["<@1>", "<@2>"]
+
+    assert store.remove_guide("1146900000000000001", "<@1>")["guides"] == ["<@2>"]
+
+
+def test_unknown_request(tmp_path):
+    store = GuideRequestStore(str(tmp_path / "guides.sqlite3"))
+    assert store.get(123) is None
+    assert store.add_guide(123, "<@1>") is None
+
+
+def test_requests_survive_a_restart(tmp_path):
+    path = str(tmp_path / "guides.sqlite3")
+    store = GuideRequestStore(path)
+    store.create(99, "Key Largo", requester="Morgan")
+    store.add_guide(99, "<@3>")
+    store.close()
+
+    reopened = GuideRequestStore(path)
+    assert reopened.db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert reopened.get(99)["guides"] == ["<@3>"]
+
+
+def test_async_methods_write_off_the_event_loop(tmp_path):
+    store = GuideRequestStore(str(tmp_path / "guides.sqlite3"))
+    commits = []
+    db = store.db
+
+    class Connection:
+        # sqlite3.Connection's methods are read-only, so record commits through a wrapper
+        def execute(self, *args):
+            return db.execute(*args)
+
+        def commit(self):
+            commits.append(threading.get_ident())
+            db.commit()
+
+    store.db = Connection()
+
+    async def main():
+        await store.create_async(7, "Blue Heron Bridge", requester="Morgan")
+        await store.add_guide_async(7, "<@1>")
+        request = await store.remove_guide_async(7, "<@1>")
+        return request, threading.get_ident()
+
+    request, loop_thread = asyncio.run(main())
+    assert request["location"] == "Blue Heron Bridge" and request["guides"] == []
+    assert len(commits) == 3 and loop_thread not in commits
@@ -0,0 +1,128 @@
+import calendar, glob, json, os
+from datetime import datetime
+import numpy as np
+import pytest
+import pytz
+import requests
+from cache import TTLCache
+from harmonics import (HARMONICS_TTL, HILO_HEIGHT_TOLERANCE, HILO_TIME_TOLERANCE, HarmonicModel, HarmonicPredictor,
+                       apply_offsets, constituent_speeds, nodal_corrections)
+from weather import GetDiveWeather, build_nws_caches
+
+# Run with: python -m pytest test_harmonics.py
+# Comparisons with NOAA need recorded fixtures: python record_noaa_fixtures.py. None are
+# committed yet, so outside CI the accuracy tests skip and the tolerances are unchecked.
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "harmonics", "*.json")))
+# In CI a missing recording is a failure, not a skip: it's the check that we agree with NOAA
+REQUIRE_FIXTURES = bool(os.getenv("CI") or os.getenv("REQUIRE_NOAA_FIXTURES"))
+
+# Speeds (degrees/hour) as listed in NOAA's harcon.json
+NOAA_SPEEDS = {
+    "M2": 28.984104, "S2": 30.0, "N2": 28.43973, "K1": 15.041069, "M4": 57.96821, "O1": 13.943035,
+    "M6": 86.95232, "MK3": 44.025173, "S4": 60.0, "MN4": 57.423832, "NU2": 28.512583, "S6": 90.0,
+    "MU2": 27.968208, "2N2": 27.895355, "OO1": 16.139101, "LAM2": 29.455626, "S1": 15.0, "M1": 14.496694,
+    "J1": 15.5854435, "MM": 0.5443747, "SSA": 0.0821373, "SA": 0.0410686, "MSF": 1.0158958, "MF": 1.0980331,
+    "RHO": 13.471515, "Q1": 13.398661, "T2": 29.958933, "R2": 30.041067, "2Q1": 12.854286, "P1": 14.958931,
+    "2SM2": 31.015896, "M3": 43.47616, "L2": 29.528479, "2MK3": 42.92714, "K2": 30.082138, "M8": 115.93642,
+    "MS4": 58.984104,
+}
+
+MIXED_TIDE = [
+    {"name": "M2", "amplitude": 1.2, "phase_GMT": 10.0},
+    {"name": "K1", "amplitude": 0.5, "phase_GMT": 100.0},
+    {"name": "O1", "amplitude": 0.4, "phase_GMT": 90.0},
+]
+
+
+def test_constituent_speeds_match_noaa():
+    speeds = constituent_speeds(list(NOAA_SPEEDS))
+    assert np.allclose(speeds, list(NOAA_SPEEDS.values()), atol=1e-5)
+
+
+def test_node_factors_at_lunar_standstills():
+    # Major standstill (2006): diurnal tides strongest, M2 weakest; minor (2015) the reverse
+    major = nodal_corrections(calendar.timegm((2006, 7, 1, 0, 0, 0)))
+    minor = nodal_corrections(calendar.timegm((2015, 7, 1, 0, 0, 0)))
+    assert major["M2"][0] == pytest.approx(0.963, abs=0.003) and minor["M2"][0] == pytest.approx(1.037, abs=0.003)
+    assert major["O1"][0] == pytest.approx(1.183, abs=0.005) and minor["O1"][0] == pytest.approx(0.806, abs=0.005)
+    assert major["K1"][0] == pytest.approx(1.113, abs=0.005) and minor["K1"][0] == pytest.approx(0.882, abs=0.005)
+
+
+def test_extremes_are_the_turning_points_of_the_curve():
+    model = HarmonicModel(MIXED_TIDE, msl_above_mllw=1.5)
+    begin = calendar.timegm((2024, 5, 1, 0, 0, 0))
+    times, heights, is_high = model.extremes(begin, begin + 2 * 86400)
+    assert len(times) >= 6
+
+    dense = np.arange(begin - 3600, begin + 2 * 86400 + 3600, 10.0)
+    curve = model.heights(dense)
+    for epoch, height, high in zip(times, heights, is_high):
+        window = np.abs(dense - epoch) < 3600
+        extreme = np.argmax(curve[window]) if high else np.argmin(curve[window])
+        assert abs(dense[window][extreme] - epoch) < 60
+        assert height == pytest.approx(curve[window][extreme], abs=0.001)
+
+
+def test_subordinate_offsets():
+    epochs, heights, is_high = np.array([0.0, 21600.0]), np.array([2.0, 0.5]), np.array([True, False])
+    offsets = {"timeOffsetHighTide": -20, "timeOffsetLowTide": 15, "heightOffsetHighTide": 0.9,
+               "heightOffsetLowTide": 0.8, "heightAdjustedType": "R"}
+    shifted, scaled, _ = apply_offsets(epochs, heights, is_high, offsets)
+    assert shifted.tolist() == [-1200.0, 22500.0]
+    assert scaled.tolist() == pytest.approx([1.8, 0.4])
+
+    _, added, _ = apply_offsets(epochs, heights, is_high, {**offsets, "heightAdjustedType": "A"})
+    assert added.tolist() == pytest.approx([2.9, 1.3])
+
+
+def test_falls_back_to_harmonics_when_noaa_is_down(monkeypatch, tmp_path):
+    predictor = HarmonicPredictor(TTLCache("harmonic_constants", default_ttl=HARMONICS_TTL))
+    predictor.cache.set("8723214", {"type": "R", "harcon": {"HarmonicConstituents": MIXED_TIDE},
+                                    "datums": {"datums": [{"name": "MSL", "value": 2.0}, {"name": "MLLW", "value": 0.5}]}})
+    w = GetDiveWeather(geocode_cache=object(), tide_cache=TTLCache("test"), harmonics=predictor,
+                       nws_caches=build_nws_caches(str(tmp_path / "nws_cache.sqlite3")))
+
+    def unreachable(*args, **kwargs):
+        raise requests.ConnectionError("datagetter unreachable")
+    monkeypatch.setattr(requests, "get", unreachable)
+
+    data = w.fetch_tide_predictions("8723214")
+    assert data["source"] == "harmonic"
+    assert {prediction["type"] for prediction in data["predictions"]} == {"H", "L"}
+    # The fallback isn't cached, so NOAA gets asked again next time
+    assert w.tide_cache.stats()["entries"] == 0
+
+
+def test_noaa_recordings_are_present():
+    if not FIXTURES:
+        message = "no recorded NOAA responses in fixtures/harmonics; run python record_noaa_fixtures.py"
+        if REQUIRE_FIXTURES:
+            pytest.fail(message)
+        pytest.skip(message)
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_matches_recorded_noaa_predictions(path):
+    with open(path) as f:
+        fixture = json.load(f)
+    predictor = HarmonicPredictor(TTLCache("harmonic_constants", default_ttl=HARMONICS_TTL))
+    for station_id, constants in fixture["constants"].items():
+        predictor.cache.set(station_id, constants)
+
+    params = fixture["params"]
+    begin = calendar.timegm(datetime.strptime(params["begin_date"], '%Y%m%d').timetuple())
+    end = calendar.timegm(datetime.strptime(params["end_date"], '%Y%m%d').timetuple()) + 86400
+    local = predictor.predict(fixture["station"], begin, end, pytz.utc)["predictions"]
+
+    constants = fixture["constants"][fixture["station"]]
+    ratio = 1.0
+    if constants["type"] == "S" and constants["offsets"].get("heightAdjustedType") != "A":
+        ratio = max(1.0, constants["offsets"]["heightOffsetHighTide"], constants["offsets"]["heightOffsetLowTide"])
+
+    noaa = fixture["predictions"]["predictions"]
+    assert len(local) == len(noaa)
+    for ours, theirs in zip(local, noaa):
+        assert ours["type"] == theirs["type"]
+        drift = abs(datetime.strptime(ours["t"], '%Y-%m-%d %H:%M') - datetime.strptime(theirs["t"], '%Y-%m-%d %H:%M'))
+        assert drift <= HILO_TIME_TOLERANCE, f"{theirs['t']}: {drift}"
+        assert abs(float(ours["v"]) - float(theirs["v"])) <= HILO_HEIGHT_TOLERANCE * ratio, theirs
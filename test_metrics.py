@@ -0,0 +1,66 @@
+import asyncio, time
+import noaa_client
+from metrics import Histogram, Metrics
+from pipeline import ReportPipeline
+from test_noaa_client import run_with_stub
+
+# Run with: python -m pytest test_metrics.py
+
+
+def test_histogram_quantiles_and_buckets():
+    hist = Histogram(buckets=(0.1, 1.0))
+    for ms in range(1, 101):
+        hist.observe(ms / 100)
+    assert hist.counts == [10, 100]
+    assert hist.quantile(0.5) == 0.51
+    assert hist.quantile(0.99) == 1.0
+
+
+def test_spans_from_concurrent_tasks_attach_to_the_request():
+    metrics = Metrics()
+
+    async def stage(name, delay):
+        with metrics.span(name):
+            await asyncio.sleep(delay)
+
+    async def command():
+        with metrics.request("weather") as trace:
+            await asyncio.gather(stage("tides", 0.02), stage("forecast", 0.01))
+        return trace
+
+    trace = asyncio.run(command())
+    assert sorted(stage for stage, _ in trace["spans"]) == ["forecast", "tides"]
+    assert metrics.stages[("weather", "tides")].count == 1
+    assert metrics.requests["weather"].count == 1
+
+
+def test_slow_request_log_dumps_the_spans(capsys):
+    metrics = Metrics(slow_request_seconds=0.01)
+    with metrics.request("guide"):
+        with metrics.span("guide_store"):
+            time.sleep(0.02)
+    with metrics.request("guide"):
+        pass
+    out = capsys.readouterr().out
+    assert out.count("Slow /guide") == 1
+    assert "guide_store=" in out
+
+
+def test_pipeline_stages_and_upstream_counts_are_exported(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(noaa_client, "get_metrics", lambda: metrics)
+
+    async def scenario(w):
+        with metrics.request("weather") as trace:
+            await ReportPipeline(w, metrics=metrics).run("key largo", "FL")
+        return trace
+
+    trace = run_with_stub(monkeypatch, scenario)
+    stages = {stage for stage, _ in trace["spans"]}
+    assert {"geocode", "nearest_station", "tides", "water_temp", "forecast", "format_tide_data",
+            "noaa_datagetter", "nws_points", "nws_forecast"} <= stages
+
+    text = metrics.render()
+    assert 'divebot_upstream_requests_total{host="127.0.0.1",status="200"} 4' in text
+    assert 'divebot_stage_seconds_count{command="weather",stage="geocode"} 1' in text
+    assert 'divebot_request_seconds_quantile{command="weather",quantile="0.99"}' in text
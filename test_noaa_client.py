@@ -0,0 +1,311 @@
+import asyncio, time
+from aiohttp import web
+import harmonics, weather
+from breaker import BreakerRegistry
+from cache import TTLCache
+from harmonics import HarmonicPredictor
+from noaa_client import AsyncNoaaClient
+from weather import DATA_UNAVAILABLE, GetDiveWeather, build_nws_caches
+
+# Run with: python -m pytest test_noaa_client.py
+
+DELAY = 0.3  # seconds the stub upstream takes per request
+CONCURRENCY = 10
+
+TIDE_RESPONSE = {"predictions": [{"t": "2023-10-06 04:12", "v": "1.902", "type": "H"}]}
+CURRENTS_RESPONSE = {"current_predictions": {"cp": [
+    {"Time": "2023-10-06 09:10", "Type": "slack", "Velocity_Major": 0.0, "meanFloodDir": 70, "meanEbbDir": 250, "Bin": "1"},
+    {"Time": "2023-10-06 12:00", "Type": "flood", "Velocity_Major": 1.43, "meanFloodDir": 70, "meanEbbDir": 250, "Bin": "1"},
+    {"Time": "2023-10-06 15:30", "Type": "slack", "Velocity_Major": 0.0, "meanFloodDir": 70, "meanEbbDir": 250, "Bin": "1"},
+    {"Time": "2023-10-06 18:40", "Type": "ebb", "Velocity_Major": -1.91, "meanFloodDir": 70, "meanEbbDir": 250, "Bin": "1"},
+]}}
+WATER_TEMP_RESPONSE = {"data": [{"t": "2023-10-06 04:00", "v": "81.3"}]}
+NO_SENSOR_STATION = "9999001"  # not in the catalog, so region and report tests never pick it
+NO_SENSOR_RESPONSE = {"error": {"message": "No data was found. This product may not be offered at this station at the requested time."}}
+UPSTREAM_CALLS = []
+FORECAST_CACHE_CONTROL = "public, max-age=0"
+FAIL_NEXT = 0  # datagetter requests to answer with a 503 before recovering
+
+
+async def start_stub_server():
+    async def datagetter(request):
+        global FAIL_NEXT
+        UPSTREAM_CALLS.append(dict(request.query))
+        await asyncio.sleep(DELAY)
+        if FAIL_NEXT > 0:
+            FAIL_NEXT -= 1
+            return web.Response(status=503)
+        if request.query.get("product") == "water_temperature" and request.query.get("station") == NO_SENSOR_STATION:
+            return web.json_response(NO_SENSOR_RESPONSE)
+        if request.query.get("product") == "water_temperature":
+            return web.json_response(WATER_TEMP_RESPONSE)
+        if request.query.get("product") == "currents_predictions":
+            return web.json_response(CURRENTS_RESPONSE)
+        return web.json_response(TIDE_RESPONSE)
+
+    async def points(request):
+        UPSTREAM_CALLS.append({"points": request.match_info["coords"]})
+        await asyncio.sleep(DELAY)
+        return web.json_response({"properties": {"forecast": str(request.url.with_path("/forecast").with_query(None))}})
+
+    async def forecast(request):
+        UPSTREAM_CALLS.append({"forecast": request.headers.get("If-None-Match")})
+        await asyncio.sleep(DELAY)
+        # max-age=0 makes every later lookup a conditional request
+        headers = {"ETag": '"forecast-v1"', "Cache-Control": FORECAST_CACHE_CONTROL}
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            return web.Response(status=304, headers=headers)
+        period = {"temperature": 84, "temperatureUnit": "F", "windSpeed": "10 mph", "windDirection": "E",
+                  "shortForecast": "Sunny", "detailedForecast": "Sunny.", "name": "Today"}
+        return web.json_response({"properties": {"periods": [period]}}, content_type="application/geo+json", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/datagetter", datagetter)
+    app.router.add_get("/points/{coords}", points)
+    app.router.add_get("/forecast", forecast)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+class StubGeocodeCache:
+    def lookup(self, city, state):
+        return 25.08, -80.45
+
+
+def offline_caches(tmp_path):
+    # Otherwise GetDiveWeather opens the bot's NWS and harmonic-constant caches in the repo directory
+    return {"nws_caches": build_nws_caches(str(tmp_path / "nws_cache.sqlite3")),
+            "harmonics": HarmonicPredictor(TTLCache("harmonic_constants", default_ttl=60))}
+
+
+def run_with_stub(monkeypatch, scenario, breakers=None, **weather_kwargs):
+    async def main():
+        runner, base = await start_stub_server()
+        monkeypatch.setattr(weather, "BASE_URL", f"{base}/datagetter")
+        monkeypatch.setattr(weather, "WATER_TEMP_URL", f"{base}/datagetter")
+        monkeypatch.setattr(weather, "BASE_NWS_URL", base)
+        monkeypatch.setattr(harmonics, "MDAPI_URL", f"{base}/mdapi")
+        client = AsyncNoaaClient(timeout=5, breakers=breakers or BreakerRegistry())
+        w = GetDiveWeather(geocode_cache=StubGeocodeCache(), http=client, **{"tide_cache": TTLCache("test"), "observation_cache": TTLCache("test", default_ttl=360),
+                                                                                     "nws_caches": (TTLCache("points", default_ttl=3600), TTLCache("forecast", default_ttl=60)),
+                                                                                     "harmonics": HarmonicPredictor(TTLCache("harmonics", default_ttl=60), client),
+                                                                                     **weather_kwargs})
+        try:
+            return await scenario(w)
+        finally:
+            await asyncio.gather(*w._background, return_exceptions=True)
+            await client.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_take_about_as_long_as_one(monkeypatch):
+    async def scenario(w):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(w.fetch_tide_predictions_async("8723214") for _ in range(CONCURRENCY)))
+        return time.perf_counter() - start, results
+
+    elapsed, results = run_with_stub(monkeypatch, scenario)
+    assert all(result == TIDE_RESPONSE for result in results)
+    assert elapsed < DELAY * 2, f"{CONCURRENCY} requests took {elapsed:.2f}s"
+
+
+def test_concurrent_weather_commands_run_in_parallel(monkeypatch):
+    async def one_command(w):
+        station_id, station_msg = await w.get_nearest_station_async("key largo", "FL")
+        tide_data = await w.fetch_tide_predictions_async(station_id)
+        water_temp_data = await w.fetch_water_temperature_async(station_id)
+        forecast = (await w.weather_async("key largo", "FL"))[0]
+        return w.format_tide_data(tide_data, water_temp_data, "key largo", "FL", forecast=forecast, station_msg=station_msg)
+
+    async def scenario(w):
+        start = time.perf_counter()
+        reports = await asyncio.gather(*(one_command(w) for _ in range(CONCURRENCY)))
+        return time.perf_counter() - start, reports
+
+    elapsed, reports = run_with_stub(monkeypatch, scenario)
+    assert all("Water Temperature: 81.3°F" in report for report in reports)
+    # One command is four sequential upstream calls
+    assert elapsed < DELAY * 4 * 2, f"{CONCURRENCY} commands took {elapsed:.2f}s"
+
+
+def test_request_timeout(monkeypatch):
+    async def scenario(w):
+        try:
+            await w.http.get_json(weather.BASE_URL, timeout=DELAY / 3)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    assert run_with_stub(monkeypatch, scenario)
+
+
+def test_pipeline_renders_what_arrived_before_the_deadline(monkeypatch):
+    from pipeline import ReportPipeline
+
+    async def scenario(w):
+        # The stub answers in DELAY seconds; give water temperature less than that
+        pipeline = ReportPipeline(w, deadlines={"tides": DELAY * 3, "water_temp": DELAY / 3, "forecast": DELAY * 3})
+        start = time.perf_counter()
+        report = await pipeline.run("key largo", "FL")
+        return time.perf_counter() - start, report
+
+    elapsed, report = run_with_stub(monkeypatch, scenario)
+    assert "Water Temperature: data unavailable" in report
+    assert "Conditions: Sunny" in report
+    # Tides and water temp run alongside the two NWS calls instead of after them
+    assert elapsed < DELAY * 3, f"pipeline took {elapsed:.2f}s"
+
+
+def test_warm_tide_cache_skips_the_network(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        first = await w.fetch_tide_predictions_async("8723214")
+        second = await w.fetch_tide_predictions_async("8723214")
+        return first, second, w.tide_cache.stats()
+
+    first, second, stats = run_with_stub(monkeypatch, scenario)
+    assert first == second == TIDE_RESPONSE
+    assert len(UPSTREAM_CALLS) == 1
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_tide_cache_expires_at_station_midnight(tmp_path):
+    w = GetDiveWeather(geocode_cache=StubGeocodeCache(), tide_cache=TTLCache("test"), **offline_caches(tmp_path))
+    # Virginia Key is UTC-5: 2023-10-06 22:30 local is 03:30 UTC on the 7th
+    now = 1696649400
+    assert w.station_midnight("8723214", now=now) == 1696654800  # 2023-10-07 00:00 at UTC-5
+
+
+def test_concurrent_water_temp_misses_share_one_request(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        results = await asyncio.gather(*(w.fetch_water_temperature_async("8723214") for _ in range(CONCURRENCY)))
+        # Within the TTL a later request is a plain cache hit
+        results.append(await w.fetch_water_temperature_async("8723214"))
+        return results, w.water_temperature_stats()
+
+    results, stats = run_with_stub(monkeypatch, scenario, observation_cache=TTLCache("test", default_ttl=360))
+    assert all(result == WATER_TEMP_RESPONSE for result in results)
+    assert len(UPSTREAM_CALLS) == 1
+    assert stats["upstream_calls"] == 1
+    assert stats["coalesced"] == CONCURRENCY - 1
+    assert stats["hits"] == 1
+
+
+def test_station_without_a_sensor_reports_water_temperature_unavailable(monkeypatch):
+    async def scenario(w):
+        first = await w.fetch_water_temperature_async(NO_SENSOR_STATION)
+        return first, w.observation_cache.get_stale(NO_SENSOR_STATION), w.format_tide_data(
+            TIDE_RESPONSE, first, "key largo", "FL", forecast="", station_msg="")
+
+    data, cached, report = run_with_stub(monkeypatch, scenario)
+    assert data is None and cached is None
+    assert f"Water Temperature: {DATA_UNAVAILABLE}" in report
+
+
+def test_nws_points_cached_and_forecast_revalidated(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        first = await w.forecast_for_coords_async(25.0801, -80.4502)
+        # A few metres away: same points entry, and the forecast is revalidated with its ETag
+        second = await w.forecast_for_coords_async(25.0803, -80.4499)
+        return first, second
+
+    first, second = run_with_stub(monkeypatch, scenario)
+    assert first == second
+    assert UPSTREAM_CALLS == [{"points": "25.08,-80.45"}, {"forecast": None}, {"forecast": '"forecast-v1"'}]
+
+
+def test_concurrent_forecast_misses_share_one_points_and_one_forecast_request(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        return await asyncio.gather(*(w.forecast_for_coords_async(25.0801, -80.4502) for _ in range(CONCURRENCY)))
+
+    results = run_with_stub(monkeypatch, scenario)
+    assert all(result == results[0] for result in results)
+    assert UPSTREAM_CALLS == [{"points": "25.08,-80.45"}, {"forecast": None}]
+
+
+def test_fresh_forecast_costs_nothing(monkeypatch):
+    monkeypatch.setitem(globals(), "FORECAST_CACHE_CONTROL", "public, max-age=600")
+
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        await w.forecast_for_coords_async(25.08, -80.45)
+        await w.forecast_for_coords_async(25.08, -80.45)
+
+    run_with_stub(monkeypatch, scenario)
+    assert len(UPSTREAM_CALLS) == 2  # one points lookup, one forecast
+
+
+def test_currents_use_the_index_and_prediction_cache(monkeypatch):
+    from pipeline import ReportPipeline
+
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        pipeline = ReportPipeline(w)
+        first = await pipeline.run_currents("key largo", "FL")
+        second = await pipeline.run_currents("key largo", "FL")
+        return first, second, list(UPSTREAM_CALLS)
+
+    first, second, calls = run_with_stub(monkeypatch, scenario)
+    assert first == second and "Nearest current station" in first
+    assert len(calls) == 1
+    assert calls[0]["product"] == "currents_predictions" and calls[0]["interval"] == "MAX_SLACK"
+
+
+def test_concurrent_current_misses_share_one_request(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        return await asyncio.gather(*(w.fetch_current_predictions_async("ACT6366", 1) for _ in range(CONCURRENCY)))
+
+    results = run_with_stub(monkeypatch, scenario)
+    assert all(result == CURRENTS_RESPONSE for result in results)
+    assert len(UPSTREAM_CALLS) == 1
+
+
+def test_current_bin_and_next_events(tmp_path):
+    from datetime import datetime
+    import pytz
+    from stations import Station
+
+    w = GetDiveWeather(geocode_cache=StubGeocodeCache(), tide_cache=TTLCache("test"), **offline_caches(tmp_path))
+    station = Station("KEY0001", "Test Channel", 24.55, -81.8, bins=[(1, 30.0, "S"), (2, 10.0, "S"), (3, None, "S")])
+    assert w.choose_current_bin(station) == (2, 10.0, "S")
+    assert w.choose_current_bin(station, depth=25) == (1, 30.0, "S")
+
+    # 14:00 UTC is 10:00 EDT: the morning slack has passed
+    report = w.format_current_data(CURRENTS_RESPONSE, station, (2, 10.0, "S"), 3.2, "key west", "FL",
+                                   now=datetime(2023, 10, 6, 14, 0, tzinfo=pytz.utc))
+    assert "- Next Slack: 03:30 PM" in report
+    assert "- Next Max Flood: 12:00 PM, 1.4 knots toward 70°" in report
+    assert "- Next Max Ebb: 06:40 PM, 1.9 knots toward 250°" in report
+    assert "Slack at 09:10 AM" in report
+
+
+def test_identical_reports_come_from_the_rendered_cache(monkeypatch):
+    import test_noaa_client
+    from pipeline import ReportPipeline
+    monkeypatch.setattr(test_noaa_client, "FORECAST_CACHE_CONTROL", "public, max-age=600")
+
+    async def scenario(w):
+        pipeline = ReportPipeline(w)
+        first = await pipeline.run("key largo", "FL")
+        UPSTREAM_CALLS.clear()
+        start = time.perf_counter()
+        second = await pipeline.run("Key Largo", "fl")
+        elapsed = time.perf_counter() - start
+        key = next(iter(pipeline.report_cache.entries))
+        return first, second, elapsed, list(UPSTREAM_CALLS), pipeline, key, w
+
+    first, second, elapsed, calls, pipeline, key, w = run_with_stub(monkeypatch, scenario)
+    assert second == first and calls == [] and elapsed < DELAY
+    stats = pipeline.stats()
+    assert stats["hits"] == 1 and stats["time_saved_s"] >= DELAY
+    # Never outlives the water temperature observation it shows
+    assert pipeline.report_cache.expiry(key) <= w.observation_cache.expiry(key[0])
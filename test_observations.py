@@ -0,0 +1,154 @@
+import asyncio, threading
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from aiohttp import web
+import observations
+from noaa_client import AsyncNoaaClient
+from breaker import BreakerRegistry
+from observations import ObservationStore, fetch_ranges, parse_observations
+
+# Run with: python -m pytest test_observations.py
+
+DAY = 86400
+NOW = 1_700_000_000 // DAY * DAY + 12 * 3600  # midday UTC
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def epoch(text):
+    return int(datetime.strptime(text, '%Y%m%d %H:%M').replace(tzinfo=timezone.utc).timestamp())
+
+
+def test_fetch_ranges_backfill_then_only_whats_new():
+    backfill = fetch_ranges(None, NOW, backfill_days=45)
+    assert backfill[0][0] == NOW - 45 * DAY and backfill[-1][1] == NOW
+    assert all(end - begin < 30 * DAY for begin, end in backfill)
+    assert fetch_ranges(NOW - 3600, NOW) == [(NOW - 3600 + 360, NOW)]
+    assert fetch_ranges(NOW, NOW) == []
+
+
+def test_append_skips_what_is_stored_and_survives_a_torn_write(tmp_path):
+    store = ObservationStore(str(tmp_path))
+    assert store.append("water_temperature", "8723214", [NOW, NOW - 360], [80.1, 80.0]) == 2
+    assert store.append("water_temperature", "8723214", [NOW - 360, NOW, NOW + 360], [0, 0, 80.2]) == 1
+    # A crash after writing the value column but before the time column
+    with open(tmp_path / "water_temperature" / "8723214.v", "ab") as f:
+        f.write(np.float32(99).tobytes())
+    times, values = store.columns("water_temperature", "8723214")
+    assert times.tolist() == [NOW - 360, NOW, NOW + 360]
+    assert store.append("water_temperature", "8723214", [NOW + 720], [80.3]) == 1
+    assert store.columns("water_temperature", "8723214")[1].tolist() == np.float32([80.0, 80.1, 80.2, 80.3]).tolist()
+
+
+def test_partial_records_are_ignored_then_trimmed(tmp_path):
+    store = ObservationStore(str(tmp_path))
+    store.append("water_temperature", "8723214", [NOW - 360, NOW], [80.0, 80.1])
+    # A crash part-way through both records of the next append
+    with open(tmp_path / "water_temperature" / "8723214.v", "ab") as f:
+        f.write(np.float32(99).tobytes()[:3])
+    with open(tmp_path / "water_temperature" / "8723214.t", "ab") as f:
+        f.write(np.int64(NOW + 360).tobytes()[:5])
+    times, values = store.columns("water_temperature", "8723214")
+    assert times.tolist() == [NOW - 360, NOW] and len(values) == 2
+    assert store.last_time("water_temperature", "8723214") == NOW
+    assert store.append("water_temperature", "8723214", [NOW + 360], [80.2]) == 1
+    times, values = store.columns("water_temperature", "8723214")
+    assert times.tolist() == [NOW - 360, NOW, NOW + 360]
+    assert values.tolist() == np.float32([80.0, 80.1, 80.2]).tolist()
+
+
+def test_daily_aggregates_and_anomalies(tmp_path):
+    store = ObservationStore(str(tmp_path), clock=Clock())
+    midnight = NOW // DAY * DAY
+    times = np.arange(NOW - 40 * DAY, NOW, 3600)
+    # 78°F for the baseline month, 81°F this past week, with a ±1° daily swing
+    values = np.where(times >= midnight - 7 * DAY, 81.0, 78.0) + np.sin(times / DAY * 2 * np.pi)
+    store.append("water_temperature", "8723214", times, values)
+
+    starts, lows, highs, means, counts = store.daily("water_temperature", "8723214", midnight - 3 * DAY, midnight)
+    assert starts.tolist() == [midnight - 3 * DAY, midnight - 2 * DAY, midnight - DAY] and counts.tolist() == [24] * 3
+    assert np.allclose(highs - lows, 2.0, atol=0.05)
+
+    week = store.anomalies("water_temperature", "8723214", days=5)
+    assert len(week) == 5
+    for day in week[:-1]:
+        # Each day is compared with its own trailing month, which takes in the warm days before it
+        prior = day["day"] - np.arange(1, 31) * DAY
+        expected = 81.0 - np.where(prior >= midnight - 7 * DAY, 81.0, 78.0).mean()
+        assert day["mean"] == pytest.approx(81.0, abs=0.01) and day["anomaly"] == pytest.approx(expected, abs=0.05)
+
+
+def test_update_fetches_only_the_new_range(tmp_path):
+    requests_seen, disk_threads = [], []
+
+    async def datagetter(request):
+        begin, end = epoch(request.query["begin_date"]), epoch(request.query["end_date"])
+        requests_seen.append((begin, end))
+        rows = [{"t": datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M'), "v": "80.5" if t % 720 else "", "f": "0,0,0"}
+                for t in range(begin, end + 1, 360)]
+        return web.json_response({"data": rows})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/datagetter", datagetter)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        observations.DATAGETTER_URL = f"http://127.0.0.1:{runner.addresses[0][1]}/datagetter"
+        client = AsyncNoaaClient(breakers=BreakerRegistry())
+        clock = Clock()
+        store = ObservationStore(str(tmp_path), http=client, clock=clock)
+        # Every file read and write should happen off the event loop's thread
+        columns = store.columns
+        store.columns = lambda *args: disk_threads.append(threading.get_ident()) or columns(*args)
+        loop_thread = threading.get_ident()
+        try:
+            first = await store.update_async("water_temperature", "8723214")
+            clock.now += 3600
+            second = await store.update_async("water_temperature", "8723214")
+            return first, second, loop_thread
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    original = observations.DATAGETTER_URL
+    try:
+        first, second, loop_thread = asyncio.run(main())
+    finally:
+        observations.DATAGETTER_URL = original
+    assert disk_threads and loop_thread not in disk_threads
+    assert len(requests_seen) == 3  # 45 days of backfill in two requests, then one hour
+    assert second == 5 and first > 45 * 24 * 5 - 5
+    assert requests_seen[-1][1] - requests_seen[-1][0] <= 3600
+
+
+def test_a_silent_station_is_not_backfilled_on_every_call(tmp_path):
+    calls = []
+
+    class NoData:
+        async def get_json(self, url, params=None):
+            calls.append(params["begin_date"])
+            return {"error": {"message": "No data was found."}}
+
+    clock = Clock()
+    store = ObservationStore(str(tmp_path), http=NoData(), clock=clock)
+    assert asyncio.run(store.update_async("water_temperature", "8723214")) == 0
+    assert len(calls) == 2  # the whole backfill, once
+    clock.now += 3600
+    assert asyncio.run(store.update_async("water_temperature", "8723214")) == 0
+    assert len(calls) == 2
+    clock.now += observations.OBSERVATIONS_EMPTY_RETRY
+    asyncio.run(store.update_async("water_temperature", "8723214"))
+    assert len(calls) == 4
+
+
+def test_parse_skips_gaps():
+    times, values = parse_observations({"data": [{"t": "2023-10-06 04:00", "v": "81.3"}, {"t": "2023-10-06 04:06", "v": ""}]})
+    assert times.tolist() == [epoch("20231006 04:00")] and values.tolist() == [np.float32(81.3)]
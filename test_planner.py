@@ -0,0 +1,38 @@
+import time
+import numpy as np
+from planner import DivePlanner, parse_sites, score_windows, wind_mph
+from test_noaa_client import UPSTREAM_CALLS, run_with_stub
+
+# Run with: python -m pytest test_planner.py
+
+
+def test_parse_sites_and_wind():
+    assert parse_sites("Key Largo, FL; Jupiter, FL\nBad entry") == [("Key Largo", "FL"), ("Jupiter", "FL")]
+    assert wind_mph("5 to 10 mph") == 10 and wind_mph("15 mph") == 15 and np.isnan(wind_mph(""))
+
+
+def test_windows_near_slack_in_warm_calm_water_score_best():
+    windows = np.array([[[0.0, 3 * 3600.0]], [[0.0, 3 * 3600.0]]])  # 2 sites, 1 day, 2 windows
+    events = np.array([[0.0, np.nan], [3 * 3600.0, 9 * 3600.0]])
+    weights = np.array([[1.0, np.nan], [0.8, 1.0]])
+    scores = score_windows(windows, events, weights, np.array([80.0, 60.0]), np.array([[5.0], [np.nan]]))
+    assert scores.shape == (2, 1, 2)
+    assert scores[0, 0, 0] == 1.0                     # high slack, warm, calm
+    assert scores[0, 0, 0] > scores[0, 0, 1]          # three hours off slack
+    assert scores[1, 0, 1] > scores[1, 0, 0]          # low slack at 03:00
+    assert np.isclose(scores[1, 0, 1], 0.5 * 0.8 + 0.2 * 0.0 + 0.3 * 0.5)
+
+
+def test_plan_fetches_each_station_and_grid_cell_once(monkeypatch):
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        planner = DivePlanner(w)
+        ranked = await planner.plan([("Key Largo", "FL"), ("Tavernier", "FL"), ("Islamorada", "FL")], days=7, now=time.time())
+        return ranked, planner.format_plan(ranked, 7), list(UPSTREAM_CALLS)
+
+    ranked, message, calls = run_with_stub(monkeypatch, scenario)
+    # The stub geocodes every site to the same spot: one tide, water temp, points and forecast call
+    assert len(calls) <= 4
+    assert sum(call.get("product") == "predictions" for call in calls) == 1
+    assert [entry["score"] for entry in ranked] == sorted((entry["score"] for entry in ranked), reverse=True)
+    assert "Dive Plan for the next 7 days" in message
@@ -0,0 +1,66 @@
+import asyncio
+from cache import SqliteStore, TTLCache
+from prefetch import PrefetchScheduler, StationPopularity
+from test_noaa_client import UPSTREAM_CALLS, run_with_stub
+
+# Run with: python -m pytest test_prefetch.py
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_popularity_decays():
+    clock = Clock()
+    popularity = StationPopularity(half_life=3600, clock=clock)
+    for _ in range(4):
+        popularity.record("8723214")
+    clock.now += 3 * 3600  # four lookups three half-lives ago count for half a lookup now
+    popularity.record("8722670")
+    assert popularity.top(2) == ["8722670", "8723214"]
+
+
+def test_popularity_ranks_every_shards_lookups(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "shared.sqlite3")
+    shards = [StationPopularity(clock=clock, shard_id=shard, shard_count=2, publish_every=60,
+                                shared=TTLCache("station_popularity", store=SqliteStore(path, "station_popularity")))
+              for shard in range(2)]
+    shards[0].record("8723214")
+    for _ in range(3):
+        shards[1].record("8722670")
+    assert shards[0].top(2) == ["8723214"]
+    # Shard 1 published on its first lookup; the rest wait for the next publish
+    assert asyncio.run(shards[0].top_all_shards(2)) == ["8723214", "8722670"]
+    clock.now += 60
+    shards[1].record("8722670")
+    assert asyncio.run(shards[0].top_all_shards(2)) == ["8722670", "8723214"]
+
+
+def test_prefetch_warms_popular_stations_within_budget(monkeypatch):
+    popularity = StationPopularity()
+    for station_id, lookups in (("8723214", 5), ("8722670", 3), ("8720218", 1)):
+        for _ in range(lookups):
+            popularity.record(station_id)
+
+    async def scenario(w):
+        UPSTREAM_CALLS.clear()
+        scheduler = PrefetchScheduler(w, popularity, stations=3, budget=3, interval=60)
+        await scheduler.tick()
+        warmed = list(UPSTREAM_CALLS)
+
+        # A user asking about the most popular station now is served from cache
+        UPSTREAM_CALLS.clear()
+        await w.fetch_tide_predictions_async("8723214")
+        await w.fetch_water_temperature_async("8723214")
+        return warmed, list(UPSTREAM_CALLS), scheduler.stats()
+
+    warmed, hot, stats = run_with_stub(monkeypatch, scenario, popularity=popularity)
+    assert len(warmed) == 3 and stats["over_budget"] == 1
+    stations = [call["station"] for call in warmed]
+    assert stations.count("8723214") == 2 and stations.count("8722670") == 1
+    assert hot == []
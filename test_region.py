@@ -0,0 +1,70 @@
+import time
+import test_noaa_client
+from region import BulkFetcher, RegionSummary, region_stations
+from test_noaa_client import DELAY, offline_caches, run_with_stub
+
+# Run with: python -m pytest test_region.py
+
+
+def test_region_stations_by_radius_and_state(tmp_path):
+    from weather import GetDiveWeather
+    w = GetDiveWeather(geocode_cache=object(), **offline_caches(tmp_path))
+    nearby = region_stations(w.index, w.catalog, 25.08, -80.45, radius_km=50, limit=10)
+    assert nearby and len(nearby) <= 10
+    assert [distance for distance, _ in nearby] == sorted(distance for distance, _ in nearby)
+    assert all(distance <= 50 for distance, _ in nearby)
+
+    florida = region_stations(w.index, w.catalog, state="FL", limit=25)
+    assert len(florida) == 25 and all(station.state == "FL" for _, station in florida)
+    assert florida[0][1].supports("watertemp")
+
+
+def test_bulk_fetch_is_concurrent_and_streams(monkeypatch):
+    async def scenario(w):
+        stations = region_stations(w.index, w.catalog, state="FL", limit=12)
+        summary = RegionSummary(w, BulkFetcher(w, concurrency=6))
+        start = time.perf_counter()
+        arrivals = []
+        async for line in summary.lines(stations):
+            arrivals.append((time.perf_counter() - start, line))
+        return stations, arrivals
+
+    stations, arrivals = run_with_stub(monkeypatch, scenario)
+    assert len(arrivals) == len(stations)
+    # 12 stations, 6 at a time, tides and water temp side by side: two rounds, not twelve
+    assert arrivals[-1][0] < DELAY * 4, f"took {arrivals[-1][0]:.2f}s"
+    assert arrivals[0][0] < arrivals[-1][0] - DELAY / 2  # the first lines didn't wait for the last
+    assert any("81.3°F" in line for _, line in arrivals)
+
+
+def test_failed_requests_are_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(test_noaa_client, "FAIL_NEXT", 1)
+
+    async def scenario(w):
+        fetcher = BulkFetcher(w, retries=2, backoff=0.01)
+        station = w.catalog.get("8723214")
+        results = [result async for result in fetcher.stream([(None, station)])]
+        return results, fetcher
+
+    results, fetcher = run_with_stub(monkeypatch, scenario)
+    _, _, tide, temp = results[0]
+    assert tide is not None and temp is not None
+    assert fetcher.retried == 1
+
+
+def test_a_station_that_raises_still_gets_its_line(monkeypatch):
+    async def scenario(w):
+        fetch_tides = w.fetch_tide_predictions_async
+
+        async def malformed(station_id):
+            if station_id == "8723214":
+                raise KeyError("predictions")
+            return await fetch_tides(station_id)
+
+        w.fetch_tide_predictions_async = malformed
+        stations = [(None, w.catalog.get("8723214")), (None, w.catalog.get("8722670"))]
+        return [line async for line in RegionSummary(w, BulkFetcher(w, backoff=0.01)).lines(stations)]
+
+    lines = run_with_stub(monkeypatch, scenario)
+    assert len(lines) == 2
+    assert any("8723214" in line and "tides unavailable" in line for line in lines)
@@ -0,0 +1,178 @@
+import asyncio, socketserver, threading, time
+import pytest
+from cache import RedisStore, SharedFlight, SqliteStore, TTLCache
+from geocache import GeocodeCache
+
+# Run with: python -m pytest test_shared_cache.py
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Stand-in for a Redis-compatible server: GET, SET (NX, PX), DEL, expiry, and EVAL of
+    RedisStore's compare-and-delete script"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def handle(self):
+        while (args := self.read_command()) is not None:
+            command, now = args[0].upper(), time.time()
+            with self.server.lock:
+                data = self.server.data
+                for key in [key for key, (_, expires) in data.items() if expires and expires <= now]:
+                    del data[key]
+                if command == "GET":
+                    value = data.get(args[1], (None,))[0]
+                    reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value.encode()), value.encode())
+                elif command == "SET":
+                    options = [arg.upper() for arg in args[3:]]
+                    expires = now + int(args[3 + options.index("PX") + 1]) / 1000 if "PX" in options else None
+                    if "NX" in options and args[1] in data:
+                        reply = b"$-1\r\n"
+                    else:
+                        data[args[1]] = (args[2], expires)
+                        reply = b"+OK\r\n"
+                elif command == "EVAL" and args[1] == RedisStore.RELEASE_SCRIPT:
+                    owned = data.get(args[3], (None,))[0] == args[4]
+                    reply = b":%d\r\n" % (data.pop(args[3]) is not None if owned else 0)
+                elif command == "DEL":
+                    reply = b":%d\r\n" % sum(data.pop(key, None) is not None for key in args[1:])
+                else:
+                    reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def redis_url():
+    server = FakeRedis()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/0"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sqlite_tier_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    # Two connections to one WAL file stand in for two bot processes
+    first = TTLCache("tides", default_ttl=60, store=SqliteStore(path, "tide_predictions"))
+    second = TTLCache("tides", default_ttl=60, store=SqliteStore(path, "tide_predictions"))
+    first.set(("predictions", "8723214"), {"predictions": []})
+    assert second.get(("predictions", "8723214")) == {"predictions": []}
+    assert second.stats()["store_hits"] == 1
+
+
+def test_leases_are_exclusive_until_released(tmp_path):
+    first, second = (SqliteStore(str(tmp_path / "shared.sqlite3"), "water_temperature") for _ in range(2))
+    assert first.lease("8723214", 10, "first")
+    assert not second.lease("8723214", 10, "second")
+    first.release("8723214", "first")
+    assert second.lease("8723214", 10, "second")
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "redis"])
+def test_a_lapsed_holder_cannot_release_the_new_owners_lease(backend, tmp_path, request):
+    if backend == "redis":
+        url = request.getfixturevalue("redis_url")
+        first, second = RedisStore(url, "water_temperature"), RedisStore(url, "water_temperature")
+    else:
+        first, second = (SqliteStore(str(tmp_path / "shared.sqlite3"), "water_temperature") for _ in range(2))
+    assert first.lease("8723214", 0.05, "slow")
+    time.sleep(0.1)
+    assert second.lease("8723214", 10, "fast")
+    first.release("8723214", "slow")  # finished late; the lease is no longer its to give up
+    assert not first.lease("8723214", 10, "third")
+    second.release("8723214", "fast")
+    assert first.lease("8723214", 10, "third")
+
+
+def test_redis_store_round_trip_and_expiry(redis_url):
+    store = RedisStore(redis_url, "water_temperature")
+    cache = TTLCache("water_temperature", store=store)
+    cache.set("8723214", {"data": [{"v": "81.3"}]}, ttl=60)
+    other = TTLCache("water_temperature", store=RedisStore(redis_url, "water_temperature"))
+    assert other.get("8723214") == {"data": [{"v": "81.3"}]}
+
+    store.set("gone", {"v": 1}, time.time() + 0.05)
+    time.sleep(0.1)
+    assert store.get("gone") is None
+    assert store.lease("8723214", 10, "a") and not store.lease("8723214", 10, "b")
+
+
+def test_geocode_cache_shares_places_through_the_store(redis_url):
+    calls = []
+
+    def geocoder(city, state):
+        calls.append(city)
+        return 25.08, -80.45
+
+    for _ in range(2):
+        cache = GeocodeCache(geocoder, store=RedisStore(redis_url, "geocode"))
+        assert cache.lookup("Key Largo", "Florida") == (25.08, -80.45)
+    assert calls == ["Key Largo"]
+
+
+def test_shared_flight_makes_one_upstream_call_across_processes(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    calls = []
+
+    async def fetch(cache):
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        cache.set("8723214", {"v": "81.3"})
+        return {"v": "81.3"}
+
+    async def main():
+        flights = []
+        for _ in range(2):
+            cache = TTLCache("water_temperature", default_ttl=60, store=SqliteStore(path, "water_temperature"))
+            flights.append((SharedFlight("water_temperature", cache, poll=0.01), cache))
+        return await asyncio.gather(*(flight.do("8723214", lambda cache=cache: fetch(cache))
+                                      for flight, cache in flights for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert results == [{"v": "81.3"}] * 6
+    assert len(calls) == 1
+
+
+def test_slow_store_is_bounded_and_skipped_from_the_event_loop():
+    class HungStore:
+        calls = 0
+
+        def get(self, key):
+            HungStore.calls += 1
+            time.sleep(0.5)
+
+        def set(self, key, value, expires):
+            time.sleep(0.5)
+
+    async def main():
+        cache = TTLCache("nws_points", default_ttl=60, store=HungStore(), store_timeout=0.05, store_retry=60)
+        start = time.perf_counter()
+        # The loop keeps running while the store hangs: the lookups wait side by side, not in turn
+        missed = await asyncio.gather(*(cache.get_async(("25.08", "-80.45")) for _ in range(5)))
+        cache.set(("25.08", "-80.45"), "https://api.weather.gov/gridpoints/MFL/75,20/forecast")
+        hit = await cache.get_async(("25.08", "-80.45"))
+        skipped = await cache.get_async("elsewhere")
+        return missed, hit, skipped, time.perf_counter() - start, cache.stats()
+
+    missed, hit, skipped, elapsed, stats = asyncio.run(main())
+    assert missed == [None] * 5 and skipped is None
+    assert hit == "https://api.weather.gov/gridpoints/MFL/75,20/forecast"
+    assert elapsed < 0.3
+    # After the failure the store is left alone for store_retry seconds
+    assert HungStore.calls == 5 and stats["store_errors"] == 5
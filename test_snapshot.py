@@ -0,0 +1,53 @@
+import json, os, time
+from snapshot import SnapshotCatalog, build_snapshot, catalog_version, load_catalog, snapshot_is_current, snapshot_path
+from stations import STATION_DIR, Station, StationCatalog
+
+# Run with: python -m pytest test_snapshot.py
+
+
+def write_lists(directory, lists):
+    for station_type, stations in lists.items():
+        with open(os.path.join(directory, f"noaa_stations_{station_type}.json"), "w") as f:
+            json.dump(stations, f)
+
+
+def test_every_station_survives_the_round_trip(tmp_path):
+    output = str(tmp_path / "noaa_stations.snapshot")
+    parsed = StationCatalog(STATION_DIR).load()
+    assert build_snapshot(STATION_DIR, output) == len(parsed)
+    mapped = SnapshotCatalog(output)
+    assert len(mapped) == len(parsed)
+    for station in parsed.stations():
+        copy = mapped.get(station.id)
+        for field in Station.__slots__:
+            assert getattr(copy, field) == getattr(station, field), (station.id, field)
+    for product in parsed.by_product:
+        assert sorted(s.id for s in mapped.stations(product)) == sorted(s.id for s in parsed.stations(product))
+
+
+def test_load_catalog_uses_the_snapshot_until_a_list_changes(tmp_path):
+    directory = str(tmp_path)
+    write_lists(directory, {
+        "tidepredictions": [{"id": "8723214", "name": "Virginia Key", "lat": 25.731, "lng": -80.162, "state": "FL",
+                             "type": "R", "timezonecorr": -5}],
+        "watertemp": [{"id": "8723214", "name": "Virginia Key", "lat": 25.731, "lng": -80.162, "state": "FL"},
+                      {"id": "9414290", "name": "San Francisco – Golden Gate", "lat": 37.806, "lng": -122.465, "state": "CA"}],
+        "currentpredictions": [{"id": "ACT7621", "name": "Government Cut", "lat": 25.76, "lng": -80.13, "currbin": 1, "depth": None, "type": "H"},
+                               {"id": "ACT7621", "name": "Government Cut", "lat": 25.76, "lng": -80.13, "currbin": 2, "depth": 16.0, "type": "H"}],
+    })
+    assert load_catalog(directory).__class__ is StationCatalog  # no snapshot yet
+    build_snapshot(directory, snapshot_path(directory))
+    version = catalog_version(directory)
+    catalog = load_catalog(directory)
+    assert isinstance(catalog, SnapshotCatalog)
+    assert catalog.get("9414290").name == "San Francisco – Golden Gate"  # non-ASCII names decode per string
+    virginia_key = catalog.get("8723214")
+    assert (virginia_key.state, virginia_key.type, virginia_key.timezonecorr) == ("FL", "R", -5)
+    assert virginia_key.product_names() == ["watertemp", "tidepredictions"]
+    assert catalog.get("ACT7621").bins == [(1, None, "H"), (2, 16.0, "H")]
+
+    time.sleep(0.01)  # a distinct mtime
+    write_lists(directory, {"watertemp": [{"id": "8723214", "name": "Virginia Key", "lat": 25.731, "lng": -80.162, "state": "FL"}]})
+    assert catalog_version(directory) != version
+    assert not snapshot_is_current(directory)
+    assert "9414290" not in load_catalog(directory)
@@ -0,0 +1,87 @@
+import math, random
+import numpy as np
+import pytest
+from spatial import StationIndex, haversine_km
+from stations import STATION_DIR, StationCatalog
+
+# Run with: python -m pytest test_spatial.py
+
+
+@pytest.fixture(scope="module")
+def index():
+    return StationIndex(StationCatalog(STATION_DIR).load())
+
+
+@pytest.fixture(scope="module")
+def points(index):
+    # Mostly near real (coastal) stations, plus open ocean, the poles and the antimeridian
+    rng = random.Random(42)
+    stations = index.catalog.stations("tidepredictions")
+    points = []
+    for _ in range(120):
+        station = rng.choice(stations)
+        points.append((station.lat + rng.uniform(-1, 1), station.lng + rng.uniform(-1, 1)))
+    points += [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(30)]
+    points += [(89.9, 10.0), (-89.9, -120.0), (51.0, 179.99), (51.0, -179.99), (0.0, 0.0)]
+    return points
+
+
+def brute_force(catalog, lat, lng, product=None):
+    """Every station of a product as (distance_km, station), closest first"""
+    return sorted(((haversine_km(lat, lng, station.lat, station.lng), station) for station in catalog.stations(product)),
+                  key=lambda pair: pair[0])
+
+
+def brute_force_with_fallback(catalog, lat, lng, preferred="physocean", fallback="tidepredictions", threshold_distance=50):
+    distance, station = brute_force(catalog, lat, lng, preferred)[0]
+    if distance > threshold_distance:
+        fallback_distance, fallback_station = brute_force(catalog, lat, lng, fallback)[0]
+        if fallback_distance < distance:
+            distance, station = fallback_distance, fallback_station
+    return station, distance
+
+
+@pytest.mark.parametrize("product", [None, "tidepredictions", "physocean", "currentpredictions"])
+def test_nearest_matches_brute_force(index, points, product):
+    for lat, lng in points:
+        expected = brute_force(index.catalog, lat, lng, product)
+        found = index.nearest(lat, lng, k=5, product=product)
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected[:5]], abs=1e-9)
+        within = [pair for pair in expected if pair[0] <= 100][:5]
+        found = index.nearest(lat, lng, k=5, radius_km=100, product=product)
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in within], abs=1e-9)
+
+
+def test_nearest_with_fallback_matches_brute_force(index, points):
+    fell_back = 0
+    for lat, lng in points:
+        station, distance = index.nearest_with_fallback(lat, lng)
+        expected_station, expected_distance = brute_force_with_fallback(index.catalog, lat, lng)
+        assert distance == pytest.approx(expected_distance, abs=1e-9)
+        assert station.id == expected_station.id or math.isclose(distance, expected_distance, abs_tol=1e-9)
+        fell_back += not station.supports("physocean")
+    assert fell_back, "no point exercised the tide-station fallback"
+
+
+def test_batch_apis_match_the_scalar_ones(index, points):
+    lats, lngs = (np.array(column) for column in zip(*points))
+    for product in ("tidepredictions", "physocean"):
+        ids, distances = index.nearest_batch(lats, lngs, product=product)
+        for (lat, lng), station_id, distance in zip(points, ids, distances):
+            expected_distance, expected_station = brute_force(index.catalog, lat, lng, product)[0]
+            assert distance == pytest.approx(expected_distance, abs=1e-6)
+            assert station_id == expected_station.id or math.isclose(distance, expected_distance, abs_tol=1e-6)
+
+    ids, distances = index.nearest_with_fallback_batch(lats, lngs)
+    for (lat, lng), station_id, distance in zip(points, ids, distances):
+        station, expected_distance = index.nearest_with_fallback(lat, lng)
+        assert distance == pytest.approx(expected_distance, abs=1e-6)
+        assert station_id == station.id or math.isclose(distance, expected_distance, abs_tol=1e-6)
+
+
+def test_empty_product_and_radius(index):
+    empty = StationIndex(StationCatalog(STATION_DIR, types=[]).load())
+    assert empty.nearest(25.0, -80.0) == []
+    ids, distances = empty.nearest_batch([25.0], [-80.0])
+    assert ids.tolist() == [None] and distances.tolist() == [np.inf]
+    assert index.nearest(0.0, -140.0, k=3, radius_km=10, product="tidepredictions") == []
@@ -0,0 +1,71 @@
+import json, os
+import pytest
+import stations, weather
+from snapshot import SnapshotCatalog, build_snapshot, snapshot_path
+from stations import get_catalog
+from weather import UpdateStations
+
+# Run with: python -m pytest test_update_stations.py
+
+
+def tide_station(station_id, name, lat, lng):
+    return {"id": station_id, "name": name, "lat": lat, "lng": lng, "state": "FL", "type": "R", "timezonecorr": -5}
+
+
+def current_bin(station_id, currbin, depth, lat=25.76, lng=-80.13):
+    return {"id": station_id, "name": "Government Cut", "lat": lat, "lng": lng, "currbin": currbin, "depth": depth, "type": "H"}
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_diff_reports_added_removed_and_changed_stations_and_bins(tmp_path):
+    update = UpdateStations(str(tmp_path))
+    old = [tide_station("8723214", "Virginia Key", 25.731, -80.162), tide_station("8722670", "Lake Worth Pier", 26.612, -80.034),
+           current_bin("ACT7621", 1, 6.0), current_bin("ACT7621", 2, 16.0)]
+    new = [tide_station("8723214", "Virginia Key, Biscayne Bay", 25.731, -80.162), tide_station("8720218", "Mayport", 30.397, -81.428),
+           current_bin("ACT7621", 1, 6.0, lat=25.77), current_bin("ACT7621", 2, 16.0), current_bin("ACT7621", 3, 26.0)]
+    diff = update.diff_station_list(old, new)
+    assert diff["added"] == ["8720218", "ACT7621_3"]  # a new bin of a known station counts
+    assert diff["removed"] == ["8722670"]
+    assert diff["changed"] == ["8723214", "ACT7621_1"]
+    assert diff["moved"] == ["ACT7621_1"]
+    assert update.diff_station_list(new, new) == {"added": [], "removed": [], "changed": [], "moved": []}
+
+
+def test_a_failed_write_leaves_the_old_list_in_place(tmp_path, monkeypatch):
+    update = UpdateStations(str(tmp_path))
+    update.write_station_file("tidepredictions", [tide_station("8723214", "Virginia Key", 25.731, -80.162)])
+    path = tmp_path / "noaa_stations_tidepredictions.json"
+
+    def dump_then_fail(stations, f, **kwargs):
+        f.write('[{"id": "87')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(weather.json, "dump", dump_then_fail)
+    with pytest.raises(OSError):
+        update.write_station_file("tidepredictions", [tide_station("8720218", "Mayport", 30.397, -81.428)])
+    monkeypatch.undo()
+    assert [station["id"] for station in read(path)] == ["8723214"]
+    assert os.listdir(tmp_path) == ["noaa_stations_tidepredictions.json"]  # no temp file left behind
+
+
+def test_update_rebuilds_the_snapshot_and_swaps_the_catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(stations, "_catalog", None)
+    update = UpdateStations(str(tmp_path))
+    update.write_station_file("tidepredictions", [tide_station("8723214", "Virginia Key", 25.731, -80.162)])
+    build_snapshot(str(tmp_path), snapshot_path(str(tmp_path)))
+
+    lists = {"tidepredictions": [tide_station("8723214", "Virginia Key", 25.731, -80.162), tide_station("8720218", "Mayport", 30.397, -81.428)],
+             "currentpredictions": [current_bin("ACT7621", 1, 6.0), current_bin("ACT7621", 2, 16.0)]}
+    monkeypatch.setattr(update, "fetch_station_list", lambda station_type: lists.get(station_type))
+    report = update.update_stations_file()
+    assert report["types"]["tidepredictions"]["added"] == ["8720218"]
+    assert report["types"]["currentpredictions"]["added"] == ["ACT7621_1", "ACT7621_2"]
+
+    catalog = get_catalog()
+    assert isinstance(catalog, SnapshotCatalog)  # the snapshot was rebuilt, not left stale
+    assert catalog.get("8720218").name == "Mayport"
+    assert [currbin for currbin, _, _ in catalog.get("ACT7621").bins] == [1, 2]
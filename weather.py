@@ -1,6 +1,16 @@
-import requests, json, math, pytz
+import asyncio, os, requests, json, math, pytz, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
 from datetime import datetime, timedelta
-from geopy.geocoders import Nominatim
+from stations import STATION_DIR, STATION_TYPES, get_catalog, set_catalog
+from snapshot import build_snapshot, load_catalog, snapshot_path
+from spatial import StationIndex, get_station_index
+from geocache import get_geocode_cache
+from gazetteer import get_gazetteer
+from noaa_client import get_async_client, get_sync, http_expiry
+from cache import SharedFlight, TTLCache, shared_store
+from harmonics import get_harmonic_predictor
+from prefetch import get_station_popularity
 
 state_abbreviations = {
     "AL": "Alabama",
@@ -58,30 +68,199 @@ state_abbreviations = {
 NOAA_BASE_URL = "https://api.tidesandcurrents.noaa.gov"
 
 BASE_URL = "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter"
+WATER_TEMP_URL = "https://tidesandcurrents.noaa.gov/api/datagetter"
 BASE_NWS_URL = "https://api.weather.gov"
+DATA_UNAVAILABLE = "data unavailable"
+# Standard-time UTC offsets (timezonecorr) to the zones NOAA's lst_ldt times are reported in
+US_TIMEZONES = {
+    -4: "America/Puerto_Rico",
+    -5: "US/Eastern",
+    -6: "US/Central",
+    -7: "US/Mountain",
+    -8: "US/Pacific",
+    -9: "US/Alaska",
+    -10: "US/Hawaii",
+    -11: "Pacific/Pago_Pago",
+    10: "Pacific/Guam",
+}
 HEADERS = {
     'User-Agent': 'ASDiveBot, contact: morgan.habecker@gmail.com', 
     'Accept': 'application/geo+json'
 }
 
+TIDE_CACHE_SIZE = int(os.getenv("TIDE_CACHE_SIZE") or 2048)
+TIDE_CACHE_PATH = os.getenv("TIDE_CACHE_PATH")  # optional SQLite file so predictions survive restarts
+
+_tide_cache = None
+
+def get_tide_cache():
+    global _tide_cache
+    if _tide_cache is None:
+        store = shared_store("tide_predictions", TIDE_CACHE_PATH)
+        _tide_cache = TTLCache("tide_predictions", max_entries=TIDE_CACHE_SIZE, store=store)
+    return _tide_cache
+
+# NOAA posts observations every 6 minutes, so anything younger than that is as fresh as upstream
+OBSERVATION_TTL = float(os.getenv("OBSERVATION_TTL") or 360)
+
+_observation_cache = None
+_observation_flight = None
+
+def get_observation_cache():
+    global _observation_cache
+    if _observation_cache is None:
+        # Only shared when CACHE_URL is set; a restart can just ask NOAA again
+        _observation_cache = TTLCache("water_temperature", max_entries=1024, default_ttl=OBSERVATION_TTL, store=shared_store("water_temperature"))
+    return _observation_cache
+
+def get_observation_flight():
+    global _observation_flight
+    if _observation_flight is None:
+        _observation_flight = SharedFlight("water_temperature", get_observation_cache())
+    return _observation_flight
+
+# The NWS points -> gridpoint mapping almost never changes; forecasts follow the NWS cache headers
+NWS_CACHE_PATH = os.getenv("NWS_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "nws_cache.sqlite3")
+NWS_POINTS_TTL = float(os.getenv("NWS_POINTS_TTL") or 30 * 24 * 3600)
+NWS_FORECAST_TTL = float(os.getenv("NWS_FORECAST_TTL") or 900)  # only used when NWS sends no cache headers
+
+_nws_caches = None
+
+def build_nws_caches(path=NWS_CACHE_PATH):
+    """(points, forecast) caches backed by CACHE_URL, else by the SQLite file at path (None: memory only)"""
+    return (
+        TTLCache("nws_points", max_entries=4096, default_ttl=NWS_POINTS_TTL, store=shared_store("nws_points", path)),
+        TTLCache("nws_forecast", max_entries=1024, default_ttl=NWS_FORECAST_TTL, store=shared_store("nws_forecast", path)),
+    )
+
+def get_nws_caches():
+    global _nws_caches
+    if _nws_caches is None:
+        _nws_caches = build_nws_caches()
+    return _nws_caches
+
 ##### GET NEW NOAA STATION LIST #####
 class UpdateStations:
-    def __init__(self):
+    def __init__(self, directory=STATION_DIR):
         self.DATA_BASE_URL = "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations.json?type="
-        self.TYPES = ["watertemp", "physocean", "tidepredictions", "currentpredictions", "currents", "waterlevels"]
+        self.TYPES = list(STATION_TYPES)
+        self.directory = directory
+
+    def fetch_station_list(self, station_type):
+        try:
+            response = requests.get(self.DATA_BASE_URL + station_type, timeout=60)
+        except requests.RequestException as e:
+            print(f"Failed to fetch data for {station_type}: {e}")
+            return None
+        print(f"Station: {station_type}  Response: {response.status_code}")
+        if response.status_code == 200:
+            return response.json()["stations"]
+        print(f"Failed to fetch data for {station_type}. HTTP Status: {response.status_code}")
+        return None
+
+    def load_station_file(self, station_type):
+        filename = os.path.join(self.directory, f"noaa_stations_{station_type}.json")
+        if not os.path.exists(filename):
+            return []
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def station_key(station):
+        # Current prediction stations appear once per bin; NOAA names each one <id>_<bin>
+        return f"{station['id']}_{station['currbin']}" if station.get("currbin") is not None else str(station["id"])
+
+    def diff_station_list(self, old_stations, new_stations, moved_degrees=1e-4):
+        """Station keys (ids, or id_bin for current bins) added, removed or changed between two
+        versions of a station list; "moved" are the changed ones whose coordinates differ"""
+        old = {self.station_key(station): station for station in old_stations}
+        new = {self.station_key(station): station for station in new_stations}
+        both = new.keys() & old.keys()
+        moved = [key for key in both
+                 if abs(float(new[key]["lat"]) - float(old[key]["lat"])) > moved_degrees
+                 or abs(float(new[key]["lng"]) - float(old[key]["lng"])) > moved_degrees]
+        return {
+            "added": sorted(new.keys() - old.keys()),
+            "removed": sorted(old.keys() - new.keys()),
+            "changed": sorted(key for key in both if new[key] != old[key]),
+            "moved": sorted(moved),
+        }
+
+    def write_station_file(self, station_type, stations):
+        # Compact JSON written to a temp file and renamed over the old one, so a crash
+        # mid-write never leaves a truncated catalog behind
+        filename = os.path.join(self.directory, f"noaa_stations_{station_type}.json")
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".noaa_stations_{station_type}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(stations, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
 
     def update_stations_file(self):
-        for station_type in self.TYPES:
-            response = requests.get(self.DATA_BASE_URL + station_type)
-            print(f"Station: {station_type}  Response: {response.status_code}")
-            if response.status_code == 200: 
-                data = response.json()
-                with open(f"noaa_stations_{station_type}.json", "w") as f:
-                    json.dump(data["stations"], f, indent=4)
-            else:
-                print(f"Failed to fetch data for {station_type}. HTTP Status: {response.status_code}")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.TYPES)) as pool:
+            fetched = dict(zip(self.TYPES, pool.map(self.fetch_station_list, self.TYPES)))
+
+        report = {"types": {}}
+        for station_type, stations in fetched.items():
+            if stations is None:
+                continue
+            diff = self.diff_station_list(self.load_station_file(station_type), stations)
+            self.write_station_file(station_type, stations)
+            report["types"][station_type] = diff
+            print(f"{station_type}: {len(stations)} stations, +{len(diff['added'])} -{len(diff['removed'])} "
+                  f"~{len(diff['changed'])} changed ({len(diff['moved'])} moved)")
+
+        if report["types"]:
+            if os.path.exists(snapshot_path(self.directory)):
+                build_snapshot(self.directory, snapshot_path(self.directory))
+            # Swap in the new catalog; the spatial index rebuilds on its next lookup
+            set_catalog(load_catalog(self.directory))
+        report["elapsed_s"] = round(time.perf_counter() - start, 2)
+        report["changed"] = sum(len(diff["added"]) + len(diff["removed"]) + len(diff["changed"]) for diff in report["types"].values())
+        print(f"Station refresh finished in {report['elapsed_s']}s with {report['changed']} changes")
+        return report
 
 class GetDiveWeather:
+    def __init__(self, catalog=None, geocode_cache=None, gazetteer=None, http=None, tide_cache=None, observation_cache=None, nws_caches=None, harmonics=None, popularity=None):
+        # Station lists are parsed once per process and shared by every command
+        self._catalog = catalog
+        self._index = StationIndex(catalog) if catalog is not None else None
+        self.geocode_cache = geocode_cache or get_geocode_cache()
+        # Offline place index; None unless gazetteer.bin has been built
+        self.gazetteer = gazetteer or get_gazetteer()
+        # Pooled aiohttp sessions backing the *_async fetchers
+        self.http = http or get_async_client()
+        # Harmonic predictions don't change during a day, so they're kept until the station's midnight
+        self.tide_cache = tide_cache if tide_cache is not None else get_tide_cache()
+        self.observation_cache = observation_cache if observation_cache is not None else get_observation_cache()
+        self.observation_flight = get_observation_flight() if observation_cache is None else SharedFlight("water_temperature", observation_cache)
+        self.tide_flight = SharedFlight("tide_predictions", self.tide_cache)
+        self.nws_points_cache, self.nws_forecast_cache = nws_caches or get_nws_caches()
+        # Neighbouring points and repeated places share one points lookup and one forecast request
+        self.points_flight = SharedFlight("nws_points", self.nws_points_cache)
+        self.forecast_flight = SharedFlight("nws_forecast", self.nws_forecast_cache)
+        # Local tide engine for when the datagetter is down; constants are fetched after a live answer
+        self.harmonics = harmonics or get_harmonic_predictor(self.http)
+        self._background = set()
+        # Which stations people ask about, for the background prefetcher
+        self.popularity = popularity or get_station_popularity()
+
+    # Follow the shared catalog, so a station refresh takes effect without a restart
+    @property
+    def catalog(self):
+        return self._catalog if self._catalog is not None else get_catalog()
+
+    @property
+    def index(self):
+        return self._index if self._index is not None else get_station_index()
+
     def convert_utc_to_est(self, utc_dt):
         utc_dt = pytz.utc.localize(utc_dt)
         est_dt = utc_dt.astimezone(pytz.timezone('US/Eastern'))
@@ -98,20 +277,26 @@ class GetDiveWeather:
             o_stations = json.load(file)
         return o_stations
 
-    def get_station_by_id(self, station_id, stations):
+    def get_station_by_id(self, station_id, stations=None):
+        if stations is None:
+            return self.catalog.get(station_id)
         for station in stations:
             if station["id"] == station_id:
                 return station
         return None
 
     def fetch_lat_long_for_city(self, city, state):
-        geolocator = Nominatim(user_agent="DiveBot")
-        location = geolocator.geocode(f"{city}, {state}")
-        
-        if location:
-            return (location.latitude, location.longitude)
-        else:
-            raise ValueError(f"Could not fetch coordinates for {city}, {state}")
+        state = self.convert_state_to_full_name(state.strip())
+        if self.gazetteer:
+            place = self.gazetteer.resolve(city, self.convert_state_to_abbreviation(state))
+            if place:
+                return place[1], place[2]
+        # "FL" and "Florida" share one cache entry (and one Nominatim request)
+        return self.geocode_cache.lookup(city, state)
+
+    async def fetch_lat_long_for_city_async(self, city, state):
+        # Gazetteer/cache hits are cheap, but a Nominatim miss blocks, so keep it off the event loop
+        return await asyncio.to_thread(self.fetch_lat_long_for_city, city, state)
 
     def haversine_distance(self, lat1, lon1, lat2, lon2):
         try:
@@ -133,41 +318,38 @@ class GetDiveWeather:
 
 
     def get_nearest_station(self, city, state, threshold_distance=50):
-        all_noaa_stations = self.load_stations_from_file()
-        all_physocean_stations = self.load__oceanographic_stations_from_file()
-        
         city_lat, city_long = self.fetch_lat_long_for_city(city, state)
+        return self.nearest_station_message(city_lat, city_long, city, state, threshold_distance)
 
-        nearest_station_id = None
-        nearest_distance = float('inf')
-        
-        for station in all_physocean_stations:
-            distance = self.haversine_distance(city_lat, city_long, station['lat'], station['lng'])
-            if distance < nearest_distance:
-                nearest_distance = distance
-                nearest_station_id = station['id']
-
-        # If no oceanographic station found within threshold_distance, check other stations
-        if not nearest_station_id or nearest_distance > threshold_distance:
-            for station in all_noaa_stations:
-                distance = self.haversine_distance(city_lat, city_long, station['lat'], station['lng'])
-                if distance < nearest_distance:
-                    nearest_distance = distance
-                    nearest_station_id = station['id']
-
-        nearest_station = self.get_station_by_id(nearest_station_id, all_noaa_stations)
+    async def get_nearest_station_async(self, city, state, threshold_distance=50):
+        city_lat, city_long = await self.fetch_lat_long_for_city_async(city, state)
+        return self.nearest_station_message(city_lat, city_long, city, state, threshold_distance)
+
+    def nearest_station_message(self, city_lat, city_long, city, state, threshold_distance=50):
+        # Prefer oceanographic stations; fall back to tide prediction stations past threshold_distance
+        nearest_station, nearest_distance = self.index.nearest_with_fallback(
+            city_lat, city_long, preferred="physocean", fallback="tidepredictions", threshold_distance=threshold_distance)
+        if nearest_station is None:
+            return None, f"Could not find a nearby NOAA station for {city}, {state}."
+
+        self.popularity.record(nearest_station.id)
         msg = f"`*Nearest NOAA station: {nearest_station['name']}, ID: {nearest_station['id']}\nThe station is {round(nearest_distance)} miles from {city.capitalize()}, {state.upper()}.*`"
-        return nearest_station_id, msg
+        return nearest_station.id, msg
+
+    def get_nearest_stations_batch(self, lats, lngs, threshold_distance=50):
+        """Station ids and distances for many already-geocoded points in one call,
+        with the same physocean-first preference as get_nearest_station"""
+        return self.index.nearest_with_fallback_batch(lats, lngs, threshold_distance=threshold_distance)
 
     ##### FETCH TIDE DATA #####
-    def fetch_tide_predictions(self, station_id):
+    def tide_prediction_params(self, station_id, days=1):
         now = datetime.utcnow()
-        end_date = now + timedelta(days=1)
+        end_date = now + timedelta(days=days)
 
         begin_date_str = now.strftime('%Y%m%d')
         end_date_str = end_date.strftime('%Y%m%d')
 
-        params = {
+        return {
             "begin_date": begin_date_str,
             "end_date": end_date_str,
             "station": station_id,
@@ -179,19 +361,271 @@ class GetDiveWeather:
             "format": "json"
         }
 
-        response = requests.get(BASE_URL, params=params)
-        data = response.json()
+    def tide_cache_key(self, params):
+        return (str(params["station"]), params["begin_date"], params["end_date"], params["datum"], params["interval"])
+
+    def station_offset(self, station):
+        """Standard-time UTC offset (hours) for a station. Current prediction stations carry no
+        timezone, so they borrow it from the nearest tide station."""
+        if station is None:
+            return -5
+        if station.timezonecorr is not None:
+            return station.timezonecorr
+        for _, neighbour in self.index.nearest(station.lat, station.lng, k=5, product="tidepredictions"):
+            if neighbour.timezonecorr is not None:
+                return neighbour.timezonecorr
+        return round(station.lng / 15)
+
+    def station_timezone(self, station):
+        offset = self.station_offset(station)
+        return pytz.timezone(US_TIMEZONES[offset]) if offset in US_TIMEZONES else pytz.FixedOffset(int(offset * 60))
+
+    def station_midnight(self, station_id, now=None):
+        """Epoch seconds of the next local (standard time) midnight at the station"""
+        offset = self.station_offset(self.catalog.get(station_id))
+        local_now = (now or time.time()) + offset * 3600
+        return (local_now // 86400 + 1) * 86400 - offset * 3600
+
+    def cache_tide_predictions(self, params, data):
+        # Only real predictions are cached; NOAA reports bad stations as {"error": ...}
+        if data and "predictions" in data:
+            self.tide_cache.set(self.tide_cache_key(params), data, expires=self.station_midnight(params["station"]))
+        return data
+
+    def local_tide_predictions(self, station_id, params=None):
+        """Hilo predictions from cached harmonic constants, or None if the station has none yet"""
+        params = params or self.tide_prediction_params(station_id)
+        tz = self.station_timezone(self.catalog.get(station_id))
+        begin = tz.localize(datetime.strptime(params["begin_date"], '%Y%m%d'))
+        end = tz.localize(datetime.strptime(params["end_date"], '%Y%m%d') + timedelta(days=1))
+        return self.harmonics.predict(station_id, begin.timestamp(), end.timestamp(), tz)
+
+    async def local_tide_predictions_async(self, station_id, params=None):
+        # Bring the constants into memory without blocking the loop; the prediction itself is local
+        await self.harmonics.constants_async(station_id)
+        return self.local_tide_predictions(station_id, params)
+
+    def tide_fallback(self, station_id, params, reason, local=None):
+        local = local if local is not None else self.local_tide_predictions(station_id, params)
+        if local is not None:
+            print(f"Tide predictions for station {station_id} unavailable ({reason}); using harmonic constants")
+        return local
+
+    def fetch_tide_predictions(self, station_id):
+        params = self.tide_prediction_params(station_id)
+        cached = self.tide_cache.get(self.tide_cache_key(params))
+        if cached is not None:
+            return cached
 
+        try:
+            response = get_sync(BASE_URL, params=params, breakers=self.http.breakers)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            local = self.tide_fallback(station_id, params, e)
+            if local is None:
+                raise
+            return local
+        if "predictions" not in data:
+            return self.tide_fallback(station_id, params, data.get("error")) or data
+
+        return self.cache_tide_predictions(params, data)
+
+    async def fetch_tide_predictions_async(self, station_id, days=1):
+        params = self.tide_prediction_params(station_id, days)
+        key = self.tide_cache_key(params)
+        cached = await self.tide_cache.get_async(key)
+        if cached is not None:
+            return cached
+        # One request per station and day, however many commands (and bot processes) ask at once
+        return await self.tide_flight.do(key, lambda: self._fetch_tide_predictions_upstream(station_id, params))
+
+    async def _fetch_tide_predictions_upstream(self, station_id, params):
+        try:
+            data = await self.http.get_json(BASE_URL, params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            local = self.tide_fallback(station_id, params, e, await self.local_tide_predictions_async(station_id, params))
+            if local is None:
+                raise
+            return local
+        if "predictions" not in data:
+            return self.tide_fallback(station_id, params, data.get("error"), await self.local_tide_predictions_async(station_id, params)) or data
+
+        if await self.harmonics.constants_async(station_id) is None:
+            self.in_background(self.harmonics.ensure_constants_async(station_id))
+        return self.cache_tide_predictions(params, data)
+
+    def in_background(self, coroutine):
+        """Run coroutine without making the caller wait; failures are only logged"""
+        async def logged():
+            try:
+                return await coroutine
+            except Exception as e:
+                print(f"Background refresh failed: {e}")
+        task = asyncio.ensure_future(logged())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    ##### TIDAL CURRENTS #####
+    def choose_current_bin(self, station, depth=None):
+        """(currbin, depth, type) closest to the requested depth, else the shallowest known bin"""
+        bins = station.bins or [(1, None, "")]
+        with_depth = [entry for entry in bins if entry[1] is not None]
+        if not with_depth:
+            return bins[0]
+        if depth is not None:
+            return min(with_depth, key=lambda entry: abs(entry[1] - depth))
+        return min(with_depth, key=lambda entry: entry[1])
+
+    def nearest_current_station(self, lat, lon, depth=None):
+        """(station, bin, distance_km) for the closest current prediction station"""
+        found = self.index.nearest(lat, lon, k=1, product="currentpredictions")
+        if not found:
+            return None, None, None
+        distance, station = found[0]
+        return station, self.choose_current_bin(station, depth), distance
+
+    def current_prediction_params(self, station_id, currbin):
+        params = self.tide_prediction_params(station_id)
+        del params["datum"]
+        params.update({"product": "currents_predictions", "bin": currbin, "interval": "MAX_SLACK"})
+        return params
+
+    def current_cache_key(self, params):
+        return ("currents", str(params["station"]), params["bin"], params["begin_date"], params["end_date"], params["interval"])
+
+    def cache_current_predictions(self, params, data):
+        # Same harmonic, same-day reasoning as tides: keep until the station's midnight
+        if data and "current_predictions" in data:
+            self.tide_cache.set(self.current_cache_key(params), data, expires=self.station_midnight(params["station"]))
         return data
 
+    def fetch_current_predictions(self, station_id, currbin=1):
+        params = self.current_prediction_params(station_id, currbin)
+        cached = self.tide_cache.get(self.current_cache_key(params))
+        if cached is not None:
+            return cached
+        return self.cache_current_predictions(params, get_sync(BASE_URL, params=params, breakers=self.http.breakers).json())
+
+    async def fetch_current_predictions_async(self, station_id, currbin=1):
+        params = self.current_prediction_params(station_id, currbin)
+        key = self.current_cache_key(params)
+        cached = await self.tide_cache.get_async(key)
+        if cached is not None:
+            return cached
+        # Same cache, same flight as the tide predictions: one request per station, bin and day
+        return await self.tide_flight.do(key, lambda: self._fetch_current_predictions_upstream(params))
+
+    async def _fetch_current_predictions_upstream(self, params):
+        return self.cache_current_predictions(params, await self.http.get_json(BASE_URL, params=params))
+
+    def format_current_data(self, current_data, station, current_bin, distance, city, state, now=None):
+        zone = self.station_timezone(station)
+        local_now = (now or datetime.now(pytz.utc)).astimezone(zone).replace(tzinfo=None)
+        currbin, depth, _ = current_bin
+        depth_str = f", depth {depth:g} ft" if depth is not None else ""
+        output = [
+            f">>> ## __DiveBot Currents for {city.capitalize()}, {state.upper()} as of {local_now.strftime('%m/%d/%Y at %I:%M %p')}__\n",
+            f"`*Nearest current station: {station.name}, ID: {station.id} (bin {currbin}{depth_str})\n"
+            f"The station is {round(distance)} km from {city.capitalize()}, {state.upper()}.*`",
+        ]
+        if not current_data or "current_predictions" not in current_data:
+            output.append(f"- Current predictions: {DATA_UNAVAILABLE}")
+            return "\n".join(output)
+
+        events = []
+        for prediction in current_data["current_predictions"].get("cp", []):
+            event_time = datetime.strptime(prediction["Time"], '%Y-%m-%d %H:%M')
+            events.append((event_time, prediction))
+
+        upcoming = {}
+        for event_time, prediction in events:
+            kind = prediction["Type"].lower()
+            if event_time > local_now and kind not in upcoming:
+                upcoming[kind] = (event_time, prediction)
+
+        def describe(kind, event_time, prediction):
+            if kind == "slack":
+                return f"Slack at {event_time.strftime('%I:%M %p')}"
+            direction = prediction.get("meanFloodDir" if kind == "flood" else "meanEbbDir")
+            direction_str = f" toward {direction:g}°" if isinstance(direction, (int, float)) else ""
+            return f"Max {kind.capitalize()} at {event_time.strftime('%I:%M %p')}, {abs(float(prediction['Velocity_Major'])):.1f} knots{direction_str}"
+
+        for kind, label in (("slack", "Next Slack"), ("flood", "Next Max Flood"), ("ebb", "Next Max Ebb")):
+            if kind in upcoming:
+                output.append(f"- {label}: {describe(kind, *upcoming[kind]).split(' at ', 1)[1]}")
+
+        output.append("\n__**Today's Currents:**__")
+        for event_time, prediction in events:
+            if event_time.date() == local_now.date():
+                output.append(f"- {describe(prediction['Type'].lower(), event_time, prediction)}")
+        return "\n".join(output)
+
+    def water_temperature_params(self, station_id):
+        return {
+            "date": "today",
+            "station": station_id,
+            "product": "water_temperature",
+            "units": "english",
+            "time_zone": "lst_ldt",
+            "format": "json"
+        }
+
     def fetch_water_temperature(self, station_id):
-        url = f"https://tidesandcurrents.noaa.gov/api/datagetter?date=today&station={station_id}&product=water_temperature&units=english&time_zone=lst_ldt&format=json"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
+        cached = self.observation_cache.get(str(station_id))
+        if cached is not None:
+            return cached
+
+        try:
+            response = get_sync(WATER_TEMP_URL, params=self.water_temperature_params(station_id), breakers=self.http.breakers)
+        except requests.RequestException as e:
+            print(f"Failed to fetch water temperature: {e}")
+            return self.stale_water_temperature(station_id)
+        data = response.json() if response.status_code == 200 else None
+        if data and "data" in data:
+            self.observation_cache.set(str(station_id), data)
+            return data
+        print(f"Failed to fetch water temperature: {(data or {}).get('error', response.status_code)}")
+        return self.stale_water_temperature(station_id)
+
+    async def fetch_water_temperature_async(self, station_id):
+        cached = await self.observation_cache.get_async(str(station_id))
+        if cached is not None:
+            return cached
+        # Ten people asking about the same site at once share one upstream request
+        refresh = lambda: self.observation_flight.do(str(station_id), lambda: self._fetch_water_temperature_upstream(station_id))
+        if self.http.degraded(WATER_TEMP_URL):
+            stale = await self.stale_water_temperature_async(station_id)
+            if stale is not None:
+                # NOAA has been failing: answer from the last reading now and let the refresh probe it
+                self.in_background(refresh())
+                return stale
+        return await refresh() or await self.stale_water_temperature_async(station_id)
+
+    async def _fetch_water_temperature_upstream(self, station_id):
+        try:
+            data = await self.http.get_json(WATER_TEMP_URL, params=self.water_temperature_params(station_id))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
             print("Failed to fetch water temperature.")
             return None
+        # Stations without a temperature sensor answer 200 with {"error": ...}; that isn't a reading
+        if "data" not in data:
+            print(f"No water temperature for station {station_id}: {data.get('error')}")
+            return None
+        self.observation_cache.set(str(station_id), data)
+        return data
+
+    def stale_water_temperature(self, station_id):
+        """The last good reading, marked stale, or None if there never was one"""
+        stale = self.observation_cache.get_stale(str(station_id))
+        return {**stale, "stale": True} if stale is not None else None
+
+    async def stale_water_temperature_async(self, station_id):
+        stale = await self.observation_cache.get_stale_async(str(station_id))
+        return {**stale, "stale": True} if stale is not None else None
+
+    def water_temperature_stats(self):
+        return {**self.observation_cache.stats(), **self.observation_flight.stats()}
 
     def parse_location(self, input_str):
         words = input_str.split()
@@ -199,7 +633,7 @@ class GetDiveWeather:
         # If we find two words and the second word matches a state abbreviation,
         # return immediately as city and state.
         if len(words) == 2 and words[1].upper() in state_abbreviations:
-            return words[0], state_abbreviations[words[1].upper()]
+            return self.canonical_city(words[0], state_abbreviations[words[1].upper()])
 
         # If we don't find a match using the above, then we iterate through the words.
         # This loop checks for a match against full state names like "New York" or "New Mexico".
@@ -209,29 +643,160 @@ class GetDiveWeather:
             if potential_state in state_abbreviations:
                 city = " ".join(words[:i])
                 state = state_abbreviations[potential_state]
-                return city, state
-            elif potential_state in state_abbreviations.values():
+                return self.canonical_city(city, state)
+            elif potential_state.title() in state_abbreviations.values():
                 city = " ".join(words[:i])
-                state = potential_state
-                return city, state
+                state = potential_state.title()
+                return self.canonical_city(city, state)
 
         # If function hasn't returned by now, then the format wasn't recognized
         raise ValueError("Could not parse location string. Please use a recognized format.")
 
+    def canonical_city(self, city, state):
+        """Swap a partial or misspelled city for the gazetteer's spelling, when we have one"""
+        if self.gazetteer:
+            place = self.gazetteer.resolve(city, self.convert_state_to_abbreviation(state))
+            if place:
+                return place[0].title(), state
+        return city, state
+
+    ##### NWS FORECAST #####
+    def nws_points(self, lat, lon):
+        # ~100 m grid; NWS forecast cells are 2.5 km, so neighbours share a cache entry
+        lat, lon = round(float(lat), 3), round(float(lon), 3)
+        return (lat, lon), f"{BASE_NWS_URL}/points/{lat},{lon}"
+
+    def forecast_url(self, lat, lon):
+        key, points_url = self.nws_points(lat, lon)
+        forecast_url = self.nws_points_cache.get(key)
+        if forecast_url is None:
+            try:
+                response = get_sync(points_url, headers=HEADERS, breakers=self.http.breakers)
+                response.raise_for_status()
+                forecast_url = response.json()['properties']['forecast']
+            except (requests.RequestException, ValueError, KeyError):
+                # The grid cell of a point doesn't move; an expired mapping is still right
+                forecast_url = self.nws_points_cache.get_stale(key)
+                if forecast_url is None:
+                    raise
+                return forecast_url
+            self.nws_points_cache.set(key, forecast_url)
+        return forecast_url
+
+    async def forecast_url_async(self, lat, lon):
+        key, points_url = self.nws_points(lat, lon)
+        forecast_url = await self.nws_points_cache.get_async(key)
+        if forecast_url is not None:
+            return forecast_url
+        return await self.points_flight.do(key, lambda: self._fetch_forecast_url_upstream(key, points_url))
+
+    async def _fetch_forecast_url_upstream(self, key, points_url):
+        try:
+            response = await self.http.get_json(points_url, headers=HEADERS)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            forecast_url = await self.nws_points_cache.get_stale_async(key)
+            if forecast_url is None:
+                raise
+            return forecast_url
+        forecast_url = response['properties']['forecast']
+        self.nws_points_cache.set(key, forecast_url)
+        return forecast_url
+
+    def conditional_headers(self, stale):
+        headers = dict(HEADERS)
+        if stale and stale.get("etag"):
+            headers["If-None-Match"] = stale["etag"]
+        if stale and stale.get("last_modified"):
+            headers["If-Modified-Since"] = stale["last_modified"]
+        return headers
+
+    def cache_forecast(self, forecast_url, stale, status, headers, data):
+        if status == 304 and stale:
+            data = stale["data"]
+        entry = {
+            "data": data,
+            "etag": headers.get("ETag") or (stale or {}).get("etag"),
+            "last_modified": headers.get("Last-Modified") or (stale or {}).get("last_modified"),
+        }
+        self.nws_forecast_cache.set(forecast_url, entry, expires=http_expiry(headers, NWS_FORECAST_TTL))
+        return entry
+
+    def fetch_forecast(self, forecast_url):
+        cached = self.nws_forecast_cache.get(forecast_url)
+        if cached is not None:
+            return cached["data"]
+        # Expired: revalidate with ETag / Last-Modified, a 304 costs no body
+        stale = self.nws_forecast_cache.get_stale(forecast_url)
+        try:
+            response = get_sync(forecast_url, headers=self.conditional_headers(stale), breakers=self.http.breakers)
+            if response.status_code != 304:
+                response.raise_for_status()
+            data = None if response.status_code == 304 else response.json()
+        except (requests.RequestException, ValueError):
+            if stale is None:
+                raise
+            return {**stale["data"], "stale": True}
+        return self.cache_forecast(forecast_url, stale, response.status_code, response.headers, data)["data"]
+
+    async def fetch_forecast_async(self, forecast_url):
+        cached = await self.nws_forecast_cache.get_async(forecast_url)
+        if cached is not None:
+            return cached["data"]
+        stale = await self.nws_forecast_cache.get_stale_async(forecast_url)
+        # The flight carries the cache entry, so a follower in another process can take it from the shared cache
+        revalidate = lambda: self.forecast_flight.do(forecast_url, lambda: self._revalidate_forecast(forecast_url, stale))
+        if stale is not None and self.http.degraded(forecast_url):
+            # api.weather.gov has been failing: serve the last forecast now, revalidate behind it
+            self.in_background(revalidate())
+            return {**stale["data"], "stale": True}
+        try:
+            return (await revalidate())["data"]
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if stale is None:
+                raise
+            return {**stale["data"], "stale": True}
+
+    async def _revalidate_forecast(self, forecast_url, stale):
+        """The new cache entry, after a conditional request (a 304 keeps the stale body)"""
+        status, headers, data = await self.http.get_response(forecast_url, headers=self.conditional_headers(stale))
+        return self.cache_forecast(forecast_url, stale, status, headers, data)
+
+    def stale_forecast(self, lat, lon):
+        """The last forecast for a point's grid cell, rendered and marked stale, or None"""
+        forecast_url = self.nws_points_cache.get_stale(self.nws_points(lat, lon)[0])
+        stale = self.nws_forecast_cache.get_stale(forecast_url) if forecast_url else None
+        return self.format_forecast({**stale["data"], "stale": True}) if stale and stale.get("data") else None
+
+    async def stale_forecast_async(self, lat, lon):
+        forecast_url = await self.nws_points_cache.get_stale_async(self.nws_points(lat, lon)[0])
+        stale = await self.nws_forecast_cache.get_stale_async(forecast_url) if forecast_url else None
+        return self.format_forecast({**stale["data"], "stale": True}) if stale and stale.get("data") else None
+
     def weather(self, city, state):
         lat, lon = self.fetch_lat_long_for_city(city, state)
         if not lat or not lon:
             return "Couldn't find the location."
 
-        points_url = f"{BASE_NWS_URL}/points/{lat},{lon}"
-        response = requests.get(points_url, headers=HEADERS).json()
-        # if response.status_code != 200:
-        #     return "Couldn't find the location or the NWS API is down."
-        
-        
-        forecast_url = response['properties']['forecast']
-        forecast_data = requests.get(forecast_url, headers=HEADERS).json()
+        try:
+            forecast_data = self.fetch_forecast(self.forecast_url(lat, lon))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"NWS forecast for {city}, {state} unavailable: {e}")
+            return f"__**Today's Weather Forecast:**__\nForecast: {DATA_UNAVAILABLE}\n", []
         # print(f"\n{forecast_data}\n")
+        return self.format_forecast(forecast_data)
+
+    async def weather_async(self, city, state):
+        lat, lon = await self.fetch_lat_long_for_city_async(city, state)
+        if not lat or not lon:
+            return "Couldn't find the location."
+
+        return await self.forecast_for_coords_async(lat, lon)
+
+    async def forecast_for_coords_async(self, lat, lon):
+        forecast_data = await self.fetch_forecast_async(await self.forecast_url_async(lat, lon))
+        return self.format_forecast(forecast_data)
+
+    def format_forecast(self, forecast_data):
         today_forecast = forecast_data['properties']['periods'][0]
         extended_forcast = forecast_data['properties']['periods']
         extend = []
@@ -245,23 +810,31 @@ class GetDiveWeather:
             f"Conditions: {today_forecast['shortForecast']}\n"
             f"Forecast: {today_forecast['detailedForecast']}\n"
             )
+        if forecast_data.get("stale"):
+            today += "_api.weather.gov is unavailable; this is the last forecast we received._\n"
 
         return today, extend
 
-    def format_tide_data(self, tide_data, water_temp_data, city, state):
+    def format_tide_data(self, tide_data, water_temp_data, city, state, forecast=None, station_msg=None):
+        # forecast / station_msg are fetched here when the caller hasn't already got them
         now = datetime.utcnow()
         now_est = self.convert_utc_to_est(now)
         output = []
         output.append(f">>> ## __DiveBot Weather Report for {city.capitalize()}, {state.upper()} as of {now_est.strftime('%m/%d/%Y at %I:%M %p')}__\n")
-        output.append(self.weather(city, state)[0])
+        output.append(forecast if forecast is not None else self.weather(city, state)[0])
         
         output.append("__**Oceanic Data for Today:**__")
-        output.append(f"{self.get_nearest_station(city, state)[1]}")
+        output.append(station_msg if station_msg is not None else f"{self.get_nearest_station(city, state)[1]}")
         
         next_tide = None
         today_tides = []
         
-        for prediction in tide_data['predictions']:
+        # tide_data is None when the fetch failed or missed its deadline
+        if tide_data is None:
+            output.append(f"- Tides: {DATA_UNAVAILABLE}")
+        elif tide_data.get("source") == "harmonic":
+            output.append("- Tides: NOAA unavailable, computed locally from harmonic constants")
+        for prediction in (tide_data or {}).get('predictions', []):
             tide_time = datetime.strptime(prediction['t'], '%Y-%m-%d %H:%M')
             if tide_time > now and not next_tide:
                 next_tide = prediction
@@ -275,8 +848,13 @@ class GetDiveWeather:
 
         if water_temp_data:
             water_temp = water_temp_data.get('data', [{}])[0].get('v', None)
-            if water_temp:
+            if water_temp and water_temp_data.get("stale"):
+                read_at = datetime.strptime(water_temp_data['data'][0]['t'], '%Y-%m-%d %H:%M').strftime('%I:%M %p')
+                output.append(f"- Water Temperature: {water_temp}°F (last reading, {read_at}; NOAA unavailable)\n")
+            elif water_temp:
                 output.append(f"- Water Temperature: {water_temp}°F\n")
+        else:
+            output.append(f"- Water Temperature: {DATA_UNAVAILABLE}\n")
 
         output.append("__**Today's Tides:**__")
         for tide in today_tides:
@@ -293,3 +871,10 @@ class GetDiveWeather:
         """Convert state abbreviation to full name if needed"""
         return state_abbreviations.get(state.upper(), state)
 
+    def convert_state_to_abbreviation(self, state):
+        """Convert a full state name to its abbreviation if needed"""
+        for abbreviation, name in state_abbreviations.items():
+            if name.lower() == state.lower():
+                return abbreviation
+        return state.upper()
+